@@ -1,19 +1,80 @@
+import contextvars
+import functools
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser, PydanticOutputParser
 import config
 from llm_client import LLMClient
 from knowledge_base import InterviewKnowledgeBase
+from resilience import LLMUnavailableError
+from claims import split_claims
+from session import format_history
+from telemetry import telemetry
+from tracing import tracer
 from schemas import (
-    FactCheckReport, PsychProfile, MentorStrategy, 
+    ClaimVerdict, FactCheckReport, PsychProfile, MentorStrategy, FusedAnalysis,
     JudgeVerdict, ConversationSummary, FinalDecisionReport
 )
 
+def _traced_run(run):
+    # Каждый run() агента - отдельный спан; при выключенной трассировке это пустой контекст.
+    # Если LLM не ответил к дедлайну или выключен breaker'ом - деградированный ответ агента.
+    @functools.wraps(run)
+    def wrapper(self, context: Dict[str, Any]) -> Any:
+        with tracer.span(f"{self.name}.run", agent=self.name) as span:
+            try:
+                return run(self, context)
+            except LLMUnavailableError as e:
+                result = self.fallback(context)
+                if result is None:
+                    raise
+                telemetry.record("fallback", self.name, reason=str(e))
+                span.set(degraded=True)
+                return result
+    return wrapper
+
+def _merge_facts(facts: str, question_facts: str = None) -> str:
+    # Факты по теме вопроса (prefetch.py) дополняют поиск по ответу: короткий ответ сам по себе ничего не находит
+    if not question_facts:
+        return facts
+    lines = [line for line in question_facts.splitlines() if line.startswith("- ") and line not in facts]
+    if not lines:
+        return facts
+    if not facts.startswith("- "):
+        return "\n".join(lines)
+    return facts + "\n" + "\n".join(lines)
+
+class TruncatedOutputError(LLMUnavailableError):
+    """
+    Структурированный ответ обрезан по max_tokens и после повтора с большим лимитом.
+    """
+
+
+def _truncated(message: Any) -> bool:
+    return getattr(message, "response_metadata", {}).get("finish_reason") == "length"
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_template(template: str) -> ChatPromptTemplate:
+    # Шаблон агента от вызова к вызову один и тот же: разбираем его один раз на процесс
+    return ChatPromptTemplate.from_template(template)
+
 class BaseAgent(ABC):
+    # Имя системного промпта агента в config - статическое начало каждого его вызова
+    PROMPT_SETTING = None
+
     def __init__(self, name: str, client: LLMClient):
         self.name = name
-        self.llm = client.get_llm()
+        self.client = client
+        # Модель по профилю агента (config.AGENT_MODEL_PROFILES) с цепочкой отката
+        self.llm = client.get_llm(name)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "run" in cls.__dict__:
+            cls.run = _traced_run(cls.__dict__["run"])
 
     @abstractmethod
     def run(self, context: Dict[str, Any]) -> Any:
@@ -22,15 +83,74 @@ class BaseAgent(ABC):
         """
         pass
 
+    def fallback(self, context: Dict[str, Any]) -> Any:
+        """
+        Деградированный результат, когда LLM недоступен. None - деградации нет, ошибка пробрасывается.
+        """
+        return None
+
+    def static_prefix(self) -> str:
+        return getattr(config, self.PROMPT_SETTING) if self.PROMPT_SETTING else ""
+
+    def compile(self):
+        """
+        Прогрев при старте (warmup.py): первые разбор и рендер шаблона и схемы парсеров
+        (pydantic строит JSON-схему при первом обращении).
+        """
+        for parser in (getattr(self, "parser", None), getattr(self, "claim_parser", None)):
+            if parser is not None:
+                parser.get_format_instructions()
+        _compile_template(self.static_prefix() + "\n\n{input}").invoke({"input": ""})
+
+    def _invoke(self, template: str, variables: Dict[str, Any], parser=None) -> Any:
+        """
+        То же, что (prompt | llm | parser).invoke(variables), но с отдельными
+        спанами на рендер промпта, вызов LLM и парсинг ответа.
+        """
+        parser = parser or StrOutputParser()
+        with tracer.span("prompt_render", agent=self.name):
+            prompt_value = _compile_template(template).invoke(variables)
+        with tracer.span("llm_call", agent=self.name):
+            message = self.client.invoke(self.name, self.llm, prompt_value)
+        max_tokens = self.client.limits_for(self.name).get("max_tokens")
+        self._account(message, max_tokens)
+        if _truncated(message) and not isinstance(parser, StrOutputParser):
+            # Обрезанный JSON не распарсится: один повтор с большим лимитом, затем деградация (fallback)
+            if max_tokens:
+                max_tokens *= config.TRUNCATION_RETRY_FACTOR
+                with tracer.span("llm_call", agent=self.name, retry="truncated"):
+                    message = self.client.invoke(self.name, self.llm, prompt_value, max_tokens=max_tokens)
+                self._account(message, max_tokens)
+            if _truncated(message):
+                raise TruncatedOutputError(f"{self.name}: structured output cut off at max_tokens={max_tokens}")
+        with tracer.span("parse", agent=self.name):
+            return parser.invoke(message)
+
+    def _account(self, message: Any, max_tokens: int = None):
+        # Сколько ответов упирается в max_tokens - по этой доле подбираются лимиты
+        telemetry.incr("llm_call", self.name)
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            telemetry.incr("prompt_tokens", self.name, usage.get("input_tokens", 0))
+            telemetry.incr("completion_tokens", self.name, usage.get("output_tokens", 0))
+        if _truncated(message):
+            telemetry.record("truncated", self.name, max_tokens=max_tokens)
+
 class FactCheckerAgent(BaseAgent):
+    PROMPT_SETTING = "FACT_CHECKER_PROMPT"
+
     def __init__(self, name: str, client: LLMClient, kb: InterviewKnowledgeBase):
         super().__init__(name, client)
         self.kb = kb
         self.parser = PydanticOutputParser(pydantic_object=FactCheckReport)
+        self.claim_parser = PydanticOutputParser(pydantic_object=ClaimVerdict)
 
     def run(self, context: Dict[str, Any]) -> FactCheckReport:
         user_msg = context.get("user_message", "")
-        facts = self.kb.verify_fact(user_msg)
+        claims = split_claims(user_msg) if config.FACT_CHECK_CLAIMS else []
+        if len(claims) > 1:
+            return self._check_claims(user_msg, claims, context.get("question_facts"))
+        facts = _merge_facts(self.kb.verify_fact(user_msg), context.get("question_facts"))
         
         template = (
             config.FACT_CHECKER_PROMPT + 
@@ -39,17 +159,73 @@ class FactCheckerAgent(BaseAgent):
             "\n\n{format_instructions}"
         )
         
-        prompt = ChatPromptTemplate.from_template(template)
         # Используем json_mode если поддерживается, или полагаемся на инструкции
-        chain = prompt | self.llm | self.parser
-        
-        return chain.invoke({
+        return self._invoke(template, {
             "facts": facts, 
             "user_msg": user_msg,
             "format_instructions": self.parser.get_format_instructions()
-        })
+        }, self.parser)
+
+    def fallback(self, context: Dict[str, Any]) -> FactCheckReport:
+        return FactCheckReport(verdict="OPINION", evidence="Fact-check unavailable (LLM timeout), the claim was not verified.")
+
+    def _check_claims(self, user_msg: str, claims: List[str], question_facts: str = None) -> FactCheckReport:
+        """
+        Длинный ответ: факты для всех утверждений одним запросом к базе, проверки - параллельно,
+        так что латентность близка к одному вызову.
+        """
+        facts = self.kb.verify_facts(claims)
+        with ThreadPoolExecutor(max_workers=len(claims)) as pool:
+            # copy_context переносит в потоки токен отмены сессии и текущий спан трассировки
+            futures = [
+                pool.submit(contextvars.copy_context().run, self._check_claim,
+                            claim, _merge_facts(claim_facts, question_facts), user_msg)
+                for claim, claim_facts in zip(claims, facts)
+            ]
+            verdicts = [future.result() for future in futures]
+        return self._aggregate(verdicts)
+
+    def _check_claim(self, claim: str, facts: str, user_msg: str) -> ClaimVerdict:
+        template = (
+            config.FACT_CHECKER_PROMPT +
+            "\n\nKnown Facts (from Knowledge Base):\n{facts}" +
+            "\n\nFull Candidate Answer (context only):\n{user_msg}" +
+            "\n\nClaim to Verify:\n{claim}" +
+            "\n\n{format_instructions}"
+        )
+        try:
+            verdict = self._invoke(template, {
+                "facts": facts,
+                "user_msg": user_msg,
+                "claim": claim,
+                "format_instructions": self.claim_parser.get_format_instructions()
+            }, self.claim_parser)
+        except LLMUnavailableError as e:
+            # Одно непроверенное утверждение не должно ронять весь отчет
+            telemetry.record("fallback", self.name, reason=str(e))
+            return ClaimVerdict(claim=claim, verdict="OPINION", evidence="Fact-check unavailable (LLM timeout), the claim was not verified.")
+        return ClaimVerdict(**{**verdict.model_dump(), "claim": claim})
+
+    @staticmethod
+    def _aggregate(verdicts: List[ClaimVerdict]) -> FactCheckReport:
+        checked = [v.verdict for v in verdicts if v.verdict != "OPINION"]
+        if not checked:
+            verdict = "OPINION"
+        elif all(v == "TRUE" for v in checked):
+            verdict = "TRUE"
+        elif all(v == "FALSE" for v in checked):
+            verdict = "FALSE"
+        else:
+            verdict = "PARTIALLY TRUE"
+        evidence = " ".join(f"[{i}] {v.verdict}: {v.evidence}" for i, v in enumerate(verdicts, 1))
+        corrections = [f"[{i}] {v.correction}" for i, v in enumerate(verdicts, 1)
+                       if v.correction and v.verdict in ("FALSE", "PARTIALLY TRUE")]
+        return FactCheckReport(verdict=verdict, evidence=evidence, correction=" ".join(corrections) or None,
+                               claims=verdicts)
 
 class PsychologistAgent(BaseAgent):
+    PROMPT_SETTING = "PSYCHOLOGIST_PROMPT"
+
     def __init__(self, name: str, client: LLMClient):
         super().__init__(name, client)
         self.parser = PydanticOutputParser(pydantic_object=PsychProfile)
@@ -63,53 +239,151 @@ class PsychologistAgent(BaseAgent):
             "\n\n{format_instructions}"
         )
         
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | self.llm | self.parser
-        
-        return chain.invoke({
+        return self._invoke(template, {
             "user_msg": user_msg,
             "format_instructions": self.parser.get_format_instructions()
-        })
+        }, self.parser)
+
+    def fallback(self, context: Dict[str, Any]) -> PsychProfile:
+        # Психолог пропущен: нейтральный профиль, Ментор не делает выводов о состоянии кандидата
+        return PsychProfile(emotional_state="Unknown (psychologist skipped: LLM timeout)",
+                            communication_style="Not analyzed", soft_skills=[], stress_markers=[])
 
 class MentorAgent(BaseAgent):
+    PROMPT_SETTING = "MENTOR_PROMPT"
+    HISTORY_WINDOW = 5
+
     def __init__(self, name: str, client: LLMClient):
         super().__init__(name, client)
         self.parser = PydanticOutputParser(pydantic_object=MentorStrategy)
+        # С таблицей навыков (scoreboard.py) всё интервью уже в ней, из истории нужен только конец
+        self.history_window = config.SCOREBOARD_MENTOR_WINDOW if config.SCOREBOARD else self.HISTORY_WINDOW
+
+    def prompt_prefix(self, history: List[Dict[str, str]]) -> str:
+        """
+        Начало промпта следующего вызова, известное до ответа кандидата: после ответа
+        окно истории - это последние history_window - 1 реплик отсюда плюс сам ответ.
+        """
+        return config.MENTOR_PROMPT + "\n\nConversation History:\n" + format_history(history, self.history_window - 1)
+
+    def warm_up(self, prefix: str):
+        self.client.warm_prefix(self.name, prefix)
 
     def run(self, context: Dict[str, Any]) -> MentorStrategy:
         history = context.get("history", [])
         fact_check = context.get("fact_check", "N/A")
         psych_profile = context.get("psych_profile", "N/A")
         
-        formatted_history = "\n".join([f"{turn['role']}: {turn['content']}" for turn in history[-5:]])
+        scoreboard = context.get("scoreboard")
+        formatted_history = format_history(history, self.history_window)
+        prefix = context.get("prompt_prefix")
+        if prefix is not None:
+            # Совпал ли заранее прогретый префикс с реальным промптом (иначе прогрев был впустую)
+            rendered = config.MENTOR_PROMPT + "\n\nConversation History:\n" + formatted_history
+            telemetry.record("prefetch_hit" if rendered.startswith(prefix) else "prefetch_miss", self.name)
         
+        # Таблица идет после истории: прогретый префикс (промпт + история) остается началом промпта
+        scoreboard_part = (
+            "\n\n" + config.MENTOR_SCOREBOARD_PROMPT + "\nCandidate Scoreboard:\n{scoreboard}"
+            if scoreboard is not None else ""
+        )
         template = (
             config.MENTOR_PROMPT + 
             "\n\nConversation History:\n{formatted_history}" +
+            scoreboard_part +
             "\n\nFact-Checker Report:\n{fact_check}" +
             "\n\nPsychologist Report:\n{psych_profile}" +
             "\n\n{format_instructions}"
         )
-        
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | self.llm | self.parser
-        
-        return chain.invoke({
+        variables = {
             "formatted_history": formatted_history,
             "fact_check": str(fact_check), # Конвертируем объект pydantic в строку, если нужно
             "psych_profile": str(psych_profile),
             "format_instructions": self.parser.get_format_instructions()
-        })
+        }
+        if scoreboard is not None:
+            variables["scoreboard"] = str(scoreboard)
+        
+        return self._invoke(template, variables, self.parser)
+
+    def fallback(self, context: Dict[str, Any]) -> MentorStrategy:
+        return MentorStrategy(
+            thought_process="Mentor unavailable (LLM timeout), keeping the current topic.",
+            strategy="Continue the current topic",
+            instruction="Ask the candidate to elaborate on their last answer with a concrete example.",
+            tone="Neutral",
+        )
+
+class FusedAnalystAgent(BaseAgent):
+    """
+    Режим "fused": отчеты Фактчекера, Психолога и стратегия Ментора одним вызовом LLM.
+    """
+    PROMPT_SETTING = "FUSED_ANALYST_PROMPT"
+
+    def __init__(self, name: str, client: LLMClient, kb: InterviewKnowledgeBase):
+        super().__init__(name, client)
+        self.kb = kb
+        self.parser = PydanticOutputParser(pydantic_object=FusedAnalysis)
+
+    def run(self, context: Dict[str, Any]) -> FusedAnalysis:
+        user_msg = context.get("user_message", "")
+        history = context.get("history", [])
+        facts = _merge_facts(self.kb.verify_fact(user_msg), context.get("question_facts"))
+        
+        formatted_history = format_history(history, 5)
+        
+        template = (
+            config.FUSED_ANALYST_PROMPT + 
+            "\n\nKnown Facts (from Knowledge Base):\n{facts}" +
+            "\n\nConversation History:\n{formatted_history}" +
+            "\n\nCandidate Statement:\n{user_msg}" +
+            "\n\n{format_instructions}"
+        )
+        
+        return self._invoke(template, {
+            "facts": facts,
+            "formatted_history": formatted_history,
+            "user_msg": user_msg,
+            "format_instructions": self.parser.get_format_instructions()
+        }, self.parser)
+
+    def fallback(self, context: Dict[str, Any]) -> FusedAnalysis:
+        return FusedAnalysis(
+            fact_check=FactCheckerAgent.fallback(self, context),
+            psych_profile=PsychologistAgent.fallback(self, context),
+            mentor_strategy=MentorAgent.fallback(self, context),
+        )
 
 class InterviewerAgent(BaseAgent):
+    PROMPT_SETTING = "INTERVIEWER_PROMPT"
+
     # Вывод обычной строки подходит для финального ответа, но можно использовать структуру для метрик.
     # Пока оставляем текст, чтобы не усложнять речь.
     def run(self, context: Dict[str, Any]) -> str:
         instruction = context.get("instruction", "")
         history = context.get("history", [])
         tone = context.get("tone", "Neutral")
+        bank_question = context.get("bank_question")
         
-        formatted_history = "\n".join([f"{turn['role']}: {turn['content']}" for turn in history[-5:]])
+        if bank_question:
+            # Вопрос уже выбран из банка (question_bank.py): перефразировать по инструкции Ментора, короткий контекст
+            template = (
+                config.INTERVIEWER_PROMPT +
+                "\n\n" + config.INTERVIEWER_BANK_PROMPT +
+                "\n\nMentor's Instruction: {instruction}" +
+                "\nNext Question: {bank_question}" +
+                "\nMentor's Desired Tone: {tone}" +
+                "\n\nConversation History:\n{formatted_history}" +
+                "\n\nYour Response to Candidate:"
+            )
+            return self._invoke(template, {
+                "instruction": instruction,
+                "bank_question": bank_question,
+                "tone": tone,
+                "formatted_history": format_history(history, 2)
+            })
+        
+        formatted_history = format_history(history, 5)
 
         template = (
             config.INTERVIEWER_PROMPT + 
@@ -119,16 +393,18 @@ class InterviewerAgent(BaseAgent):
             "\n\nYour Response to Candidate:"
         )
 
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | self.llm | StrOutputParser()
-        
-        return chain.invoke({
+        return self._invoke(template, {
             "instruction": instruction,
             "tone": tone,
             "formatted_history": formatted_history
         })
 
+    def fallback(self, context: Dict[str, Any]) -> str:
+        return "Спасибо. Расскажите, пожалуйста, подробнее о вашем последнем ответе, лучше на конкретном примере."
+
 class JudgeAgent(BaseAgent):
+    PROMPT_SETTING = "JUDGE_PROMPT"
+
     def __init__(self, name: str, client: LLMClient):
         super().__init__(name, client)
         self.parser = PydanticOutputParser(pydantic_object=JudgeVerdict)
@@ -138,7 +414,7 @@ class JudgeAgent(BaseAgent):
         instruction = context.get("instruction", "")
         generated_response = context.get("generated_response", "")
         
-        formatted_history = "\n".join([f"{turn['role']}: {turn['content']}" for turn in history[-3:]])
+        formatted_history = format_history(history, 3)
         
         template = (
             config.JUDGE_PROMPT + 
@@ -148,17 +424,20 @@ class JudgeAgent(BaseAgent):
             "\n\n{format_instructions}"
         )
         
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | self.llm | self.parser
-        
-        return chain.invoke({
+        return self._invoke(template, {
             "formatted_history": formatted_history,
             "instruction": instruction,
             "generated_response": generated_response,
             "format_instructions": self.parser.get_format_instructions()
-        })
+        }, self.parser)
+
+    def fallback(self, context: Dict[str, Any]) -> JudgeVerdict:
+        # Судья не успел: ответ пропускается, score 0 не дает политике пропускать следующие проверки
+        return JudgeVerdict(approved=True, feedback="Judge unavailable (LLM timeout), approved without review.", score=0)
 
 class SummarizerAgent(BaseAgent):
+    PROMPT_SETTING = "SUMMARIZER_PROMPT"
+
     def __init__(self, name: str, client: LLMClient):
         super().__init__(name, client)
         self.parser = PydanticOutputParser(pydantic_object=ConversationSummary)
@@ -166,7 +445,7 @@ class SummarizerAgent(BaseAgent):
     def run(self, context: Dict[str, Any]) -> ConversationSummary:
         history = context.get("history", [])
         
-        formatted_history = "\n".join([f"{turn['role']}: {turn['content']}" for turn in history])
+        formatted_history = format_history(history)
         
         template = (
             config.SUMMARIZER_PROMPT + 
@@ -174,21 +453,42 @@ class SummarizerAgent(BaseAgent):
             "\n\n{format_instructions}"
         )
         
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | self.llm | self.parser
-        
-        return chain.invoke({
+        return self._invoke(template, {
             "formatted_history": formatted_history,
             "format_instructions": self.parser.get_format_instructions()
-        })
+        }, self.parser)
+
+    def fallback(self, context: Dict[str, Any]) -> ConversationSummary:
+        # Без LLM - просто последние реплики, обрезанные по длине
+        history = context.get("history", [])
+        summary = " ".join(f"{turn['role']}: {turn['content']}" for turn in history[-4:])
+        return ConversationSummary(summary=summary[-2000:], key_points=[])
 
 class DecisionMakerAgent(BaseAgent):
+    PROMPT_SETTING = "DECISION_MAKER_PROMPT"
+
     def __init__(self, name: str, client: LLMClient):
         super().__init__(name, client)
         self.parser = PydanticOutputParser(pydantic_object=FinalDecisionReport)
 
     def run(self, context: Dict[str, Any]) -> FinalDecisionReport:
         full_log = context.get("full_log", "")
+        scoreboard = context.get("scoreboard")
+        
+        if scoreboard is not None:
+            # Таблица навыков (scoreboard.py) вместо полного лога: промпт не растет с длиной интервью
+            template = (
+                config.DECISION_MAKER_PROMPT +
+                "\n\n" + config.DECISION_MAKER_SCOREBOARD_PROMPT +
+                "\n\nCandidate Scoreboard:\n{scoreboard}" +
+                "\n\nLast Messages:\n{formatted_history}" +
+                "\n\n{format_instructions}"
+            )
+            return self._invoke(template, {
+                "scoreboard": str(scoreboard),
+                "formatted_history": format_history(context.get("history", []), config.SCOREBOARD_DECISION_WINDOW),
+                "format_instructions": self.parser.get_format_instructions()
+            }, self.parser)
         
         template = (
             config.DECISION_MAKER_PROMPT + 
@@ -196,21 +496,26 @@ class DecisionMakerAgent(BaseAgent):
             "\n\n{format_instructions}"
         )
         
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | self.llm | self.parser
-        return chain.invoke({
+        return self._invoke(template, {
             "full_log": full_log,
             "format_instructions": self.parser.get_format_instructions()
-        })
+        }, self.parser)
+
+    def fallback(self, context: Dict[str, Any]) -> FinalDecisionReport:
+        # Без LLM решение считается по таблице навыков; без таблицы деградации нет
+        scoreboard = context.get("scoreboard")
+        return scoreboard.decision() if scoreboard is not None else None
 
 class AgentManager:
-    def __init__(self):
+    def __init__(self, llm_client: LLMClient = None, kb: InterviewKnowledgeBase = None):
+        # Клиент и база знаний можно передать снаружи, чтобы параллельные
+        # сценарии не грузили модель эмбеддингов каждый раз заново.
         self.agents: Dict[str, BaseAgent] = {}
-        self.llm_client = LLMClient()
-        self.kb = InterviewKnowledgeBase()
+        self.llm_client = llm_client or LLMClient()
+        self.kb = kb or InterviewKnowledgeBase()
 
     def register_agent(self, name: str, agent_class: Any):
-        if agent_class == FactCheckerAgent:
+        if agent_class in (FactCheckerAgent, FusedAnalystAgent):
             self.agents[name] = agent_class(name, self.llm_client, self.kb)
         else:
             self.agents[name] = agent_class(name, self.llm_client)
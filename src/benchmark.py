@@ -0,0 +1,455 @@
+"""
+Сквозной бенчмарк хода интервью.
+
+Прогоняет сценарии из scenarios/*.json через run_scenario / run_final_test_scenario
+против локального stub_llm с заданным распределением задержек и считает:
+  - p50/p95/p99 латентности хода,
+  - разбивку времени по агентам,
+  - пропускную способность при N одновременных сессиях,
+  - память на сессию (tracemalloc).
+Результат сохраняется в benchmarks/*.json, два результата можно сравнить через --compare.
+--embeddings сравнивает бэкенды эмбеддингов базы знаний с fp32: латентность запроса,
+память процесса и согласие векторов и поиска на фактах базы.
+
+Примеры:
+    python src/benchmark.py --latency lognormal:-1.6:0.5 --concurrency 1 4 8
+    python src/benchmark.py --compare benchmarks/old.json benchmarks/new.json
+    python src/benchmark.py --embeddings torch-int8 onnx --threads 4
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List
+
+# Если запускаем из корня, добавляем src в путь
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+import config
+from agents import AgentManager
+from llm_client import LLMClient
+from knowledge_base import SEED_FACTS, TOPICS, InterviewKnowledgeBase
+from schemas import ScenarioSpec
+from scenario_engine import get_runner, load_scenarios
+from stub_llm import StubLLMServer, parse_agent_latency
+from telemetry import telemetry
+
+BENCHMARKS_DIR = config.BASE_DIR / "benchmarks"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Перцентиль с линейной интерполяцией, q в диапазоне 0..100.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100.0
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    Сводка по списку длительностей в секундах (в отчете - миллисекунды).
+    """
+    return {
+        "count": len(values),
+        "mean_ms": round(1000 * sum(values) / len(values), 2) if values else 0.0,
+        "p50_ms": round(1000 * percentile(values, 50), 2),
+        "p95_ms": round(1000 * percentile(values, 95), 2),
+        "p99_ms": round(1000 * percentile(values, 99), 2),
+        "max_ms": round(1000 * max(values), 2) if values else 0.0,
+    }
+
+
+class AgentTimings:
+    """
+    Потокобезопасный сборщик длительностей вызовов agent.run по имени агента.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations: Dict[str, List[float]] = {}
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self.durations.setdefault(name, []).append(seconds)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        total = sum(sum(v) for v in self.durations.values()) or 1.0
+        result = {}
+        for name, values in sorted(self.durations.items()):
+            result[name] = summarize(values)
+            result[name]["total_sec"] = round(sum(values), 3)
+            result[name]["share"] = round(sum(values) / total, 3)
+        return result
+
+
+class _TimedAgent:
+    """
+    Прокси над агентом: замеряет run(), остальное отдает как есть.
+    """
+    def __init__(self, agent, timings: AgentTimings):
+        self._agent = agent
+        self._timings = timings
+
+    def run(self, context):
+        started = time.perf_counter()
+        try:
+            return self._agent.run(context)
+        finally:
+            self._timings.record(self._agent.name, time.perf_counter() - started)
+
+    def __getattr__(self, item):
+        return getattr(self._agent, item)
+
+
+class TimingAgentManager(AgentManager):
+    def __init__(self, timings: AgentTimings, **kwargs):
+        super().__init__(**kwargs)
+        self.timings = timings
+
+    def get_agent(self, name: str):
+        agent = super().get_agent(name)
+        return _TimedAgent(agent, self.timings) if agent is not None else None
+
+
+class Benchmark:
+    def __init__(self, scenarios: List[ScenarioSpec], llm_client: LLMClient,
+                 kb: InterviewKnowledgeBase, verbose: bool = False):
+        self.scenarios = scenarios
+        self.llm_client = llm_client
+        self.kb = kb
+        self.verbose = verbose
+        self.log_dir = tempfile.mkdtemp(prefix="interview_bench_")
+
+    def _run_session(self, spec: ScenarioSpec, session_id: str, timings: AgentTimings,
+                     pipeline_mode: str = None) -> Dict[str, Any]:
+        runner = get_runner(spec.runner)
+        manager = TimingAgentManager(timings, llm_client=self.llm_client, kb=self.kb)
+        return runner(session_id, spec.participant_name, spec.inputs, manager=manager, log_dir=self.log_dir,
+                      pipeline_mode=pipeline_mode or spec.pipeline_mode)
+
+    def _quiet(self):
+        # Сценарии много печатают - в бенчмарке это только шум
+        return contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    def measure_latency(self) -> Dict[str, Any]:
+        """
+        Одна сессия за раз: чистая латентность хода и разбивка по агентам.
+        """
+        timings = AgentTimings()
+        turns: List[float] = []
+        with self._quiet():
+            for spec in self.scenarios:
+                turns.extend(self._run_session(spec, f"{spec.id}_latency", timings)["turn_latencies"])
+        return {"turn_latency": summarize(turns), "agents": timings.report()}
+
+    def measure_throughput(self, sessions: int) -> Dict[str, Any]:
+        """
+        sessions одновременных сессий (сценарии берутся по кругу).
+        """
+        timings = AgentTimings()
+        specs = [self.scenarios[i % len(self.scenarios)] for i in range(sessions)]
+        started = time.perf_counter()
+        with self._quiet(), ThreadPoolExecutor(max_workers=sessions) as pool:
+            futures = [pool.submit(self._run_session, spec, f"{spec.id}_c{sessions}_{i}", timings)
+                       for i, spec in enumerate(specs)]
+            turns = [t for f in futures for t in f.result()["turn_latencies"]]
+        wall = time.perf_counter() - started
+        return {
+            "sessions": sessions,
+            "turns": len(turns),
+            "wall_sec": round(wall, 3),
+            "turns_per_sec": round(len(turns) / wall, 3) if wall else 0.0,
+            "turn_latency": summarize(turns),
+        }
+
+    def compare_modes(self) -> Dict[str, Any]:
+        """
+        Один и тот же набор сценариев в режимах "multi" и "fused":
+        латентность хода, число LLM-вызовов на ход и согласие вердиктов по ходам.
+        """
+        outputs: Dict[str, List[Dict[str, Any]]] = {}
+        result: Dict[str, Any] = {}
+        def turn_calls() -> int:
+            # LLM-запросы из _invoke (счетчик llm_call), а не вызовы run(): проверка по утверждениям
+            # и повторы Судьи делают несколько запросов за один run()
+            return telemetry.count("llm_call") - telemetry.count("llm_call", "DecisionMaker")
+
+        for mode in ("multi", "fused"):
+            timings = AgentTimings()
+            calls_before = turn_calls()
+            with self._quiet():
+                outputs[mode] = [self._run_session(spec, f"{spec.id}_{mode}", timings, pipeline_mode=mode)
+                                 for spec in self.scenarios]
+            turns = [t for out in outputs[mode] for t in out["turn_latencies"]]
+            calls = turn_calls() - calls_before
+            result[mode] = {
+                "turn_latency": summarize(turns),
+                "llm_calls_per_turn": round(calls / len(turns), 2) if turns else 0.0,
+                "agents": timings.report(),
+            }
+
+        pairs = [(a, b) for multi, fused in zip(outputs["multi"], outputs["fused"])
+                 for a, b in zip(multi["turn_reports"], fused["turn_reports"])]
+        decisions = [(m["final_decision"], f["final_decision"]) for m, f in zip(outputs["multi"], outputs["fused"])]
+
+        def share(matches: List[bool]) -> float:
+            return round(sum(matches) / len(matches), 3) if matches else 0.0
+
+        result["agreement"] = {
+            "turns_compared": len(pairs),
+            "fact_verdict": share([a["fact_verdict"] == b["fact_verdict"] for a, b in pairs]),
+            "tone": share([a["tone"] == b["tone"] for a, b in pairs]),
+            "interview_status": share([a["interview_status"] == b["interview_status"] for a, b in pairs]),
+            "final_level": share([a.level == b.level for a, b in decisions]),
+            "final_recommendation": share([a.hiring_recommendation == b.hiring_recommendation for a, b in decisions]),
+        }
+        return result
+
+    def measure_memory(self) -> Dict[str, Any]:
+        """
+        Память Python-аллокаций одной сессии (модель и БЗ уже загружены и не учитываются).
+        """
+        spec = self.scenarios[0]
+        tracemalloc.start()
+        try:
+            baseline, _ = tracemalloc.get_traced_memory()
+            with self._quiet():
+                self._run_session(spec, f"{spec.id}_memory", AgentTimings())
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            "scenario": spec.id,
+            "session_peak_kb": round((peak - baseline) / 1024, 1),
+            "session_retained_kb": round((current - baseline) / 1024, 1),
+            # ru_maxrss в Linux - в килобайтах
+            "process_max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def _embedding_run(backend: str, texts: List[str], queries: List[str], threads: int, repeats: int) -> Dict[str, Any]:
+    """
+    Выполняется в отдельном процессе, чтобы ru_maxrss относился только к этому бэкенду.
+    """
+    from embeddings import make_embeddings
+
+    started = time.perf_counter()
+    embeddings = make_embeddings(backend, threads=threads)
+    load_sec = time.perf_counter() - started
+    doc_vectors = embeddings.embed_documents(texts)
+    embeddings.embed_query(queries[0])  # прогрев
+    latencies = []
+    for _ in range(repeats):
+        for query in queries:
+            started = time.perf_counter()
+            embeddings.embed_query(query)
+            latencies.append(time.perf_counter() - started)
+    return {
+        "load_sec": round(load_sec, 2),
+        "query_latency": summarize(latencies),
+        "process_max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "doc_vectors": [list(map(float, v)) for v in doc_vectors],
+        "query_vectors": [list(map(float, embeddings.embed_query(q))) for q in queries],
+    }
+
+
+def _cos(a: List[float], b: List[float]) -> float:
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return sum(x * y for x, y in zip(a, b)) / norm if norm else 0.0
+
+
+def compare_embeddings(backends: List[str], threads: int = 0, repeats: int = 5, k: int = 2) -> Dict[str, Any]:
+    """
+    Бэкенды эмбеддингов против fp32 "torch" на фактах и вопросах базы знаний:
+    латентность embed_query, пиковая память процесса, косинус к fp32-векторам
+    и совпадение top-k фактов при поиске.
+    """
+    texts = [text for _, text in SEED_FACTS]
+    queries = [q for levels in TOPICS.values() for level in levels.values() for q in level]
+    backends = ["torch"] + [b for b in backends if b != "torch"]
+    runs = {}
+    for backend in backends:
+        # spawn: чистый процесс на бэкенд, память не смешивается
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            runs[backend] = pool.submit(_embedding_run, backend, texts, queries, threads, repeats).result()
+
+    def top_k(query_vectors: List[List[float]], doc_vectors: List[List[float]]) -> List[List[int]]:
+        return [sorted(range(len(doc_vectors)), key=lambda i: -_cos(q, doc_vectors[i]))[:k] for q in query_vectors]
+
+    base = runs["torch"]
+    base_top = top_k(base["query_vectors"], base["doc_vectors"])
+    result: Dict[str, Any] = {"facts": len(texts), "queries": len(queries), "threads": threads, "backends": {}}
+    for backend, run in runs.items():
+        found = top_k(run["query_vectors"], run["doc_vectors"])
+        similarity = [_cos(a, b) for a, b in zip(run["doc_vectors"], base["doc_vectors"])]
+        result["backends"][backend] = {
+            "load_sec": run["load_sec"],
+            "query_latency": run["query_latency"],
+            "process_max_rss_mb": run["process_max_rss_mb"],
+            "mean_cosine_to_fp32": round(sum(similarity) / len(similarity), 4),
+            "min_cosine_to_fp32": round(min(similarity), 4),
+            f"top{k}_overlap": round(sum(len(set(a) & set(b)) for a, b in zip(found, base_top)) / (k * len(queries)), 3),
+            "top1_match": round(sum(a[0] == b[0] for a, b in zip(found, base_top)) / len(queries), 3),
+        }
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(config.BASE_DIR),
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(old_path: str, new_path: str):
+    """
+    Печатает разницу между двумя JSON-результатами бенчмарка.
+    """
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    def delta(a: float, b: float) -> str:
+        pct = f" ({(b - a) / a * 100:+.1f}%)" if a else ""
+        return f"{a:.1f} -> {b:.1f}{pct}"
+
+    print(f"Base: {old['meta']['commit']}  New: {new['meta']['commit']}")
+    print("\nTurn latency (ms):")
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        print(f"  {key:8} {delta(old['turn_latency'][key], new['turn_latency'][key])}")
+    print("\nPer-agent mean (ms):")
+    for name in sorted(set(old["agents"]) | set(new["agents"])):
+        a = old["agents"].get(name, {}).get("mean_ms", 0.0)
+        b = new["agents"].get(name, {}).get("mean_ms", 0.0)
+        print(f"  {name:14} {delta(a, b)}")
+    print("\nThroughput (turns/sec):")
+    old_tp = {r["sessions"]: r for r in old["throughput"]}
+    for row in new["throughput"]:
+        base = old_tp.get(row["sessions"])
+        if base:
+            print(f"  N={row['sessions']:<4} {delta(base['turns_per_sec'], row['turns_per_sec'])}")
+    print("\nSession peak memory (KB): "
+          f"{delta(old['memory']['session_peak_kb'], new['memory']['session_peak_kb'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the interview turn pipeline.")
+    parser.add_argument("--only", nargs="*", help="Scenario ids (default: all).")
+    parser.add_argument("--latency", default="lognormal:-1.6:0.5",
+                        help="Stub latency distribution (see stub_llm.LatencyModel).")
+    parser.add_argument("--agent-latency", nargs="*", default=[], metavar="AGENT=SPEC")
+    parser.add_argument("--base-url", help="Benchmark a real OpenAI-compatible endpoint instead of the stub.")
+    parser.add_argument("--concurrency", nargs="*", type=int, default=[1, 4, 8])
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/bench_<time>_<commit>.json).")
+    parser.add_argument("--compare-modes", action="store_true",
+                        help="Also run every scenario in multi and fused pipeline modes and compare them.")
+    parser.add_argument("--verbose", action="store_true", help="Keep scenario output.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two result files and exit.")
+    parser.add_argument("--embeddings", nargs="+", metavar="BACKEND",
+                        help="Compare embedding backends (torch-int8, onnx) with fp32 torch and exit.")
+    parser.add_argument("--threads", type=int, default=0, help="CPU threads for --embeddings (0 - library default).")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.embeddings:
+        result = compare_embeddings(args.embeddings, threads=args.threads)
+        result["meta"] = {"commit": _git_commit(), "timestamp": datetime.now().isoformat(),
+                          "python": platform.python_version()}
+        os.makedirs(BENCHMARKS_DIR, exist_ok=True)
+        output = args.output or str(BENCHMARKS_DIR / f"embeddings_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        for backend, stats in result["backends"].items():
+            lat = stats["query_latency"]
+            print(f"  {backend:11} query p50 {lat['p50_ms']} ms, p95 {lat['p95_ms']} ms, "
+                  f"RSS {stats['process_max_rss_mb']} MB, cos {stats['mean_cosine_to_fp32']}, "
+                  f"top1 {stats['top1_match']}, top2 {stats['top2_overlap']}")
+        print(f"Saved to {output}")
+        return
+
+    scenarios = load_scenarios(only=args.only)
+    stub = None
+    if args.base_url:
+        llm_client = LLMClient(base_url=args.base_url)
+    else:
+        stub = StubLLMServer(latency=args.latency, agent_latency=parse_agent_latency(args.agent_latency)).start()
+        llm_client = LLMClient(base_url=stub.base_url, api_key="stub", model="stub")
+
+    try:
+        kb = InterviewKnowledgeBase()
+        bench = Benchmark(scenarios, llm_client, kb, verbose=args.verbose)
+        print(f"Benchmarking {len(scenarios)} scenarios...")
+        result: Dict[str, Any] = {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "endpoint": args.base_url or "stub",
+                "latency": None if args.base_url else args.latency,
+                "agent_latency": parse_agent_latency(args.agent_latency),
+                "scenarios": [s.id for s in scenarios],
+            }
+        }
+        result.update(bench.measure_latency())
+        result["throughput"] = [bench.measure_throughput(n) for n in args.concurrency]
+        result["memory"] = bench.measure_memory()
+        if args.compare_modes:
+            result["mode_comparison"] = bench.compare_modes()
+        # Сколько было таймаутов, hedge-запросов, деградаций и обрезок по max_tokens за весь прогон
+        snapshot = telemetry.snapshot()
+        result["llm_events"] = snapshot["counters"]
+        result["truncation_rate"] = snapshot["truncation_rate"]
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    output = args.output
+    if not output:
+        os.makedirs(BENCHMARKS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = str(BENCHMARKS_DIR / f"bench_{stamp}_{result['meta']['commit']}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    tl = result["turn_latency"]
+    print(f"Turn latency: p50 {tl['p50_ms']} ms, p95 {tl['p95_ms']} ms, p99 {tl['p99_ms']} ms ({tl['count']} turns)")
+    for name, stats in result["agents"].items():
+        print(f"  {name:14} mean {stats['mean_ms']:8.1f} ms  share {stats['share'] * 100:5.1f}%")
+    for row in result["throughput"]:
+        print(f"  N={row['sessions']:<4} {row['turns_per_sec']} turns/sec, p95 {row['turn_latency']['p95_ms']} ms")
+    print(f"Session memory: peak {result['memory']['session_peak_kb']} KB")
+    if "mode_comparison" in result:
+        mc = result["mode_comparison"]
+        for mode in ("multi", "fused"):
+            print(f"  {mode:6} p50 {mc[mode]['turn_latency']['p50_ms']} ms, "
+                  f"p95 {mc[mode]['turn_latency']['p95_ms']} ms, {mc[mode]['llm_calls_per_turn']} LLM calls/turn")
+        print(f"  Agreement: {mc['agreement']}")
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Кооперативная отмена работы сессии.
+
+CancelToken - флаг отмены на сессию (или на ее часть через child()). Токен текущего
+потока задается cancel_scope(); ResilientCaller проверяет его перед LLM-вызовом и
+при отмене снимает задачу в event loop - HTTP-запрос обрывается, слот конкурентности
+освобождается. Фоновые задачи (например, суммаризация) запускаются через
+run_in_background() со своим токеном и отменяются вместе с ним.
+"""
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional
+
+import config
+from telemetry import telemetry
+
+
+class SessionCancelled(RuntimeError):
+    """
+    Работа отменена: кандидат остановил интервью, отключился или сессия закрыта.
+    """
+
+
+class CancelToken:
+    def __init__(self, name: str = "", parent: "CancelToken" = None):
+        self.name = name
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], Any]] = []
+        if parent is not None:
+            parent.on_cancel(lambda: self.cancel(parent.reason))
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        telemetry.record("session_cancelled", self.name or None, reason=reason)
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], Any]) -> Callable[[], None]:
+        """
+        Регистрирует callback; если токен уже отменен - вызывает сразу.
+        Возвращает функцию, снимающую регистрацию.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], Any]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise SessionCancelled(f"{self.name or 'session'}: {self.reason}")
+
+    def child(self, name: str = "") -> "CancelToken":
+        """
+        Токен части работы сессии: отменяется вместе с родителем, но может быть отменен отдельно.
+        """
+        return CancelToken(name or self.name, parent=self)
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("cancel_token", default=None)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current.get()
+
+
+@contextmanager
+def cancel_scope(token: CancelToken):
+    """
+    Делает token текущим. Если блок прерван исключением (Ctrl+C, обрыв соединения, ошибка),
+    токен отменяется - незавершенные LLM-запросы и фоновые задачи сессии снимаются.
+    """
+    reset = _current.set(token)
+    try:
+        yield token
+    except BaseException as e:
+        token.cancel(type(e).__name__)
+        raise
+    finally:
+        _current.reset(reset)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def run_in_background(fn: Callable[..., Any], *args: Any, token: CancelToken) -> Future:
+    """
+    fn(*args) в фоновом пуле под token. Отмена токена убирает задачу из очереди,
+    а уже идущую прерывает на ближайшем LLM-вызове (SessionCancelled в future).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.BACKGROUND_WORKERS, thread_name_prefix="background")
+
+    def task():
+        token.raise_if_cancelled()
+        with cancel_scope(token):
+            return fn(*args)
+
+    # Копия контекста: задача видит текущий спан трассировки (и остальные contextvars) вызывающего
+    future = _executor.submit(contextvars.copy_context().run, task)
+    unregister = token.on_cancel(future.cancel)
+    future.add_done_callback(lambda _: unregister())
+    return future
@@ -0,0 +1,203 @@
+"""
+Чекпоинты сессии интервью на локальном диске (checkpoints/<session_id>.*).
+
+  <id>.journal - JSONL, одна строка на ход: только новые реплики, сжатие истории
+                 и запись лога этого хода. Стоимость записи ограничена размером хода.
+  <id>.json    - снапшот ограниченной части состояния (окно истории после сжатия, extra,
+                 номер хода), пишется атомарно (временный файл + os.replace)
+                 раз в CHECKPOINT_SNAPSHOT_EVERY ходов; после него журнал начинается заново.
+  <id>.log     - JSONL, только дописывается: полный лог диалога и записи лога ходов,
+                 по строке на снапшот (то, что добавилось с прошлого). Снапшот хранит,
+                 сколько записей лога он покрывает, поэтому стоимость снапшота не растет с длиной интервью.
+Восстановление: снапшот + его часть <id>.log + строки журнала после него. Недописанная последняя строка
+журнала (процесс упал во время записи) пропускается, лишний хвост <id>.log (упали между дозаписью
+лога и снапшотом) обрезается. После завершения сессии файлы удаляются.
+
+Интерактивные сессии main.py получают префикс INTERACTIVE_PREFIX: по нему --resume без id
+ищет последнюю сессию и не подхватывает чекпоинты сценариев и финального теста.
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import config
+from session import Transcript
+
+INTERACTIVE_PREFIX = "interview_"
+
+
+class SessionState:
+    """
+    Восстановленное состояние цикла ходов.
+    """
+    def __init__(self, session_id: str, turn: int = 0, transcript: Transcript = None,
+                 log_turns: List[Dict[str, Any]] = None, extra: Dict[str, Any] = None):
+        self.session_id = session_id
+        self.turn = turn
+        self.transcript = transcript if transcript is not None else Transcript()
+        self.log_turns = log_turns or []
+        self.extra = extra or {}
+
+
+class SessionCheckpoint:
+    def __init__(self, session_id: str, directory: str = None, enabled: bool = None, snapshot_every: int = None):
+        self.session_id = session_id
+        self.enabled = config.CHECKPOINTS_ENABLED if enabled is None else enabled
+        self.snapshot_every = config.CHECKPOINT_SNAPSHOT_EVERY if snapshot_every is None else snapshot_every
+        directory = directory or str(config.CHECKPOINT_DIR)
+        self.snapshot_path = os.path.join(directory, f"{session_id}.json")
+        self.journal_path = os.path.join(directory, f"{session_id}.journal")
+        self.log_path = os.path.join(directory, f"{session_id}.log")
+        self._since_snapshot = 0
+        # Сколько (строк лога диалога, записей лога ходов) уже в <id>.log; None - неизвестно,
+        # следующий снапшот перепишет файл целиком (новый объект поверх чужих файлов)
+        self._logged = (0, 0) if not os.path.exists(self.log_path) else None
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def record_turn(self, state: SessionState, messages: List[List[str]], log_turn: Dict[str, Any] = None,
+                    compact: Dict[str, Any] = None, extra: Dict[str, Any] = None):
+        """
+        Вызывается в конце хода, когда state уже обновлен. messages - новые реплики хода
+        [[role, content], ...], compact - {"summary", "keep"}, если история сжималась перед ними.
+        """
+        if not self.enabled:
+            return
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot(state)
+            return
+        entry = {"turn": state.turn, "messages": messages, "log_turn": log_turn, "compact": compact,
+                 "extra": extra or {}}
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            if config.CHECKPOINT_FSYNC:
+                os.fsync(f.fileno())
+
+    def snapshot(self, state: SessionState):
+        if not self.enabled:
+            return
+        transcript = state.transcript
+        logged = (transcript.log_size, len(state.log_turns))
+        if self._logged is not None and self._logged[0] <= logged[0] and self._logged[1] <= logged[1]:
+            # Дописываем только то, что появилось с прошлого снапшота
+            self._append_log(transcript.log_tail(self._logged[0]), state.log_turns[self._logged[1]:])
+        else:
+            self._rewrite_log(transcript.log_tail(0), state.log_turns)
+        self._logged = logged
+        data = {
+            "session_id": state.session_id,
+            "turn": state.turn,
+            "transcript": transcript.to_state(with_log=False),
+            "logged": list(logged),
+            "extra": state.extra,
+        }
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            if config.CHECKPOINT_FSYNC:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Упадем между replace и очисткой журнала - при чтении старые строки отсеются по номеру хода
+        open(self.journal_path, "w").close()
+        self._since_snapshot = 0
+
+    def _append_log(self, lines: List[str], log_turns: List[Dict[str, Any]]):
+        if not lines and not log_turns:
+            return
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"lines": lines, "log_turns": log_turns}, ensure_ascii=False) + "\n")
+            f.flush()
+            if config.CHECKPOINT_FSYNC:
+                os.fsync(f.fileno())
+
+    def _rewrite_log(self, lines: List[str], log_turns: List[Dict[str, Any]]):
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"lines": lines, "log_turns": log_turns}, ensure_ascii=False) + "\n")
+            f.flush()
+            if config.CHECKPOINT_FSYNC:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.log_path)
+
+    def _read_log(self, logged: List[int]):
+        """
+        Первые logged = [строк, записей] из <id>.log; хвост сверх них (не покрыт снапшотом) обрезается.
+        """
+        lines, log_turns = [], []
+        if not os.path.exists(self.log_path):
+            return lines, log_turns
+        offset = 0
+        with open(self.log_path, "rb") as f:
+            for raw in f:
+                if len(lines) >= logged[0] and len(log_turns) >= logged[1]:
+                    break
+                try:
+                    entry = json.loads(raw)
+                except json.JSONDecodeError:
+                    break
+                lines.extend(entry["lines"])
+                log_turns.extend(entry["log_turns"])
+                offset += len(raw)
+        if os.path.getsize(self.log_path) > offset:
+            os.truncate(self.log_path, offset)
+        return lines[:logged[0]], log_turns[:logged[1]]
+
+    def load(self) -> Optional[SessionState]:
+        if not os.path.exists(self.snapshot_path) and not os.path.exists(self.journal_path):
+            return None
+        state = SessionState(self.session_id)
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            lines, log_turns = self._read_log(data["logged"])
+            state = SessionState(self.session_id, turn=data["turn"],
+                                 transcript=Transcript.from_state({**data["transcript"], "log": lines}),
+                                 log_turns=log_turns, extra=data["extra"])
+            self._logged = (len(lines), len(log_turns))
+        elif os.path.exists(self.log_path):
+            # Снапшота нет - лог от него тоже не нужен
+            os.truncate(self.log_path, 0)
+            self._logged = (0, 0)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    if entry["turn"] <= state.turn:
+                        continue
+                    if entry.get("compact"):
+                        state.transcript.compact(entry["compact"]["summary"], entry["compact"]["keep"])
+                    for role, content in entry["messages"]:
+                        state.transcript.append(role, content)
+                    if entry.get("log_turn"):
+                        state.log_turns.append(entry["log_turn"])
+                    state.extra.update(entry.get("extra") or {})
+                    state.turn = entry["turn"]
+        return state
+
+    def clear(self):
+        for path in (self.snapshot_path, self.journal_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._logged = (0, 0)
+        self._since_snapshot = 0
+
+
+def latest_session_id(directory: str = None, prefix: str = INTERACTIVE_PREFIX) -> Optional[str]:
+    """
+    Самая свежая незавершенная сессия с префиксом prefix (для main.py --resume без id).
+    """
+    directory = directory or str(config.CHECKPOINT_DIR)
+    if not os.path.isdir(directory):
+        return None
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+             if name.startswith(prefix) and name.endswith((".json", ".journal"))]
+    if not paths:
+        return None
+    latest = max(paths, key=os.path.getmtime)
+    return os.path.splitext(os.path.basename(latest))[0]
@@ -0,0 +1,59 @@
+"""
+Локальное разбиение ответа кандидата на отдельные утверждения для Фактчекера.
+
+Без LLM: предложения по знакам конца предложения и переносам строк, вопросы,
+короткие реплики ("Стоп интервью.", "Да.") и предложения без технического термина
+или числа ("Я люблю работать в команде.") отбрасываются - их проверять нечего, и ответ
+про soft skills остается одним вызовом Фактчекера. Если утверждений больше
+FACT_CHECK_MAX_CLAIMS, последние склеиваются в одно и проверяются одним вызовом, а не теряются.
+"""
+import re
+from typing import List
+
+import config
+
+# Конец предложения: ., !, ?, ; перед заглавной буквой (в т.ч. без пробела: "Developer .У меня"),
+# чтобы не резать сокращения вроде "e.g." и "т.е."
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?;])\s*(?=[A-ZА-ЯЁ«\"(])|\n+")
+_WORD_RE = re.compile(r"[\w+#-]+", re.UNICODE)
+# Признаки технического утверждения: число, код (snake_case, a.b, f(), CamelCase), латиница в русском тексте
+_CODE_RE = re.compile(r"\d|\w_\w|\w\.\w|\w\(|[a-z][A-Z]")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+_CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+# Основы технических терминов (сравнение по началу слова)
+TECH_STEMS = (
+    "python", "sql", "gil", "thread", "process", "index", "join", "transaction", "query", "database",
+    "table", "key", "list", "dict", "tuple", "set", "class", "object", "method", "function", "decorator",
+    "generator", "iterator", "async", "await", "coroutine", "lock", "mutex", "memory", "garbage", "cache",
+    "hash", "algorithm", "complexity", "api", "http", "rest", "exception", "inherit", "metaclass", "orm",
+    "поток", "процесс", "индекс", "транзакц", "запрос", "баз", "таблиц", "ключ", "спис", "словар", "кортеж",
+    "множеств", "класс", "объект", "метод", "функци", "декоратор", "генератор", "итератор", "корутин",
+    "асинхрон", "блокировк", "памят", "сборщик", "кэш", "хеш", "хэш", "алгоритм", "сложност", "исключени",
+    "наследован", "метакласс", "переменн", "тип", "модул", "библиотек",
+)
+
+
+def is_technical(sentence: str) -> bool:
+    if _CODE_RE.search(sentence):
+        return True
+    if _CYRILLIC_RE.search(sentence) and _LATIN_RE.search(sentence):
+        return True
+    words = [w.lower() for w in _WORD_RE.findall(sentence)]
+    return any(w.startswith(TECH_STEMS) for w in words)
+
+
+def split_claims(text: str, max_claims: int = None, min_words: int = None) -> List[str]:
+    max_claims = config.FACT_CHECK_MAX_CLAIMS if max_claims is None else max_claims
+    min_words = config.CLAIM_MIN_WORDS if min_words is None else min_words
+    claims = []
+    for sentence in _SENTENCE_END_RE.split(text or ""):
+        sentence = sentence.strip()
+        if not sentence or sentence.endswith("?"):
+            continue
+        if len(_WORD_RE.findall(sentence)) < min_words or not is_technical(sentence):
+            continue
+        claims.append(sentence)
+    if max_claims > 0 and len(claims) > max_claims:
+        # Хвост ответа - одно утверждение на одну проверку: число вызовов ограничено, но ничего не выпадает
+        claims = claims[:max_claims - 1] + [" ".join(claims[max_claims - 1:])]
+    return claims
@@ -13,6 +13,247 @@ QWEN_API_KEY = os.getenv("QWEN_API_KEY", "sk-dummy-key")
 QWEN_BASE_URL = os.getenv("QWEN_BASE_URL", "http://10.109.50.250:8880/v1")
 QWEN_MODEL_NAME = os.getenv("QWEN_MODEL_NAME", "/app/models/Qwen3VL-32B-Instruct-Q8_0.gguf")
 
+# Профили моделей (llm_client.py). "large" - основная 32B модель, "small" - быстрая модель
+# для классификационных агентов. По умолчанию "small" смотрит на тот же сервер, пока
+# не заданы SMALL_MODEL_*. Профиль "fallback" появляется, если задан FALLBACK_BASE_URL.
+MODEL_PROFILES = {
+    "large": {
+        "base_url": QWEN_BASE_URL,
+        "api_key": QWEN_API_KEY,
+        "model": QWEN_MODEL_NAME,
+        "temperature": 0.7,
+        "max_tokens": None,
+        "timeout": float(os.getenv("LARGE_MODEL_TIMEOUT", "120")),
+        "max_retries": 2,
+    },
+    "small": {
+        "base_url": os.getenv("SMALL_MODEL_BASE_URL", QWEN_BASE_URL),
+        "api_key": os.getenv("SMALL_MODEL_API_KEY", QWEN_API_KEY),
+        "model": os.getenv("SMALL_MODEL_NAME", QWEN_MODEL_NAME),
+        "temperature": float(os.getenv("SMALL_MODEL_TEMPERATURE", "0.7")),
+        "max_tokens": None,
+        "timeout": float(os.getenv("SMALL_MODEL_TIMEOUT", "30")),
+        "max_retries": 1,
+    },
+}
+if os.getenv("FALLBACK_BASE_URL"):
+    MODEL_PROFILES["fallback"] = {
+        "base_url": os.getenv("FALLBACK_BASE_URL"),
+        "api_key": os.getenv("FALLBACK_API_KEY", QWEN_API_KEY),
+        "model": os.getenv("FALLBACK_MODEL_NAME", QWEN_MODEL_NAME),
+        "temperature": 0.7,
+        "max_tokens": None,
+        "timeout": float(os.getenv("FALLBACK_MODEL_TIMEOUT", "120")),
+        "max_retries": 1,
+    }
+
+# Какой профиль у какого агента (имя агента - как в register_agent)
+AGENT_MODEL_PROFILES = {
+    "FactChecker": "small",
+    "Psychologist": "small",
+    "Judge": "small",
+    "Summarizer": "small",
+    "Mentor": "large",
+    "FusedAnalyst": "large",
+    "Interviewer": "large",
+    "DecisionMaker": "large",
+}
+
+# Цепочки отката при перегрузке/недоступности endpoint'а: профиль -> следующие профили
+MODEL_FALLBACKS = {
+    "small": ["large", "fallback"],
+    "large": ["fallback"],
+}
+
+# JSON-файл, переопределяющий всё выше: {"profiles": {...}, "agents": {...}, "fallbacks": {...}}
+MODEL_PROFILES_FILE = os.getenv("MODEL_PROFILES_FILE")
+
+# Бюджет генерации по агентам: max_tokens и stop-последовательности (переопределяют max_tokens профиля).
+# Время декодирования растет линейно с длиной ответа, поэтому лимиты делают латентность хода предсказуемой.
+# Лимиты структурированных агентов покрывают максимум их схемы (сумма max_length полей, ~3.5 символа на токен).
+GENERATION_LIMITS_ENABLED = os.getenv("GENERATION_LIMITS", "1") == "1"
+# Обрезанный JSON повторяется один раз с лимитом x TRUNCATION_RETRY_FACTOR, затем агент отдает fallback
+TRUNCATION_RETRY_FACTOR = int(os.getenv("TRUNCATION_RETRY_FACTOR", "2"))
+AGENT_GENERATION_LIMITS = {
+    "FactChecker": {"max_tokens": int(os.getenv("FACT_CHECKER_MAX_TOKENS", "400"))},
+    "Psychologist": {"max_tokens": int(os.getenv("PSYCHOLOGIST_MAX_TOKENS", "450"))},
+    "Judge": {"max_tokens": int(os.getenv("JUDGE_MAX_TOKENS", "250"))},
+    "Summarizer": {"max_tokens": int(os.getenv("SUMMARIZER_MAX_TOKENS", "1000"))},
+    "Mentor": {"max_tokens": int(os.getenv("MENTOR_MAX_TOKENS", "700"))},
+    "FusedAnalyst": {"max_tokens": int(os.getenv("FUSED_ANALYST_MAX_TOKENS", "1400"))},
+    # Интервьюер пишет одну реплику: не даем ему продолжить диалог за кандидата
+    "Interviewer": {"max_tokens": int(os.getenv("INTERVIEWER_MAX_TOKENS", "300")),
+                    "stop": ["\nCandidate:", "\nКандидат:", "\nInterviewer:", "\nИнтервьюер:"]},
+    "DecisionMaker": {"max_tokens": int(os.getenv("DECISION_MAKER_MAX_TOKENS", "1500"))},
+}
+
+# Хвостовая латентность LLM-вызовов (resilience.py)
+# Дедлайн на один вызов агента, секунды (включая hedge-дубликат и цепочку отката)
+AGENT_DEADLINES = {
+    "FactChecker": float(os.getenv("FACT_CHECKER_DEADLINE", "30")),
+    "Psychologist": float(os.getenv("PSYCHOLOGIST_DEADLINE", "30")),
+    "Judge": float(os.getenv("JUDGE_DEADLINE", "30")),
+    "Summarizer": float(os.getenv("SUMMARIZER_DEADLINE", "60")),
+    "Mentor": float(os.getenv("MENTOR_DEADLINE", "90")),
+    "FusedAnalyst": float(os.getenv("FUSED_ANALYST_DEADLINE", "120")),
+    "Interviewer": float(os.getenv("INTERVIEWER_DEADLINE", "90")),
+    "DecisionMaker": float(os.getenv("DECISION_MAKER_DEADLINE", "300")),
+}
+DEFAULT_AGENT_DEADLINE = float(os.getenv("DEFAULT_AGENT_DEADLINE", "120"))
+# Hedged requests: дубликат запроса, если ответа нет дольше p95 недавних вызовов агента
+HEDGE_ENABLED = os.getenv("HEDGE_REQUESTS", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))  # до этого p95 ненадежен, дубликатов нет
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+# Circuit breaker на профиль модели
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+# Сколько LLM-запросов процесса одновременно в полете (0 - без ограничения); остальные ждут слот
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Потоки для фоновой работы сессий (cancellation.run_in_background), например суммаризации
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "4"))
+# Деградация под нагрузкой (load_governor.py): full -> no_judge -> no_psychologist -> fused -> templated
+LOAD_GOVERNOR = os.getenv("LOAD_GOVERNOR", "0") == "1"  # выключен, пока пороги не подтверждены нагрузочными тестами
+LOAD_QUEUE_HIGH = int(os.getenv("LOAD_QUEUE_HIGH", str(2 * LLM_MAX_CONCURRENCY if LLM_MAX_CONCURRENCY > 0 else 32)))
+LOAD_LATENCY_RATIO = float(os.getenv("LOAD_LATENCY_RATIO", "3"))  # p95 хода / медиана хода без нагрузки
+LOAD_LOW_RATIO = float(os.getenv("LOAD_LOW_RATIO", "0.5"))  # ниже этой доли порога - возвращаем уровень
+LOAD_UP_AFTER = int(os.getenv("LOAD_UP_AFTER", "2"))
+LOAD_DOWN_AFTER = int(os.getenv("LOAD_DOWN_AFTER", "5"))
+LOAD_LATENCY_WINDOW = int(os.getenv("LOAD_LATENCY_WINDOW", "20"))  # последних ходов процесса
+LOAD_BASELINE_WINDOW = int(os.getenv("LOAD_BASELINE_WINDOW", "50"))  # ходов без очереди для базовой латентности
+LOAD_MIN_SAMPLES = int(os.getenv("LOAD_MIN_SAMPLES", "10"))
+LOAD_MAX_TIER = os.getenv("LOAD_MAX_TIER", "no_psychologist")  # самый низкий допустимый уровень
+
+# Эмбеддинги базы знаний (embeddings.py): "torch" (fp32), "torch-int8" (динамическая квантизация),
+# "onnx" (ONNX Runtime, int8-файл модели; нужен optimum[onnxruntime])
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Для русскоязычных ответов: EMBEDDING_MODEL=paraphrase-multilingual-MiniLM-L12-v2
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+# Потоки инференса на CPU (0 - по умолчанию библиотеки, обычно все ядра)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+# Шарды базы знаний по темам (knowledge_base.py): запрос ищется только в шардах,
+# которые выбрал локальный классификатор темы (косинус к центроидам эмбеддингов)
+KB_SHARDING = os.getenv("KB_SHARDING", "1") == "1"  # 0 - искать во всех шардах
+KB_MAX_SHARDS = int(os.getenv("KB_MAX_SHARDS", "2"))
+# Второй шард берется, только если его тема почти так же близка, как лучшая
+KB_SHARD_MARGIN = float(os.getenv("KB_SHARD_MARGIN", "0.05"))
+# Сколько эмбеддингов шарда брать в центроид при старте (плюс вопросы темы)
+KB_CENTROID_SAMPLE = int(os.getenv("KB_CENTROID_SAMPLE", "500"))
+
+# Гибридный поиск (lexical.py): BM25 + векторы, слияние reciprocal rank fusion
+KB_HYBRID = os.getenv("KB_HYBRID", "1") == "1"
+KB_CANDIDATES = int(os.getenv("KB_CANDIDATES", "10"))  # кандидатов с каждой стороны до слияния
+KB_RRF_K = int(os.getenv("KB_RRF_K", "60"))
+# Пороги релевантности: лучше ничего, чем шум в промпте Фактчекера
+KB_MIN_SIMILARITY = float(os.getenv("KB_MIN_SIMILARITY", "0.3"))
+KB_MIN_BM25 = float(os.getenv("KB_MIN_BM25", "1.0"))
+KB_STEM_PREFIX = int(os.getenv("KB_STEM_PREFIX", "6"))
+
+# Чекпоинты сессии (checkpoint.py): журнал на каждый ход + атомарный снапшот раз в N ходов
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS", "1") == "1"
+CHECKPOINT_DIR = BASE_DIR / "checkpoints"
+CHECKPOINT_SNAPSHOT_EVERY = int(os.getenv("CHECKPOINT_SNAPSHOT_EVERY", "5"))
+CHECKPOINT_FSYNC = os.getenv("CHECKPOINT_FSYNC", "1") == "1"  # 0 - быстрее, но без гарантии при сбое ОС
+
+# LRU-кэш сессий (session_cache.py): простаивающие сессии уходят на диск и поднимаются по следующему сообщению
+SESSION_CACHE_MAX_SESSIONS = int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "64"))
+SESSION_CACHE_MAX_MB = float(os.getenv("SESSION_CACHE_MAX_MB", "256"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "120"))  # 0 - вытеснять только по лимитам
+SESSION_SPILL_DIR = BASE_DIR / "checkpoints" / "idle"
+SESSION_SWEEP_SECONDS = float(os.getenv("SESSION_SWEEP_SECONDS", "30"))  # период cache.start_sweeper()
+
+# Пре-форк воркеры (worker_pool.py): процессы, делящие модель эмбеддингов и базу знаний с родителем
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", str(os.cpu_count() or 2)))
+
+# Пакетная переоценка архивных логов (reevaluate.py): прогресс и кэш ответов в reeval/reeval.sqlite
+REEVAL_CONCURRENCY = int(os.getenv("REEVAL_CONCURRENCY", "8"))
+REEVAL_DIR = BASE_DIR / "reeval"
+
+# Проверка фактов по утверждениям (claims.py): длинный ответ делится на утверждения,
+# каждое проверяется отдельным параллельным вызовом, вердикты сводятся в один FactCheckReport
+FACT_CHECK_CLAIMS = os.getenv("FACT_CHECK_CLAIMS", "1") == "1"
+FACT_CHECK_MAX_CLAIMS = int(os.getenv("FACT_CHECK_MAX_CLAIMS", "4"))
+CLAIM_MIN_WORDS = int(os.getenv("CLAIM_MIN_WORDS", "4"))  # короче - не утверждение ("Стоп интервью.")
+
+# Спекулятивная подготовка следующего хода, пока кандидат печатает (prefetch.py)
+PREFETCH_ENABLED = os.getenv("PREFETCH", "0") == "1"
+PREFETCH_WARM_KV = os.getenv("PREFETCH_WARM_KV", "1") == "1"  # прогревать KV-кэш сервера под промпт Ментора
+PREFETCH_DEADLINE = float(os.getenv("PREFETCH_DEADLINE", "15"))
+
+# Прогон сценариев (scenario_engine.py)
+SCENARIOS_DIR = BASE_DIR / "scenarios"
+SCENARIO_WORKERS = int(os.getenv("SCENARIO_WORKERS", "1"))
+
+# Локальный детерминированный stub-сервер LLM (stub_llm.py)
+STUB_LLM_HOST = os.getenv("STUB_LLM_HOST", "127.0.0.1")
+STUB_LLM_PORT = int(os.getenv("STUB_LLM_PORT", "0"))  # 0 - выбрать свободный порт
+# Секунды на ответ или распределение: "0.2", "uniform:0.1:0.4", "normal:0.3:0.05", "lognormal:-1.5:0.4"
+STUB_LLM_LATENCY = os.getenv("STUB_LLM_LATENCY", "0")
+STUB_LOG_DIR = BASE_DIR / "interview" / "stub_runs"
+
+# Трассировка (tracing.py): TRACING=1 включает спаны, формат экспорта "chrome" или "otlp"
+TRACING_ENABLED = os.getenv("TRACING", "0") == "1"
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "chrome")
+TRACE_DIR = BASE_DIR / "traces"
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "100000"))  # сколько последних спанов держать в памяти до export()
+
+# Адаптивный вызов Судьи (judge_policy.py)
+ADAPTIVE_JUDGE = os.getenv("ADAPTIVE_JUDGE", "1") == "1"
+JUDGE_SKIP_STREAK = int(os.getenv("JUDGE_SKIP_STREAK", "3"))  # сколько одобрений подряд нужно для пропуска
+JUDGE_SKIP_MIN_SCORE = int(os.getenv("JUDGE_SKIP_MIN_SCORE", "8"))  # минимальный score в этой серии
+JUDGE_SAMPLE_RATE = float(os.getenv("JUDGE_SAMPLE_RATE", "0.2"))  # доля выборочных проверок при пропуске
+JUDGE_MAX_RESPONSE_CHARS = int(os.getenv("JUDGE_MAX_RESPONSE_CHARS", "1500"))
+
+# Маршрутизатор сообщений (router.py)
+AGENT_ROUTER_ENABLED = os.getenv("AGENT_ROUTER", "1") == "1"
+ROUTER_ACK_MAX_WORDS = int(os.getenv("ROUTER_ACK_MAX_WORDS", "3"))
+ROUTER_STOP_MAX_WORDS = int(os.getenv("ROUTER_STOP_MAX_WORDS", "8"))
+
+# Режим анализа хода: "multi" - FactChecker, Psychologist и Mentor отдельными вызовами,
+# "fused" - один структурированный вызов FusedAnalystAgent (меньше round trip к LLM)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "multi")
+
+# Банк вопросов (question_bank.py): следующий вопрос берется из questions/*.jsonl, Интервьюер его перефразирует
+QUESTION_BANK = os.getenv("QUESTION_BANK", "0") == "1"  # по умолчанию выключен: меняет вопросы существующих сценариев
+QUESTIONS_DIR = BASE_DIR / "questions"
+QUESTION_CACHE_DIR = QUESTIONS_DIR / ".cache"
+QUESTION_START_LEVEL = os.getenv("QUESTION_START_LEVEL", "middle")
+QUESTION_DUPLICATE_SIMILARITY = float(os.getenv("QUESTION_DUPLICATE_SIMILARITY", "0.9"))  # почти-дубликаты закрываются вместе
+QUESTION_MAX_NEIGHBOURS = int(os.getenv("QUESTION_MAX_NEIGHBOURS", "4"))
+# Ответ короче - тема не определяется по нему, остается текущая ("Да" не уводит в ближайшую тему)
+QUESTION_CLASSIFY_MIN_WORDS = int(os.getenv("QUESTION_CLASSIFY_MIN_WORDS", "4"))
+# После таких вердиктов Фактчекера вместо вопроса из банка - уточняющий вопрос по инструкции Ментора
+QUESTION_FOLLOW_UP_VERDICTS = tuple(
+    v.strip() for v in os.getenv("QUESTION_FOLLOW_UP_VERDICTS", "FALSE,PARTIALLY TRUE").split(",") if v.strip()
+)
+# Вопрос из банка - только если Ментор переходит к новому вопросу/теме (ищется в strategy, затем в instruction);
+# Deepen/Simplify/уточнение/Wrap up - вопрос по инструкции Ментора
+QUESTION_NEW_MOVES = tuple(
+    v.strip().lower() for v in os.getenv(
+        "QUESTION_NEW_MOVES", "change topic,new topic,next topic,another topic,switch topic,move on,next question,new question"
+    ).split(",") if v.strip()
+)
+QUESTION_FOLLOW_UP_MOVES = tuple(
+    v.strip().lower() for v in os.getenv(
+        "QUESTION_FOLLOW_UP_MOVES", "deepen,simplify,clarif,follow up,follow-up,drill,wrap up,wrap-up"
+    ).split(",") if v.strip()
+)
+
+# Таблица навыков сессии (scoreboard.py): Ментор и DecisionMaker читают ее вместо длинной истории
+SCOREBOARD = os.getenv("SCOREBOARD", "0") == "1"  # по умолчанию выключена: меняет входы Ментора и DecisionMaker
+SCOREBOARD_MAX_ITEMS = int(os.getenv("SCOREBOARD_MAX_ITEMS", "8"))  # последних навыков/пробелов в промпте
+SCOREBOARD_MENTOR_WINDOW = int(os.getenv("SCOREBOARD_MENTOR_WINDOW", "3"))  # реплик истории у Ментора вместе с таблицей
+SCOREBOARD_DECISION_WINDOW = int(os.getenv("SCOREBOARD_DECISION_WINDOW", "4"))  # последних реплик у DecisionMaker
+
+# Прогрев при старте (warmup.py): модель эмбеддингов, БЗ, шаблоны агентов и KV-кэш сервера до приветствия
+WARMUP_ENABLED = os.getenv("WARMUP", "1") == "1"
+WARMUP_PRIME_LLM = os.getenv("WARMUP_PRIME_LLM", "1") == "1"  # запрос с системным промптом каждого агента
+WARMUP_PRIME_DEADLINE = float(os.getenv("WARMUP_PRIME_DEADLINE", "30"))  # холодный сервер отвечает дольше обычного
+READY_HOST = os.getenv("READY_HOST", "127.0.0.1")
+READY_PORT = int(os.getenv("READY_PORT", "0"))  # GET /ready: 200 после прогрева, 503 до; 0 - не поднимать
+
 # Системные промпты
 
 FACT_CHECKER_PROMPT = """You are a rigorous Fact-Checker for a technical interview.
@@ -66,6 +307,31 @@ IMPORTANT:
 - Set "interview_status" to "TERMINATE" ONLY if the interview should end (either successfully completed or user requested stop). Otherwise "CONTINUE".
 """
 
+MENTOR_SCOREBOARD_PROMPT = """The Conversation History above shows only the last few messages.
+The Candidate Scoreboard below is the running tally of the whole interview: use it to see which topics
+are already covered, which skills are confirmed and where the gaps are.
+"""
+
+FUSED_ANALYST_PROMPT = """You are the Analysis Panel of a technical interview. In ONE pass you play three roles:
+1. Fact-Checker: verify the technical claims in the candidate's latest statement.
+   Use "Known Facts" as the source of truth when relevant, otherwise your own internal knowledge.
+   Subjective claims (e.g. "I am experienced") are OPINION.
+2. Psychologist: analyze communication style, emotional state, soft skills and stress markers
+   (defensiveness, evasion, arrogance vs. insecurity).
+3. Mentor: using the two analyses above and the history, decide the next move
+   (Deepen / Simplify / Change Topic / Wrap up) and instruct the Interviewer on WHAT to ask and WHAT TONE to use.
+   You do NOT speak to the candidate.
+
+CRITICAL RULE:
+- If the candidate explicitly asks to STOP (e.g., "Stop game", "Стоп игра", "Enough"), the mentor instruction MUST be to politely ACCEPT the stop and END the interview immediately.
+
+IMPORTANT: 
+- Your internal reasoning and output must be in **ENGLISH**.
+- Fill "fact_check" and "psych_profile" first; "mentor_strategy" must rely on them.
+- Ensure valid JSON output. Escape double quotes within strings (e.g. \"quote\").
+- Set "interview_status" to "TERMINATE" ONLY if the interview should end (either successfully completed or user requested stop). Otherwise "CONTINUE".
+"""
+
 INTERVIEWER_PROMPT = """You are a Technical Interviewer.
 You receive instructions from a Mentor on what to ask, and a defined Tone to use.
 
@@ -77,6 +343,12 @@ IMPORTANT:
 - Do not use markdown formatting (no bold/italic).
 """
 
+INTERVIEWER_BANK_PROMPT = """The next question has already been chosen from the question bank.
+Briefly acknowledge the candidate's last answer (one short sentence, no evaluation of correctness),
+then ask the Next Question, rephrased naturally in Russian. Follow the Mentor's Instruction for how to
+lead into it, but the question you ask must be the Next Question. Do not add other questions.
+"""
+
 DECISION_MAKER_PROMPT = """You are the Final Decision Maker.
 Review the entire interview log, including insights from the Fact-Checker, Psychologist, and Mentor.
 
@@ -91,6 +363,12 @@ IMPORTANT:
 - Ensure valid JSON output. Escape double quotes within strings (e.g. \"quote\").
 """
 
+DECISION_MAKER_SCOREBOARD_PROMPT = """Instead of the full interview log you receive the Candidate Scoreboard:
+a running tally built turn by turn from the Fact-Checker and Psychologist reports
+(verdict counts per topic, confirmed skills, knowledge gaps with corrections, soft skills, stress markers),
+plus the last few messages. Base the scores on the scoreboard; build the roadmap from the knowledge gaps.
+"""
+
 JUDGE_PROMPT = """You are an AI Quality Assurance Judge.
 Your role is to evaluate the response generated by the 'InterviewerAgent' BEFORE it is sent to the candidate.
 
@@ -0,0 +1,54 @@
+"""
+Бэкенды эмбеддингов базы знаний (EMBEDDING_BACKEND), все только на CPU:
+  - "torch": исходный HuggingFaceEmbeddings, fp32 PyTorch;
+  - "torch-int8": та же модель с динамической int8-квантизацией Linear-слоев
+    (torch.quantization.quantize_dynamic), без дополнительных зависимостей;
+  - "onnx": ONNX Runtime через sentence-transformers (backend="onnx"), по умолчанию
+    готовый int8-файл из репозитория модели. Нужен пакет optimum[onnxruntime].
+Векторы квантизованных моделей почти совпадают с fp32 (см. python src/benchmark.py --embeddings),
+поэтому уже наполненная база переиндексации не требует.
+"""
+from typing import Any, Dict
+
+from langchain_huggingface import HuggingFaceEmbeddings
+
+import config
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+def _onnx_model_kwargs(threads: int) -> Dict[str, Any]:
+    kwargs = {"file_name": config.EMBEDDING_ONNX_FILE, "provider": "CPUExecutionProvider"}
+    if threads:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        kwargs["session_options"] = options
+    return kwargs
+
+
+def make_embeddings(backend: str = None, model_name: str = None, threads: int = None) -> HuggingFaceEmbeddings:
+    backend = backend or config.EMBEDDING_BACKEND
+    model_name = model_name or config.EMBEDDING_MODEL
+    threads = config.EMBEDDING_THREADS if threads is None else threads
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+
+    model_kwargs: Dict[str, Any] = {"device": "cpu"}
+    if backend == "onnx":
+        model_kwargs.update(backend="onnx", model_kwargs=_onnx_model_kwargs(threads))
+    elif threads:
+        import torch
+
+        torch.set_num_threads(threads)
+
+    # Нормированные векторы: расстояние в Chroma однозначно переводится в косинус (порог KB_MIN_SIMILARITY)
+    embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs,
+                                       encode_kwargs={"normalize_embeddings": True})
+    if backend == "torch-int8":
+        import torch
+
+        # inplace: fp32-веса Linear-слоев заменяются, а не копируются рядом
+        torch.quantization.quantize_dynamic(embeddings._client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return embeddings
@@ -0,0 +1,142 @@
+"""
+Адаптивная политика вызова JudgeAgent.
+
+Судья - полноценный LLM-вызов на каждый ответ Интервьюера. Политика решает,
+когда его можно пропустить:
+  1. Сначала дешевый локальный пре-фильтр (пустой ответ, markdown, не русский
+     язык, утечка ролей, грубость). Если он нашел проблему - ответ отклоняется
+     без вызова LLM.
+  2. Судья обязателен после отклонения, на повторной попытке и когда Ментор
+     выбрал тон "Strict" или завершает интервью (TERMINATE).
+  3. Если последние N вердиктов судьи в сессии - одобрения со score не ниже
+     порога, судья пропускается, но с вероятностью sample_rate все равно
+     вызывается выборочно.
+Все решения считаются в metrics(), чтобы экономию можно было сверить с качеством.
+"""
+import random
+import re
+from collections import Counter, deque
+from typing import Callable, Dict, Any, Optional, Tuple
+
+import config
+from schemas import JudgeVerdict, MentorStrategy
+
+_MARKDOWN_RE = re.compile(r"\*\*|__|```|^\s*#{1,6}\s", re.MULTILINE)
+_ROLE_LEAK_RE = re.compile(r"^\s*(Interviewer|Candidate|Mentor|Интервьюер|Кандидат|Ментор)\s*:", re.IGNORECASE | re.MULTILINE)
+_CYRILLIC_RE = re.compile(r"[а-яА-ЯёЁ]")
+_TOXIC_WORDS = ("идиот", "тупой", "тупица", "дурак", "заткнись", "бездарь", "stupid", "idiot", "shut up")
+
+
+class JudgePolicy:
+    """
+    Экземпляр на одну сессию: хранит историю вердиктов этой сессии.
+    """
+    def __init__(self, enabled: bool = None, sample_rate: float = None, streak: int = None,
+                 min_score: int = None, seed: Any = None):
+        self.enabled = config.ADAPTIVE_JUDGE if enabled is None else enabled
+        self.sample_rate = config.JUDGE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.streak = config.JUDGE_SKIP_STREAK if streak is None else streak
+        self.min_score = config.JUDGE_SKIP_MIN_SCORE if min_score is None else min_score
+        self.recent = deque(maxlen=max(1, self.streak))
+        self.force_next = False
+        # Детерминированная выборка: одна и та же сессия дает одни и те же пропуски
+        self._rng = random.Random(seed)
+        self.counters = Counter()
+        self.reasons = Counter()
+        self.scores = []
+
+    def prefilter(self, response_text: str) -> Optional[JudgeVerdict]:
+        """
+        Локальные правила. Возвращает отклоняющий вердикт или None, если ответ прошел.
+        """
+        text = (response_text or "").strip()
+        problem = None
+        if not text:
+            problem = "The response is empty."
+        elif len(text) > config.JUDGE_MAX_RESPONSE_CHARS:
+            problem = f"The response is too long ({len(text)} chars). Keep it short and ask one question."
+        elif _MARKDOWN_RE.search(text):
+            problem = "Do not use markdown formatting."
+        elif not _CYRILLIC_RE.search(text):
+            problem = "The response must be in Russian."
+        elif _ROLE_LEAK_RE.search(text):
+            problem = "Do not prefix lines with speaker roles or reveal internal roles."
+        elif any(word in text.lower() for word in _TOXIC_WORDS):
+            problem = "The response contains rude language."
+        if problem is None:
+            return None
+        return JudgeVerdict(approved=False, feedback=f"[Pre-filter] {problem}", score=0)
+
+    def should_review(self, strategy: MentorStrategy, attempt: int) -> Tuple[bool, str]:
+        """
+        Нужно ли звать LLM-судью для ответа, прошедшего пре-фильтр.
+        """
+        if not self.enabled:
+            return True, "policy_disabled"
+        if attempt > 1 or self.force_next:
+            return True, "after_rejection"
+        if strategy.tone == "Strict":
+            return True, "strict_tone"
+        if strategy.interview_status == "TERMINATE":
+            return True, "terminate"
+        if len(self.recent) < self.recent.maxlen:
+            return True, "warmup"
+        if not all(approved and score >= self.min_score for approved, score in self.recent):
+            return True, "low_confidence"
+        if self._rng.random() < self.sample_rate:
+            return True, "sampled"
+        return False, "confident_streak"
+
+    def review(self, response_text: str, strategy: MentorStrategy, attempt: int,
+               call_judge: Callable[[], JudgeVerdict], allow_llm: bool = True) -> Tuple[JudgeVerdict, str]:
+        """
+        Пре-фильтр -> решение политики -> (возможно) вызов судьи.
+        Возвращает вердикт и его источник: "prefilter", "llm", "skipped" или "load_shed"
+        (allow_llm=False: сервер перегружен, судью не зовем).
+        """
+        self.counters["responses"] += 1
+        verdict = self.prefilter(response_text)
+        if verdict is not None:
+            self.counters["prefilter_rejections"] += 1
+            self.force_next = True
+            return verdict, "prefilter"
+        if not allow_llm:
+            self.counters["skipped"] += 1
+            self.reasons["load_shed"] += 1
+            return JudgeVerdict(approved=True, feedback="Skipped under load (pre-filter only).", score=0), "load_shed"
+
+        review, reason = self.should_review(strategy, attempt)
+        self.reasons[reason] += 1
+        if not review:
+            self.counters["skipped"] += 1
+            return JudgeVerdict(approved=True, feedback=f"Skipped by adaptive policy ({reason}).",
+                                score=min(score for _, score in self.recent)), "skipped"
+
+        verdict = call_judge()
+        self.counters["judge_calls"] += 1
+        self.recent.append((verdict.approved, verdict.score))
+        self.scores.append(verdict.score)
+        self.force_next = not verdict.approved
+        if not verdict.approved:
+            self.counters["llm_rejections"] += 1
+            if reason == "sampled":
+                # Выборочная проверка нашла проблему - сигнал, что пропуски стоят качества
+                self.counters["sampled_rejections"] += 1
+        return verdict, "llm"
+
+    def metrics(self) -> Dict[str, Any]:
+        responses = self.counters["responses"]
+        calls = self.counters["judge_calls"]
+        return {
+            "enabled": self.enabled,
+            "responses": responses,
+            "judge_calls": calls,
+            "skipped": self.counters["skipped"],
+            "prefilter_rejections": self.counters["prefilter_rejections"],
+            "llm_rejections": self.counters["llm_rejections"],
+            "sampled_rejections": self.counters["sampled_rejections"],
+            "judge_call_rate": round(calls / responses, 3) if responses else 0.0,
+            "llm_approval_rate": round(1 - self.counters["llm_rejections"] / calls, 3) if calls else 0.0,
+            "mean_score": round(sum(self.scores) / len(self.scores), 2) if self.scores else None,
+            "review_reasons": dict(self.reasons),
+        }
@@ -1,104 +1,385 @@
-from typing import List
+import math
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.documents import Document
 import os
 import logging
+import config
 from config import BASE_DIR
+from embeddings import make_embeddings
+from lexical import BM25Index
+from question_bank import QuestionBank, load_question_files, questions_from_topics
+from tracing import traced
 
 # Отключаем лишние предупреждения при загрузке модели
 logging.getLogger("transformers").setLevel(logging.ERROR)
 
+# База вопросов по уровням
+TOPICS = {
+    "python": {
+        "junior": ["What are the basic data types in Python?", "Explain list vs tuple.", "What is a decorator?"],
+        "middle": ["Explain the Global Interpreter Lock (GIL).", "How does memory management work?", "Generators vs Iterators."],
+        "senior": ["Metaclasses usage.", "Asyncio internals.", "Python optimization techniques."]
+    },
+    "sql": {
+        "junior": ["SELECT vs SELECT DISTINCT", "What is a primary key?", "Basic JOINs."],
+        "middle": ["Index types.", "ACID properties.", "Normalization."],
+        "senior": ["Query optimization.", "Transaction isolation levels.", "Sharding strategies."]
+    },
+    "general": {
+        "junior": ["What is Git?", "HTTP methods."],
+        "middle": ["REST vs SOAP.", "Docker basics."],
+        "senior": ["System Design basics.", "Microservices patterns."]
+    }
+}
+
+# Начальные факты: (тема, текст)
+SEED_FACTS = [
+    # Python Core
+    ("python", "Python 4.0 сейчас не планируется. Гвидо ван Россум сказал, что это вряд ли случится скоро."),
+    ("python", "The Global Interpreter Lock (GIL) prevents multiple native threads from executing Python bytecodes at once in CPython."),
+    ("python", "Lists are mutable arrays. Tuples are immutable sequences. Using tuples can be slightly faster and safer for fixed data."),
+    ("python", "Decorators are functions that modify the behavior of other functions or methods. They use the @syntax."),
+    ("python", "Generators are iterators that yield results one by one using `yield`, saving memory compared to lists."),
+    ("python", "Context managers (with statement) ensure resources like files or locks are properly managed (opened/closed)."),
+    
+    # Databases / SQL
+    ("sql", "ACID stands for Atomicity, Consistency, Isolation, Durability - properties that guarantee database transaction reliability."),
+    ("sql", "Indexing improves read speed but slows down write operations (INSERT/UPDATE/DELETE)."),
+    ("sql", "Normalization is the process of organizing data to reduce redundancy. Denormalization is used for performance optimization."),
+    ("sql", "Sharding is horizontal scaling where data is distributed across multiple servers (shards), often by a shard key."),
+    ("sql", "CAP Theorem: A distributed system can provide only two of three: Consistency, Availability, Partition Tolerance."),
+    ("sql", "N+1 problem occurs when code explicitly executes a query for each child record instead of fetching them in a single query."),
+    
+    # Architecture / General
+    ("general", "REST APIs typically use standard HTTP methods (GET, POST, PUT, DELETE) and commonly return JSON."),
+    ("general", "Microservices architecture splits a monolithic app into smaller, independent services communicating via APIs."),
+    ("general", "Docker containers package code and dependencies together to ensure consistency across environments."),
+    ("general", "CI/CD (Continuous Integration/Continuous Deployment) automates testing and deployment pipelines."),
+    ("general", "SOLID principles: Single Responsibility, Open/Closed, Liskov Substitution, Interface Segregation, Dependency Inversion."),
+    
+    # Specifics mentioned in scenarios
+    ("python", "Python's asyncio uses an event loop to run asynchronous tasks on a single thread."),
+    ("sql", "In Django, `select_related` performs a SQL join to fetch related objects, while `prefetch_related` does a separate lookup."),
+    ("python", "Metaclasses in Python allow you to customize class creation. They are 'classes of classes'."),
+]
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+
+class TopicClassifier:
+    """
+    Локальный классификатор темы: косинус к центроиду эмбеддингов каждой темы.
+    Центроид - среднее нормированных векторов (вопросы темы + факты шарда) и
+    дообновляется при добавлении фактов без пересчета.
+    """
+    def __init__(self):
+        self._sums: Dict[str, List[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._centroids: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, topic: str, vectors: List[List[float]]):
+        with self._lock:
+            for vector in vectors:
+                vector = _normalize(list(vector))
+                total = self._sums.get(topic)
+                self._sums[topic] = vector if total is None else [a + b for a, b in zip(total, vector)]
+                self._counts[topic] = self._counts.get(topic, 0) + 1
+            if topic in self._sums:
+                self._centroids[topic] = _normalize(self._sums[topic])
+
+    def scores(self, vector: List[float]) -> Dict[str, float]:
+        vector = _normalize(list(vector))
+        with self._lock:
+            return {topic: sum(a * b for a, b in zip(vector, centroid))
+                    for topic, centroid in self._centroids.items()}
+
+    def route(self, vector: List[float], max_shards: int, margin: float) -> List[str]:
+        """
+        Лучшая тема плюс темы, отстающие от нее не больше чем на margin (пограничные вопросы).
+        """
+        ranked = sorted(self.scores(vector).items(), key=lambda item: item[1], reverse=True)
+        if not ranked:
+            return []
+        best = ranked[0][1]
+        return [topic for topic, score in ranked[:max_shards] if best - score <= margin]
+
+
 class InterviewKnowledgeBase:
     def __init__(self):
         # База вопросов по уровням
-        self.topics = {
-            "python": {
-                "junior": ["What are the basic data types in Python?", "Explain list vs tuple.", "What is a decorator?"],
-                "middle": ["Explain the Global Interpreter Lock (GIL).", "How does memory management work?", "Generators vs Iterators."],
-                "senior": ["Metaclasses usage.", "Asyncio internals.", "Python optimization techniques."]
-            },
-            "sql": {
-                "junior": ["SELECT vs SELECT DISTINCT", "What is a primary key?", "Basic JOINs."],
-                "middle": ["Index types.", "ACID properties.", "Normalization."],
-                "senior": ["Query optimization.", "Transaction isolation levels.", "Sharding strategies."]
-            },
-            "general": {
-                "junior": ["What is Git?", "HTTP methods."],
-                "middle": ["REST vs SOAP.", "Docker basics."],
-                "senior": ["System Design basics.", "Microservices patterns."]
-            }
-        }
-        
+        self.topics = TOPICS
         
         # Инициализация векторной базы знаний (RAG)
         print("Инициализация базы знаний... Это может занять пару секунд.")
-        # Используем локальную модель эмбеддингов (она небольшая, ~100MB)
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        # Используем локальную модель эмбеддингов (она небольшая, ~100MB);
+        # EMBEDDING_BACKEND=torch-int8/onnx - квантизованный вариант для CPU
+        self.embeddings = make_embeddings()
         
-        # Используем локальную базу ChromaDB.
-        # Если она пустая - наполним её данными.
-        self.vector_store = Chroma(
-            collection_name="interview_facts",
-            embedding_function=self.embeddings,
-            persist_directory=str(BASE_DIR / "chroma_db")
-        )
+        # Локальная ChromaDB, по коллекции (шарду) на тему: поиск идет только по шардам,
+        # которые выбрал классификатор, и его цена растет с размером шарда, а не всей базы.
+        # Тема "general" принимает всё, что не подошло к остальным.
+        self.shards: Dict[str, Chroma] = {
+            topic: Chroma(
+                collection_name=self._collection_name(topic),
+                embedding_function=self.embeddings,
+                persist_directory=str(BASE_DIR / "chroma_db")
+            )
+            for topic in self.topics
+        }
+        self.classifier = TopicClassifier()
+        # Лексический индекс рядом с каждым шардом (гибридный поиск, KB_HYBRID)
+        self.lexical: Dict[str, BM25Index] = {topic: BM25Index() for topic in self.shards}
+        self._shard_counts: Dict[str, int] = {}
+        # Read-only снимок шардов для пре-форк воркеров (freeze): тексты и матрица эмбеддингов
+        self._frozen: Dict[str, Tuple[List[str], np.ndarray]] = {}
+        self._shard_stats = {topic: {"queries": 0, "search_ms": 0.0} for topic in self.shards}
+        self._stats_lock = threading.Lock()
+        # Банк вопросов (questions/*.jsonl) строится при первом обращении
+        self._question_bank: Optional[QuestionBank] = None
+        self._bank_lock = threading.Lock()
         
         self._populate_db()
+        self._fit_classifier()
+        self._build_lexical()
+
+    @staticmethod
+    def _collection_name(topic: str) -> str:
+        # Другая модель эмбеддингов (другая размерность) - свои коллекции, база наполнится заново
+        if config.EMBEDDING_MODEL == "all-MiniLM-L6-v2":
+            return f"interview_facts_{topic}"
+        slug = "".join(ch if ch.isalnum() else "_" for ch in config.EMBEDDING_MODEL.split("/")[-1])
+        return f"interview_facts_{topic}__{slug}"
 
     def _populate_db(self):
         """
-        Проверяем, пуста ли база. Если да - загружаем начальные факты.
+        Проверяем, пусты ли шарды. Если да - переносим старую плоскую коллекцию или загружаем начальные факты.
         """
-        # Простая проверка: если в коллекции нет элементов - наполняем.
         try:
             # count() показывает количество записей
-            count = self.vector_store._collection.count()
+            self._shard_counts = {topic: shard._collection.count() for topic, shard in self.shards.items()}
+            count = sum(self._shard_counts.values())
             if count > 0:
-                print(f"База знаний загружена. Фактов: {count}.")
+                print(f"База знаний загружена. Фактов: {count} в {len(self.shards)} шардах.")
                 return
         except Exception:
             # Если ошибка доступа - считаем базу пустой
-            pass
+            self._shard_counts = {topic: 0 for topic in self.shards}
+
+        # Классификатор на вопросах тем нужен, чтобы разложить факты без явной темы
+        self._fit_classifier(sample=0)
+        if config.EMBEDDING_MODEL == "all-MiniLM-L6-v2" and self._migrate_flat_collection():
+            return
 
         print("Наполняем базу знаний...")
-        facts = [
-            # Python Core
-            "Python 4.0 сейчас не планируется. Гвидо ван Россум сказал, что это вряд ли случится скоро.",
-            "The Global Interpreter Lock (GIL) prevents multiple native threads from executing Python bytecodes at once in CPython.",
-            "Lists are mutable arrays. Tuples are immutable sequences. Using tuples can be slightly faster and safer for fixed data.",
-            "Decorators are functions that modify the behavior of other functions or methods. They use the @syntax.",
-            "Generators are iterators that yield results one by one using `yield`, saving memory compared to lists.",
-            "Context managers (with statement) ensure resources like files or locks are properly managed (opened/closed).",
-            
-            # Databases / SQL
-            "ACID stands for Atomicity, Consistency, Isolation, Durability - properties that guarantee database transaction reliability.",
-            "Indexing improves read speed but slows down write operations (INSERT/UPDATE/DELETE).",
-            "Normalization is the process of organizing data to reduce redundancy. Denormalization is used for performance optimization.",
-            "Sharding is horizontal scaling where data is distributed across multiple servers (shards), often by a shard key.",
-            "CAP Theorem: A distributed system can provide only two of three: Consistency, Availability, Partition Tolerance.",
-            "N+1 problem occurs when code explicitly executes a query for each child record instead of fetching them in a single query.",
-            
-            # Architecture / General
-            "REST APIs typically use standard HTTP methods (GET, POST, PUT, DELETE) and commonly return JSON.",
-            "Microservices architecture splits a monolithic app into smaller, independent services communicating via APIs.",
-            "Docker containers package code and dependencies together to ensure consistency across environments.",
-            "CI/CD (Continuous Integration/Continuous Deployment) automates testing and deployment pipelines.",
-            "SOLID principles: Single Responsibility, Open/Closed, Liskov Substitution, Interface Segregation, Dependency Inversion.",
-            
-            # Specifics mentioned in scenarios
-            "Python's asyncio uses an event loop to run asynchronous tasks on a single thread.",
-            "In Django, `select_related` performs a SQL join to fetch related objects, while `prefetch_related` does a separate lookup.",
-            "Metaclasses in Python allow you to customize class creation. They are 'classes of classes'.",
-        ]
-        
-        docs = [Document(page_content=f, metadata={"source": "init_data"}) for f in facts]
-        self.vector_store.add_documents(docs)
+        for topic in self.topics:
+            self.add_facts([text for fact_topic, text in SEED_FACTS if fact_topic == topic], topic=topic)
         print("База знаний успешно наполнена.")
 
+    def _migrate_flat_collection(self) -> bool:
+        """
+        Старая база (одна коллекция interview_facts): раскладываем факты по шардам классификатором,
+        эмбеддинги переиспользуются.
+        """
+        legacy = Chroma(
+            collection_name="interview_facts",
+            embedding_function=self.embeddings,
+            persist_directory=str(BASE_DIR / "chroma_db")
+        )
+        try:
+            data = legacy._collection.get(include=["documents", "embeddings", "metadatas"])
+        except Exception:
+            return False
+        if not data.get("ids"):
+            return False
+        print(f"Переносим базу знаний в шарды по темам. Фактов: {len(data['ids'])}.")
+        grouped: Dict[str, List[int]] = {}
+        for i, vector in enumerate(data["embeddings"]):
+            topic = (self.classifier.route(vector, 1, 0.0) or ["general"])[0]
+            grouped.setdefault(topic, []).append(i)
+        for topic, indices in grouped.items():
+            self._add_to_shard(
+                topic,
+                [data["documents"][i] for i in indices],
+                [list(data["embeddings"][i]) for i in indices],
+                [data["metadatas"][i] or {"source": "migrated"} for i in indices],
+            )
+        return True
+
+    def _fit_classifier(self, sample: int = None):
+        """
+        Центроиды тем: вопросы темы и выборка эмбеддингов ее шарда (KB_CENTROID_SAMPLE).
+        """
+        sample = config.KB_CENTROID_SAMPLE if sample is None else sample
+        self.classifier = TopicClassifier()
+        for topic, levels in self.topics.items():
+            questions = [question for level in levels.values() for question in level]
+            self.classifier.add(topic, self.embeddings.embed_documents([topic] + questions))
+            if sample and self._shard_counts.get(topic):
+                data = self.shards[topic]._collection.get(limit=sample, include=["embeddings"])
+                self.classifier.add(topic, data["embeddings"])
+
+    def _build_lexical(self):
+        for topic, shard in self.shards.items():
+            if self._shard_counts.get(topic) and not len(self.lexical[topic]):
+                self.lexical[topic].add(shard._collection.get(include=["documents"])["documents"])
+
+    def freeze(self):
+        """
+        Переводит базу в режим только для чтения перед fork (worker_pool.py): факты и эмбеддинги
+        шардов копируются в память процесса, поиск идет по матрице без клиента Chroma.
+        Воркеры делят эти страницы с родителем copy-on-write.
+        """
+        # Банк вопросов тоже загружаем до fork, чтобы воркеры его делили
+        self.question_bank
+        for topic, shard in self.shards.items():
+            if not self._shard_counts.get(topic):
+                self._frozen[topic] = ([], np.zeros((0, 0), dtype=np.float32))
+                continue
+            data = shard._collection.get(include=["documents", "embeddings"])
+            self._frozen[topic] = (list(data["documents"]), np.asarray(data["embeddings"], dtype=np.float32))
+
+    @property
+    def frozen(self) -> bool:
+        return bool(self._frozen)
+
+    def _add_to_shard(self, topic: str, texts: List[str], vectors: List[List[float]],
+                      metadatas: List[Dict[str, Any]]):
+        if not texts:
+            return
+        if self.frozen:
+            raise RuntimeError("Knowledge base is frozen (read-only), facts cannot be added.")
+        self.shards[topic]._collection.add(
+            ids=[str(uuid.uuid4()) for _ in texts],
+            documents=texts,
+            embeddings=vectors,
+            metadatas=[{**meta, "topic": topic} for meta in metadatas],
+        )
+        self.classifier.add(topic, vectors)
+        self.lexical[topic].add(texts)
+        with self._stats_lock:
+            self._shard_counts[topic] = self._shard_counts.get(topic, 0) + len(texts)
+
+    def add_facts(self, texts: List[str], topic: str = None, source: str = "init_data"):
+        """
+        Добавляет факты в шард темы; без темы каждый факт раскладывается классификатором.
+        """
+        if not texts:
+            return
+        vectors = self.embeddings.embed_documents(texts)
+        if topic is not None:
+            self._add_to_shard(topic, texts, vectors, [{"source": source}] * len(texts))
+            return
+        grouped: Dict[str, List[int]] = {}
+        for i, vector in enumerate(vectors):
+            fact_topic = (self.classifier.route(vector, 1, 0.0) or ["general"])[0]
+            grouped.setdefault(fact_topic, []).append(i)
+        for fact_topic, indices in grouped.items():
+            self._add_to_shard(fact_topic, [texts[i] for i in indices], [vectors[i] for i in indices],
+                               [{"source": source}] * len(indices))
+
+    def classify_topic(self, text: str) -> Optional[str]:
+        routed = self.classifier.route(self.embeddings.embed_query(text), 1, 0.0)
+        return routed[0] if routed else None
+
+    def _route(self, vector: List[float]) -> List[str]:
+        if not config.KB_SHARDING:
+            return list(self.shards)
+        return self.classifier.route(vector, config.KB_MAX_SHARDS, config.KB_SHARD_MARGIN) or list(self.shards)
+
+    def _search(self, queries: List[str], vectors: List[List[float]], k: int) -> List[List[str]]:
+        """
+        Для каждого запроса - до k фактов из выбранных для него шардов.
+        Векторы группируются по шардам, так что на шард уходит один запрос к Chroma.
+        Кандидаты векторного поиска (косинус >= KB_MIN_SIMILARITY) и BM25 (score >= KB_MIN_BM25)
+        сливаются reciprocal rank fusion; если порог не прошел никто, факт не возвращается вовсе.
+        """
+        depth = max(k, config.KB_CANDIDATES)
+        by_shard: Dict[str, List[int]] = {}
+        for i, vector in enumerate(vectors):
+            for topic in self._route(vector):
+                by_shard.setdefault(topic, []).append(i)
+
+        dense: List[List[Tuple[float, str]]] = [[] for _ in vectors]
+        sparse: List[List[Tuple[float, str]]] = [[] for _ in vectors]
+        for topic, indices in by_shard.items():
+            size = self._shard_counts.get(topic, 0)
+            if not size:
+                continue
+            started = time.perf_counter()
+            hits = self._dense_search(topic, [vectors[i] for i in indices], min(depth, size))
+            for i, found in zip(indices, hits):
+                dense[i].extend((similarity, doc) for similarity, doc in found
+                                if similarity >= config.KB_MIN_SIMILARITY)
+                if config.KB_HYBRID:
+                    sparse[i].extend((score, doc) for doc, score in self.lexical[topic].search(queries[i], depth)
+                                     if score >= config.KB_MIN_BM25)
+            with self._stats_lock:
+                stats = self._shard_stats[topic]
+                stats["queries"] += len(indices)
+                stats["search_ms"] += (time.perf_counter() - started) * 1000
+
+        results = []
+        for dense_hits, sparse_hits in zip(dense, sparse):
+            fused: Dict[str, float] = {}
+            for hits in (dense_hits, sparse_hits):
+                for rank, (_, doc) in enumerate(sorted(hits, reverse=True)[:depth]):
+                    fused[doc] = fused.get(doc, 0.0) + 1 / (config.KB_RRF_K + rank + 1)
+            results.append(sorted(fused, key=fused.get, reverse=True)[:k])
+        return results
+
+    def _dense_search(self, topic: str, vectors: List[List[float]], n: int) -> List[List[Tuple[float, str]]]:
+        """
+        n ближайших фактов шарда для каждого вектора: (косинус, текст).
+        """
+        if topic in self._frozen:
+            docs, matrix = self._frozen[topic]
+            similarities = np.asarray(vectors, dtype=np.float32) @ matrix.T
+            top = np.argpartition(-similarities, n - 1, axis=1)[:, :n] if n < len(docs) else \
+                np.tile(np.arange(len(docs)), (len(vectors), 1))
+            return [[(float(row[j]), docs[j]) for j in ids] for row, ids in zip(similarities, top)]
+        result = self.shards[topic]._collection.query(
+            query_embeddings=vectors,
+            n_results=n,
+            include=["documents", "distances"],
+        )
+        # Векторы нормированы, расстояние Chroma (квадрат L2) = 2 - 2 * cos
+        return [[(1 - d / 2, doc) for d, doc in zip(distances, docs)]
+                for docs, distances in zip(result["documents"], result["distances"])]
+
+    def shard_stats(self) -> Dict[str, Any]:
+        """
+        Размер шардов, сколько запросов ушло в каждый и среднее время поиска в нем.
+        """
+        with self._stats_lock:
+            return {
+                topic: {
+                    "facts": self._shard_counts.get(topic, 0),
+                    "queries": stats["queries"],
+                    "avg_search_ms": round(stats["search_ms"] / stats["queries"], 2) if stats["queries"] else 0.0,
+                }
+                for topic, stats in self._shard_stats.items()
+            }
+
+    @property
+    def question_bank(self) -> QuestionBank:
+        with self._bank_lock:
+            if self._question_bank is None:
+                questions = load_question_files(str(config.QUESTIONS_DIR)) or questions_from_topics(self.topics)
+                self._question_bank = QuestionBank(questions, self.embeddings)
+            return self._question_bank
+
     def get_questions(self, topic: str, level: str) -> List[str]:
-        return self.topics.get(topic.lower(), {}).get(level.lower(), [])
+        return self.question_bank.get_questions(topic, level)
 
+    @traced("kb_retrieval")
     def verify_fact(self, query: str) -> str:
         """
         Ищет похожие факты в векторной базе.
@@ -106,18 +387,34 @@ class InterviewKnowledgeBase:
         if not query or len(query.strip()) < 5:
             return "Запрос слишком короткий для проверки."
             
-        # Ищем 2 самых похожих факта
+        # Ищем 2 самых похожих факта в шардах темы запроса
         try:
-            results = self.vector_store.similarity_search(query, k=2)
+            results = self._search([query], [self.embeddings.embed_query(query)], k=2)[0]
             
             if not results:
                 return "В базе знаний ничего не найдено."
                 
-            formatted_results = "\n".join([f"- {doc.page_content}" for doc in results])
+            formatted_results = "\n".join([f"- {doc}" for doc in results])
             return formatted_results
         except Exception as e:
             return f"Ошибка поиска в базе знаний: {str(e)}"
 
+    @traced("kb_retrieval")
+    def verify_facts(self, queries: List[str], k: int = 2) -> List[str]:
+        """
+        verify_fact для нескольких утверждений сразу: одна пачка эмбеддингов и по запросу на шард.
+        """
+        if not queries:
+            return []
+        try:
+            results = self._search(queries, self.embeddings.embed_documents(queries), k)
+        except Exception as e:
+            return [f"Ошибка поиска в базе знаний: {str(e)}"] * len(queries)
+        return [
+            "\n".join([f"- {doc}" for doc in docs]) if docs else "В базе знаний ничего не найдено."
+            for docs in results
+        ]
+
     def get_all_topics(self) -> List[str]:
         return list(self.topics.keys())
 
@@ -136,6 +433,8 @@ if __name__ == "__main__":
     print("\n--- Проверка поиска ---")
     for q in test_queries:
         print(f"\nВопрос: {q}")
+        print(f"Тема: {kb.classify_topic(q)}")
         print(f"Результат:\n{kb.verify_fact(q)}")
     
+    print(f"\nШарды: {kb.shard_stats()}")
     print("\nБаза знаний готова к работе.")
@@ -0,0 +1,76 @@
+"""
+Лексический поиск по фактам базы знаний: BM25 на инвертированном индексе в памяти.
+
+Дополняет векторный поиск там, где эмбеддинги промахиваются: русские ответы против
+англоязычной модели, точные термины ("GIL", "ACID", "select_related").
+Токены - слова в нижнем регистре, обрезанные до KB_STEM_PREFIX символов
+(грубый стемминг, которого хватает для русских окончаний), без стоп-слов.
+"""
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import config
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOP_WORDS = {
+    "the", "a", "an", "is", "are", "of", "to", "in", "and", "or", "for", "on", "with", "it", "that", "this",
+    "by", "as", "be", "at", "from", "what", "how", "do", "does",
+    "и", "в", "во", "на", "не", "что", "это", "как", "с", "со", "по", "из", "к", "у", "а", "но", "за",
+    "от", "для", "то", "же", "ли", "бы", "я", "он", "она", "они", "мы", "вы", "его", "ее", "их",
+}
+
+
+def tokenize(text: str, prefix: int = None) -> List[str]:
+    prefix = config.KB_STEM_PREFIX if prefix is None else prefix
+    return [token[:prefix] for token in _TOKEN_RE.findall((text or "").lower())
+            if len(token) > 1 and token not in STOP_WORDS]
+
+
+class BM25Index:
+    """
+    Документ идентифицируется своим текстом (так же его возвращает Chroma), повторы игнорируются.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, texts: List[str]):
+        with self._lock:
+            for text in texts:
+                if text in self._lengths:
+                    continue
+                tokens = tokenize(text)
+                self._lengths[text] = len(tokens)
+                self._total_length += len(tokens)
+                for term, tf in Counter(tokens).items():
+                    self._postings.setdefault(term, {})[text] = tf
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """
+        До k документов с BM25 > 0 (есть хотя бы один общий термин), по убыванию score.
+        """
+        with self._lock:
+            n = len(self._lengths)
+            if not n:
+                return []
+            avg_length = self._total_length / n
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc] / avg_length)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -1,21 +1,165 @@
+import json
+import time
+from typing import Any, Dict, List, Tuple
+
+import openai
 from langchain_openai import ChatOpenAI
 import config
+from resilience import BreakerOpenError, LLMUnavailableError, ResilientCaller
+from load_governor import LoadGovernor
+from telemetry import telemetry
+
+# Errors that mean the endpoint is overloaded or unreachable
+OVERLOAD_ERRORS = (
+    openai.APIConnectionError,   # includes APITimeoutError
+    openai.RateLimitError,       # 429
+    openai.InternalServerError,  # 5xx, including 503 from an overloaded server
+)
 
 class LLMClient:
     """
     Wrapper for LangChain ChatOpenAI.
+    Each agent gets a model from its profile (endpoint, model, temperature,
+    max_tokens, timeout) and a fallback chain to other profiles under overload.
+    base_url/api_key/model override every profile at once (e.g. to point at the local stub_llm).
+    Agent calls go through invoke(): deadline, hedging and a circuit breaker (resilience.py)
+    for each profile of the fallback chain separately.
     """
-    def __init__(self):
-        self.llm = ChatOpenAI(
-            model=config.QWEN_MODEL_NAME,
-            api_key=config.QWEN_API_KEY,
-            base_url=config.QWEN_BASE_URL,
-            temperature=0.7
-        )
-
-    def get_llm(self):
-        return self.llm
-        
+    def __init__(self, base_url: str = None, api_key: str = None, model: str = None,
+                 profiles_file: str = None):
+        profiles = {name: dict(p) for name, p in config.MODEL_PROFILES.items()}
+        agents = dict(config.AGENT_MODEL_PROFILES)
+        fallbacks = {name: list(chain) for name, chain in config.MODEL_FALLBACKS.items()}
+        limits = {name: dict(l) for name, l in config.AGENT_GENERATION_LIMITS.items()}
+
+        profiles_file = profiles_file or config.MODEL_PROFILES_FILE
+        if profiles_file:
+            with open(profiles_file, "r", encoding="utf-8") as f:
+                overrides = json.load(f)
+            for name, profile in overrides.get("profiles", {}).items():
+                profiles[name] = {**profiles.get(name, profiles["large"]), **profile}
+            agents.update(overrides.get("agents", {}))
+            fallbacks.update(overrides.get("fallbacks", {}))
+            for name, agent_limits in overrides.get("generation_limits", {}).items():
+                limits[name] = {**limits.get(name, {}), **agent_limits}
+
+        for profile in profiles.values():
+            if base_url:
+                profile["base_url"] = base_url
+            if api_key:
+                profile["api_key"] = api_key
+            if model:
+                profile["model"] = model
+
+        self.profiles: Dict[str, Dict[str, Any]] = profiles
+        self.agent_profiles: Dict[str, str] = agents
+        self.fallbacks: Dict[str, List[str]] = fallbacks
+        self.generation_limits: Dict[str, Dict[str, Any]] = limits if config.GENERATION_LIMITS_ENABLED else {}
+        self._models: Dict[str, ChatOpenAI] = {}
+        self._bound: Dict[Tuple[str, str], Any] = {}
+        self.llm = self._model("large")
+        # The breaker counts only overload and timeouts as failures, not 4xx
+        self.resilience = ResilientCaller(failure_errors=OVERLOAD_ERRORS)
+        # Turn quality tier by server load, shared by all sessions of this client
+        self.governor = LoadGovernor(self.resilience)
+
+    def _model(self, profile_name: str) -> ChatOpenAI:
+        """
+        One ChatOpenAI per profile, created once and shared by all agents.
+        """
+        if profile_name not in self._models:
+            p = self.profiles[profile_name]
+            self._models[profile_name] = ChatOpenAI(
+                model=p["model"],
+                api_key=p["api_key"],
+                base_url=p["base_url"],
+                temperature=p.get("temperature", 0.7),
+                max_tokens=p.get("max_tokens"),
+                timeout=p.get("timeout"),
+                max_retries=p.get("max_retries", 2),
+            )
+        return self._models[profile_name]
+
+    def profile_for(self, agent_name: str = None) -> str:
+        return self.agent_profiles.get(agent_name, "large")
+
+    def fallback_chain(self, agent_name: str = None) -> List[str]:
+        """
+        Fallback profiles for the agent: existing ones only, no duplicates.
+        """
+        primary = self.profile_for(agent_name)
+        chain = []
+        for name in self.fallbacks.get(primary, []):
+            if name in self.profiles and name != primary and name not in chain:
+                chain.append(name)
+        return chain
+
+    def limits_for(self, agent_name: str = None) -> Dict[str, Any]:
+        """
+        The agent's max_tokens/stop (config.AGENT_GENERATION_LIMITS); empty values are dropped.
+        """
+        return {k: v for k, v in self.generation_limits.get(agent_name, {}).items() if v}
+
+    def bound_model(self, agent_name: str, profile_name: str):
+        """
+        The profile's model with the agent's generation budget (created once per agent/profile pair).
+        """
+        key = (agent_name, profile_name)
+        if key not in self._bound:
+            limits = self.limits_for(agent_name)
+            model = self._model(profile_name)
+            self._bound[key] = model.bind(**limits) if limits else model
+        return self._bound[key]
+
+    def get_llm(self, agent_name: str = None):
+        """
+        The agent's primary-profile model with its generation budget. Without a name - the main one ("large"), as before.
+        Falling back to other profiles is done by invoke(), so that each profile has its own breaker.
+        """
+        return self.bound_model(agent_name, self.profile_for(agent_name))
+
+    def invoke(self, agent_name: str, llm, prompt_value, max_tokens: int = None):
+        """
+        llm.invoke(prompt_value) with the agent's deadline, hedged requests and a circuit breaker.
+        max_tokens - a different generation limit for every profile (retry of a truncated answer).
+        An overloaded profile (OVERLOAD_ERRORS or an open breaker) yields to the next one in the
+        fallback chain within the same deadline; a timeout ends the call right away.
+        Raises resilience.LLMUnavailableError if there is no answer.
+        """
+        deadline = config.AGENT_DEADLINES.get(agent_name, config.DEFAULT_AGENT_DEADLINE)
+        started = time.monotonic()
+        chain = [(self.profile_for(agent_name), llm)]
+        chain += [(name, self.bound_model(agent_name, name)) for name in self.fallback_chain(agent_name)]
+        if max_tokens:
+            chain = [(profile, model.bind(max_tokens=max_tokens)) for profile, model in chain]
+        last_error: Exception = None
+        for profile, model in chain:
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            try:
+                return self.resilience.call(agent_name, profile, lambda model=model: model.ainvoke(prompt_value),
+                                            deadline=remaining)
+            except (BreakerOpenError,) + OVERLOAD_ERRORS as e:
+                last_error = e
+                telemetry.record("profile_unavailable", agent_name, profile=profile, error=type(e).__name__)
+        # The whole fallback chain is overloaded - for the agent this is the same as a timeout
+        reason = type(last_error).__name__ if last_error is not None else "deadline exceeded"
+        raise LLMUnavailableError(f"{agent_name}: {reason}") from last_error
+
+    def warm_prefix(self, agent_name: str, text: str, deadline: float = None, breaker: bool = True):
+        """
+        Warms the server KV cache for a future agent call: a request with the start of its prompt
+        and max_tokens=1 (llama.cpp cache_prompt and vLLM prefix caching reuse the shared prefix).
+        breaker=False - startup warm-up: its failures do not open the profile's circuit breaker.
+        """
+        from langchain_core.messages import HumanMessage
+
+        llm = self._model(self.profile_for(agent_name)).bind(max_tokens=1)
+        return self.resilience.call(f"{agent_name}.warmup", self.profile_for(agent_name),
+                                    lambda: llm.ainvoke([HumanMessage(content=text)]),
+                                    deadline=deadline or config.PREFETCH_DEADLINE, breaker=breaker)
+
     def get_completion(self, messages, temperature=0.7):
         """
         Legacy/Fallback method.
@@ -0,0 +1,162 @@
+"""
+Деградация конвейера хода под нагрузкой.
+
+Когда очередь к LLM-серверу глубокая, медленно идут все сессии сразу. LoadGovernor
+(один на LLMClient, общий для всех сессий процесса) смотрит на нагрузку, а не на
+абсолютную длительность хода: глубину очереди ResilientCaller (ждут слот + в полете)
+относительно LOAD_QUEUE_HIGH и p95 недавних ходов относительно медианы ходов, закончившихся
+без очереди (базовая латентность этой модели и сервера). Медленная большая модель без
+чужого трафика поэтому не считается перегрузкой. Уровни качества:
+
+    full -> no_judge -> no_psychologist -> fused -> templated
+
+  - no_judge:        ответ Интервьюера проверяет только локальный пре-фильтр;
+  - no_psychologist: вместо Психолога нейтральный профиль;
+  - fused:           факты, психология и стратегия одним вызовом FusedAnalystAgent;
+  - templated:       без LLM на ходу - шаблонный уточняющий вопрос.
+
+Гистерезис: уровень понижается на ступень после LOAD_UP_AFTER проверок подряд с
+давлением >= 1 и возвращается после LOAD_DOWN_AFTER проверок с давлением <= LOAD_LOW_RATIO,
+поэтому на границе порога уровни не мигают. Уровень проверяется в начале каждого хода
+и пишется в лог хода (quality_tier). По умолчанию выключен (LOAD_GOVERNOR=0) и не опускается
+ниже no_psychologist (LOAD_MAX_TIER).
+"""
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict
+
+import config
+from resilience import LatencyTracker, ResilientCaller
+from schemas import FactCheckReport, MentorStrategy, PsychProfile
+from telemetry import telemetry
+
+TIERS = ("full", "no_judge", "no_psychologist", "fused", "templated")
+
+FOLLOW_UP_TEMPLATES = (
+    "Спасибо. Можете привести конкретный пример из своего опыта, где вы это применяли?",
+    "Понял. С какими трудностями вы при этом сталкивались и как их решали?",
+    "Хорошо. Почему вы выбрали именно такой подход, какие были альтернативы?",
+    "Спасибо. Что бы вы сделали иначе, если бы решали эту задачу сейчас?",
+)
+
+
+class LoadGovernor:
+    def __init__(self, caller: ResilientCaller, enabled: bool = None, queue_high: int = None,
+                 latency_ratio: float = None, max_tier: str = None):
+        self.caller = caller
+        self.enabled = config.LOAD_GOVERNOR if enabled is None else enabled
+        self.queue_high = queue_high or config.LOAD_QUEUE_HIGH
+        self.latency_ratio = latency_ratio or config.LOAD_LATENCY_RATIO
+        self.max_level = TIERS.index(max_tier or config.LOAD_MAX_TIER)
+        self.level = 0
+        self.turn_latency = LatencyTracker(window=config.LOAD_LATENCY_WINDOW)
+        # Ходы, закончившиеся без очереди: базовая латентность без нагрузки
+        self.baseline = LatencyTracker(window=config.LOAD_BASELINE_WINDOW)
+        self._above = 0
+        self._below = 0
+        self._lock = threading.Lock()
+        self.turns = Counter()
+        self.transitions = deque(maxlen=50)
+
+    def _queue_pressure(self) -> float:
+        return self.caller.queue_depth() / self.queue_high
+
+    def pressure(self) -> float:
+        """
+        1.0 - порог перегрузки: очередь queue_high запросов или p95 хода в latency_ratio раз
+        выше медианы хода без нагрузки. Пока замеров меньше LOAD_MIN_SAMPLES - только очередь.
+        """
+        p95 = self.turn_latency.percentile(95, config.LOAD_MIN_SAMPLES)
+        base = self.baseline.percentile(50, config.LOAD_MIN_SAMPLES)
+        latency = p95 / (base * self.latency_ratio) if p95 is not None and base else 0.0
+        return max(self._queue_pressure(), latency)
+
+    def tier(self) -> str:
+        """
+        Уровень для начинающегося хода (с учетом текущей нагрузки).
+        """
+        if not self.enabled:
+            return TIERS[0]
+        pressure = self.pressure()
+        with self._lock:
+            if pressure >= 1.0:
+                self._above += 1
+                self._below = 0
+            elif pressure <= config.LOAD_LOW_RATIO:
+                self._below += 1
+                self._above = 0
+            else:
+                self._above = self._below = 0
+            if self._above >= config.LOAD_UP_AFTER and self.level < self.max_level:
+                self._switch(self.level + 1, pressure)
+            elif self._below >= config.LOAD_DOWN_AFTER and self.level > 0:
+                self._switch(self.level - 1, pressure)
+            tier = TIERS[self.level]
+            self.turns[tier] += 1
+            return tier
+
+    def _switch(self, level: int, pressure: float):
+        old = TIERS[self.level]
+        self.level = level
+        self._above = self._below = 0
+        self.transitions.append({"time": round(time.time(), 3), "from": old, "to": TIERS[level],
+                                 "pressure": round(pressure, 2), "queue": self.caller.queue_depth()})
+        telemetry.record("tier_change", None, old=old, new=TIERS[level], pressure=round(pressure, 2))
+
+    def observe_turn(self, seconds: float):
+        self.turn_latency.add(seconds)
+        if self._queue_pressure() <= config.LOAD_LOW_RATIO:
+            self.baseline.add(seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            p95 = self.turn_latency.percentile(95)
+            base = self.baseline.percentile(50)
+            return {
+                "enabled": self.enabled,
+                "tier": TIERS[self.level],
+                "queue_depth": self.caller.queue_depth(),
+                "turn_p95_sec": round(p95, 3) if p95 is not None else None,
+                "baseline_p50_sec": round(base, 3) if base is not None else None,
+                "turns_per_tier": dict(self.turns),
+                "transitions": list(self.transitions),
+            }
+
+
+def runs_judge(tier: str) -> bool:
+    return TIERS.index(tier) < TIERS.index("no_judge")
+
+
+def runs_psychologist(tier: str) -> bool:
+    return TIERS.index(tier) < TIERS.index("no_psychologist")
+
+
+def pipeline_for(tier: str, mode: str) -> str:
+    """
+    Режим анализа хода: "multi"/"fused" из настроек, "fused" под нагрузкой, "templated" - без LLM.
+    """
+    if tier == "templated":
+        return "templated"
+    if TIERS.index(tier) >= TIERS.index("fused"):
+        return "fused"
+    return mode
+
+
+def skipped_psych_profile(tier: str) -> PsychProfile:
+    return PsychProfile(emotional_state=f"Unknown (psychologist skipped: load tier {tier})",
+                        communication_style="Not analyzed", soft_skills=[], stress_markers=[])
+
+
+def templated_turn(turn: int):
+    """
+    Ход без LLM: отчеты-заглушки и шаблонный уточняющий вопрос (по кругу, чтобы не повторяться подряд).
+    """
+    fact_report = FactCheckReport(verdict="OPINION", evidence="Fact-check skipped: load tier templated.")
+    strategy = MentorStrategy(
+        thought_process="Server overloaded, asking a templated follow-up on the current topic.",
+        strategy="Continue the current topic",
+        instruction="Ask a follow-up about the last answer.",
+        tone="Neutral",
+    )
+    return fact_report, skipped_psych_profile("templated"), strategy, FOLLOW_UP_TEMPLATES[turn % len(FOLLOW_UP_TEMPLATES)]
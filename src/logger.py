@@ -21,7 +21,15 @@ class InterviewLogger:
         self.session_data["participant_name"] = participant_name
         self.session_data["start_time"] = datetime.now().isoformat()
 
-    def log_turn(self, user_message: str, internal_thoughts: str, agent_message: str):
+    def restore_turns(self, turns: List[Dict[str, Any]]):
+        """
+        Продолжение сессии из чекпоинта: уже записанные ходы.
+        """
+        self.session_data["turns"] = list(turns)
+        self.turn_count = len(turns)
+        self._save()
+
+    def log_turn(self, user_message: str, internal_thoughts: str, agent_message: str, quality_tier: str = None):
         self.turn_count += 1
         turn_entry = {
             "turn_id": self.turn_count,
@@ -29,8 +37,19 @@ class InterviewLogger:
             "user_message": user_message,
             "internal_thoughts": internal_thoughts
         }
+        if quality_tier is not None:
+            # Уровень качества хода под нагрузкой (load_governor.py)
+            turn_entry["quality_tier"] = quality_tier
         self.session_data["turns"].append(turn_entry)
         self._save()
+        return turn_entry
+
+    def log_metrics(self, name: str, metrics: Dict[str, Any]):
+        """
+        Служебные метрики сессии (например, статистика вызовов Судьи).
+        """
+        self.session_data.setdefault("metrics", {})[name] = metrics
+        self._save()
 
     def log_feedback(self, feedback: Any):
         if hasattr(feedback, "model_dump"):
@@ -1,13 +1,48 @@
+import argparse
+import re
 import sys
 import json
-from agents import AgentManager, FactCheckerAgent, PsychologistAgent, MentorAgent, InterviewerAgent, DecisionMakerAgent
+import time
+from collections import Counter
+from datetime import datetime
+import config
+from agents import (
+    AgentManager, FactCheckerAgent, PsychologistAgent, MentorAgent, InterviewerAgent, DecisionMakerAgent,
+    FusedAnalystAgent
+)
 from logger import InterviewLogger
+from tracing import tracer
+from telemetry import telemetry
+from router import AgentRouter
+from load_governor import pipeline_for, runs_psychologist, skipped_psych_profile, templated_turn
+from cancellation import CancelToken, cancel_scope, run_in_background
+from prefetch import SpeculativePrefetcher
+from session import Transcript
+from checkpoint import INTERACTIVE_PREFIX, SessionCheckpoint, SessionState, latest_session_id
+from scoreboard import Scoreboard
+from warmup import format_report, readiness, serve_readiness, warm_up
 
-def main():
+GREETING = "Привет! Давай начнем твое собеседование. Расскажи о себе."
+
+def _restore(resume: str):
+    """
+    Чекпоинт прерванной сессии (resume="" - самая свежая интерактивная) или (None, None).
+    """
+    session_id = resume or latest_session_id()
+    if not session_id:
+        return None, None
+    checkpoint = SessionCheckpoint(session_id)
+    state = checkpoint.load()
+    return (checkpoint, state) if state is not None else (None, None)
+
+def main(resume: str = None, warmup: bool = None):
     print("Initializing Multi-Agent Interview Coach (v2.0)...")
+    # READY_PORT: проба /ready отвечает 503, пока не закончится прогрев
+    serve_readiness()
     
     logger = InterviewLogger()
-    manager = AgentManager()
+    with readiness.phase("kb"):
+        manager = AgentManager()
     
     # Регистрация агентов (версия 2)
     manager.register_agent("FactChecker", FactCheckerAgent)
@@ -15,94 +50,221 @@ def main():
     manager.register_agent("Mentor", MentorAgent)
     manager.register_agent("Interviewer", InterviewerAgent)
     manager.register_agent("DecisionMaker", DecisionMakerAgent)
+    manager.register_agent("FusedAnalyst", FusedAnalystAgent)
     
     fact_checker = manager.get_agent("FactChecker")
     psychologist = manager.get_agent("Psychologist")
     mentor = manager.get_agent("Mentor")
     interviewer = manager.get_agent("Interviewer")
     decision_maker = manager.get_agent("DecisionMaker")
+    fused_analyst = manager.get_agent("FusedAnalyst")
+    router = AgentRouter()
+    
+    # Прогрев до приветствия: первый кандидат получает латентность установившегося режима
+    if config.WARMUP_ENABLED if warmup is None else warmup:
+        print("Warming up (embeddings, knowledge base, agent prompts, LLM cache)...")
+        print(format_report(warm_up(manager)))
+    else:
+        readiness.mark_ready()
     
     print("Welcome! The panel is ready. (Interviewer, Mentor, Fact-Checker, Psychologist, Decision-Maker)")
     print("Type 'STOP' to end the interview.\n")
     
-    participant_name = input("Enter your name: ")
-    logger.start_session(participant_name)
+    checkpoint, state = _restore(resume) if resume is not None else (None, None)
+    if state is not None:
+        # Продолжаем прерванную сессию: история, лог и номер хода из чекпоинта
+        # Чекпоинт, переданный по id, мог быть записан не main.py - тогда имени в нем нет
+        participant_name = state.extra.get("participant_name") or input("Enter your name: ")
+        state.extra["participant_name"] = participant_name
+        logger.start_session(participant_name)
+        logger.restore_turns(state.log_turns)
+        print(f"Resuming session {state.session_id} after turn {state.turn}.")
+    else:
+        if resume is not None:
+            print("No checkpoint to resume, starting a new session.")
+        participant_name = input("Enter your name: ")
+        logger.start_session(participant_name)
+        slug = re.sub(r"[^\w-]+", "_", participant_name) or "candidate"
+        checkpoint = SessionCheckpoint(f"{INTERACTIVE_PREFIX}{slug}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        # История для агентов и полный лог для DecisionMaker (собирается один раз в конце)
+        state = SessionState(checkpoint.session_id, transcript=Transcript(),
+                             extra={"participant_name": participant_name})
+    
+    history = state.transcript
+    turn_no = state.turn
+    # Уровень качества хода по нагрузке на LLM-сервер
+    governor = manager.llm_client.governor
+    tier_counts = Counter()
+    # Следующий вопрос из банка (какие уже заданы - в чекпоинте)
+    questions = None
+    if config.QUESTION_BANK:
+        questions = manager.kb.question_bank.session(state.extra.get("questions"), classify=manager.kb.classify_topic)
+    # Таблица навыков сессии: Ментор и DecisionMaker читают ее вместо длинной истории
+    scoreboard = None
+    if config.SCOREBOARD:
+        scoreboard = Scoreboard(state.extra.get("scoreboard"), classify=manager.kb.classify_topic)
     
-    history = []
-    full_log_text = ""
+    # Ctrl+C обрывает незавершенные LLM-запросы сессии;
+    # STOP/TERMINATE снимают фоновую работу хода, которая больше не нужна
+    session_token = CancelToken(participant_name)
+    background = session_token.child()
+    # PREFETCH=1: пока кандидат печатает, готовим факты по вопросу и прогреваем KV-кэш под Ментора
+    prefetcher = SpeculativePrefetcher(manager.kb, mentor, background)
     
-    # Первое приветствие (сгенерированное или ручное)
-    print("\nInterviewer: Привет! Давай начнем твое собеседование. Расскажи о себе.")
+    # Первое приветствие (сгенерированное или ручное); после восстановления - последний вопрос
+    last_question = history[-1].content if len(history) and history[-1].role == "Interviewer" else GREETING
+    print(f"\nInterviewer: {last_question}")
     
-    while True:
-        try:
-            user_input = input(f"\n{participant_name}: ")
-        except EOFError:
-            break
+    with cancel_scope(session_token):
+        while True:
+            try:
+                user_input = input(f"\n{participant_name}: ")
+            except EOFError:
+                background.cancel("disconnected")
+                break
             
-        if user_input.strip().upper() == "STOP":
-            print("\nInterview finished. The Decision-Maker is deliberating...")
-            break
+            # Роутер: "STOP"/"Стоп интервью" - сразу к решению, короткие "Да"/"Нет" - без фактчекинга
+            routing = router.route(user_input, turn=turn_no + 1)
+            if routing.stop:
+                print("\nInterview finished. The Decision-Maker is deliberating...")
+                background.cancel("stop")
+                break
             
-        history.append({"role": "Candidate", "content": user_input})
-        full_log_text += f"\nCandidate: {user_input}"
+            turn_no += 1
+            prefetched = prefetcher.take()
+            extra_ctx = prefetched.context() if prefetched else {}
+            with tracer.span("turn", session=participant_name, turn=turn_no):
+                turn_started = time.perf_counter()
+                history.append("Candidate", user_input)
         
-        print("\n--- Analysing... ---")
+                print("\n--- Analysing... ---")
+                tier = governor.tier()
+                tier_counts[tier] += 1
+                turn_mode = pipeline_for(tier, config.PIPELINE_MODE)
+                templated_response = None
         
-        # 1. Параллельный анализ (Факты + Психология)
-        fact_ctx = {"user_message": user_input}
-        fact_report = fact_checker.run(fact_ctx)
-        
-        psych_ctx = {"user_message": user_input}
-        psych_report = psychologist.run(psych_ctx)
-        
-        print(f"[Fact-Checker]: {fact_report}")
-        print(f"[Psychologist]: {psych_report}")
+                if turn_mode == "templated":
+                    # Сервер перегружен: ход без LLM, шаблонный уточняющий вопрос
+                    fact_report, psych_report, instruction, templated_response = templated_turn(turn_no)
+                elif turn_mode == "fused":
+                    # 1+2. Факты, психология и стратегия одним вызовом LLM
+                    analysis = fused_analyst.run({"user_message": user_input, "history": history, **extra_ctx})
+                    fact_report = analysis.fact_check
+                    psych_report = analysis.psych_profile
+                    instruction = analysis.mentor_strategy
+                    if scoreboard is not None:
+                        scoreboard.update(user_input, fact_report, psych_report,
+                                          topic=questions.topic if questions is not None else None)
+                else:
+                    # 1. Параллельный анализ (Факты + Психология): Психолог в фоне, пока работает Фактчекер
+                    psych_ctx = {"user_message": user_input}
+                    psych_future = None
+                    if runs_psychologist(tier):
+                        psych_future = run_in_background(psychologist.run, psych_ctx, token=background)
+                    if routing.run_fact_checker:
+                        fact_ctx = {"user_message": user_input, **extra_ctx}
+                        fact_report = fact_checker.run(fact_ctx)
+                    else:
+                        fact_report = router.skipped_fact_report(routing)
+                    psych_report = psych_future.result() if psych_future is not None else skipped_psych_profile(tier)
+                    if scoreboard is not None:
+                        scoreboard.update(user_input, fact_report, psych_report,
+                                          topic=questions.topic if questions is not None else None)
+            
+                    # 2. Стратегия ментора
+                    mentor_ctx = {
+                        "history": history,
+                        "fact_check": fact_report,
+                        "psych_profile": psych_report,
+                        "scoreboard": scoreboard,
+                        **extra_ctx
+                    }
+                    instruction = mentor.run(mentor_ctx)
         
-        # 2. Стратегия ментора
-        mentor_ctx = {
-            "history": history,
-            "fact_check": fact_report,
-            "psych_profile": psych_report
-        }
-        instruction = mentor.run(mentor_ctx)
-        print(f"[Mentor]: {instruction}")
+                print(f"[Fact-Checker]: {fact_report}")
+                print(f"[Psychologist]: {psych_report}")
+                print(f"[Mentor]: {instruction}")
         
-        # 3. Ответ интервьюера
-        interviewer_ctx = {
-            "history": history,
-            "instruction": instruction
-        }
-        response = interviewer.run(interviewer_ctx)
+                # 3. Ответ интервьюера
+                question = None
+                if questions is not None and templated_response is None and instruction.interview_status != "TERMINATE":
+                    question = questions.next_for(user_input, fact_report.verdict, instruction)
+                interviewer_ctx = {
+                    "history": history,
+                    "instruction": instruction,
+                    "bank_question": question.text if question is not None else None
+                }
+                response = templated_response or interviewer.run(interviewer_ctx)
         
-        # Обновление состояния
-        history.append({"role": "Interviewer", "content": response})
-        full_log_text += f"\nInterviewer: {response}"
+                # Обновление состояния
+                history.append("Interviewer", response)
+                prefetcher.start(history)
         
-        # Логирование
-        # Очищаем отчеты от переносов строк для красивого лога
-        fc_clean = str(fact_report).replace('\n', ' ').strip()
-        psych_clean = str(psych_report).replace('\n', ' ').strip()
-        mentor_clean = str(instruction).replace('\n', ' ').strip()
+                # Логирование
+                # Очищаем отчеты от переносов строк для красивого лога
+                fc_clean = str(fact_report).replace('\n', ' ').strip()
+                psych_clean = str(psych_report).replace('\n', ' ').strip()
+                mentor_clean = str(instruction).replace('\n', ' ').strip()
         
-        combined_thoughts = f"[Fact-Checker] {fc_clean} | [Psychologist] {psych_clean} | [Mentor] {mentor_clean}"
-        logger.log_turn(user_input, combined_thoughts, response)
+                combined_thoughts = f"[Fact-Checker] {fc_clean} | [Psychologist] {psych_clean} | [Mentor] {mentor_clean}"
+                if question is not None:
+                    combined_thoughts += f" | [Question-Bank] {question.topic}/{question.level}: {question.text}"
+                with tracer.span("logging"):
+                    log_entry = logger.log_turn(user_input, combined_thoughts, response, quality_tier=tier)
+                    # Чекпоинт хода: при падении сессию можно продолжить через --resume
+                    state.turn = turn_no
+                    state.log_turns.append(log_entry)
+                    turn_extra = {}
+                    if questions is not None:
+                        state.extra["questions"] = turn_extra["questions"] = questions.to_state()
+                    if scoreboard is not None:
+                        state.extra["scoreboard"] = turn_extra["scoreboard"] = scoreboard.to_state()
+                    checkpoint.record_turn(state, [["Candidate", user_input], ["Interviewer", response]],
+                                           log_turn=log_entry, extra=turn_extra)
         
-        print(f"\n[Interviewer]: {response}")
+                print(f"\n[Interviewer]: {response}")
+                governor.observe_turn(time.perf_counter() - turn_started)
 
-        # Check for Mentor's termination signal
-        if instruction.interview_status == "TERMINATE":
-             print("\n--- Interview Concluded by Mentor ---")
-             break
+                # Check for Mentor's termination signal
+                if instruction.interview_status == "TERMINATE":
+                     print("\n--- Interview Concluded by Mentor ---")
+                     background.cancel("terminate")
+                     break
 
-    # 4. Финальное решение
-    dm_ctx = {"full_log": full_log_text}
-    final_decision = decision_maker.run(dm_ctx)
+        # 4. Финальное решение
+        if scoreboard is not None:
+            dm_ctx = {"scoreboard": scoreboard, "history": history}
+        else:
+            dm_ctx = {"full_log": history.full_log()}
+        final_decision = decision_maker.run(dm_ctx)
     
-    logger.log_feedback(final_decision)
+        logger.log_feedback(final_decision)
+        logger.log_metrics("routing", router.audit())
+        if scoreboard is not None:
+            logger.log_metrics("scoreboard", scoreboard.to_state())
+        logger.log_metrics("load_tiers", {"turns": dict(tier_counts), "governor": governor.metrics()})
+        # Таймауты, hedge-запросы, breaker и деградации (счетчики общие на процесс)
+        logger.log_metrics("llm_events", telemetry.snapshot())
+        # Размер шардов базы знаний и куда уходили запросы
+        logger.log_metrics("kb_shards", manager.kb.shard_stats())
+    # Сессия завершена штатно - продолжать нечего
+    checkpoint.clear()
     print("\n--- Final Decision ---")
     print(final_decision)
     print(f"\nSession saved to {logger.filename}")
+    trace_path = tracer.export()
+    if trace_path:
+        print(f"Trace saved to {trace_path}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Multi-Agent Interview Coach.")
+    parser.add_argument("--resume", nargs="?", const="", metavar="SESSION_ID",
+                        help="Continue an interrupted session from its checkpoint (default: the latest one).")
+    parser.add_argument("--no-warmup", action="store_true",
+                        help="Skip the startup warm-up (embeddings, agent prompts, LLM prefix cache).")
+    args = parser.parse_args()
+    try:
+        main(resume=args.resume, warmup=False if args.no_warmup else None)
+    except KeyboardInterrupt:
+        # cancel_scope уже снял незавершенные LLM-запросы сессии
+        print("\nInterview aborted.")
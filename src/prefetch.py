@@ -0,0 +1,103 @@
+"""
+Спекулятивная подготовка следующего хода, пока кандидат печатает ответ.
+
+После вопроса Интервьюера в фоне:
+  1. ищутся факты базы знаний по теме вопроса (дополняют поиск Фактчекера по ответу);
+  2. рендерится префикс промпта следующего вызова Ментора (история до ответа);
+  3. префикс отправляется на сервер с max_tokens=1, чтобы KV-кэш был прогрет
+     к моменту настоящего вызова Ментора.
+Когда приходит ответ, незавершенная работа отменяется, а готовые части отдаются ходу.
+Всё, что не успело или не совпало, просто не используется - результат хода не меняется.
+"""
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import config
+from cancellation import CancelToken, run_in_background
+from knowledge_base import InterviewKnowledgeBase
+from resilience import LLMUnavailableError
+from telemetry import telemetry
+
+
+class Prefetched:
+    """
+    Части, успевшие подготовиться. Поля заполняются по мере готовности (из фонового потока).
+    """
+    def __init__(self, question: str):
+        self.question = question
+        self.question_facts: Optional[str] = None
+        self.mentor_prefix: Optional[str] = None
+        self.warmed = False
+        self.done = False
+
+    def context(self) -> Dict[str, Any]:
+        """
+        Добавки к контексту агентов: question_facts для Фактчекера, prompt_prefix для Ментора.
+        """
+        extra = {}
+        if self.question_facts is not None:
+            extra["question_facts"] = self.question_facts
+        if self.warmed:
+            extra["prompt_prefix"] = self.mentor_prefix
+        return extra
+
+
+class SpeculativePrefetcher:
+    def __init__(self, kb: InterviewKnowledgeBase, mentor: Any, session_token: CancelToken,
+                 enabled: bool = None, warm_kv: bool = None):
+        self.enabled = config.PREFETCH_ENABLED if enabled is None else enabled
+        self.warm_kv = config.PREFETCH_WARM_KV if warm_kv is None else warm_kv
+        self.kb = kb
+        self.mentor = mentor
+        self.session_token = session_token
+        self._token: Optional[CancelToken] = None
+        self._current: Optional[Prefetched] = None
+        self._lock = threading.Lock()
+
+    def start(self, history: Sequence[Any]):
+        """
+        Вызывается сразу после вопроса Интервьюера (последняя реплика history).
+        """
+        if not self.enabled or not history:
+            return
+        self.cancel("superseded")
+        state = Prefetched(history[-1]["content"])
+        token = self.session_token.child()
+        with self._lock:
+            self._current, self._token = state, token
+        telemetry.incr("prefetch_started")
+        run_in_background(self._prefetch, state, list(history), token=token)
+
+    def _prefetch(self, state: Prefetched, history: List[Any]):
+        state.question_facts = self.kb.verify_fact(state.question)
+        state.mentor_prefix = self.mentor.prompt_prefix(history)
+        if self.warm_kv:
+            try:
+                self.mentor.warm_up(state.mentor_prefix)
+                state.warmed = True
+            except LLMUnavailableError:
+                # Прогрев - необязательная работа, его сбой ход не замечает
+                pass
+        state.done = True
+
+    def take(self) -> Optional[Prefetched]:
+        """
+        Пришел ответ кандидата: отменяет незаконченную работу и возвращает готовые части.
+        """
+        with self._lock:
+            state, token = self._current, self._token
+            self._current, self._token = None, None
+        if state is None:
+            return None
+        if state.done:
+            telemetry.incr("prefetch_complete")
+        else:
+            token.cancel("answer arrived")
+        return state
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            token = self._token
+            self._current, self._token = None, None
+        if token is not None:
+            token.cancel(reason)
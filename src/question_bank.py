@@ -0,0 +1,244 @@
+"""
+Банк вопросов вместо генерации каждого следующего вопроса с нуля.
+
+Вопросы загружаются из questions/*.jsonl (или *.json со списком) - по строке
+{"topic": ..., "level": ..., "question": ..., "id": ...(необязательно)}; без файлов
+используется встроенный TOPICS базы знаний. Эмбеддинги вопросов считаются один раз
+и кэшируются на диске (questions/.cache) вместе со списком почти-дубликатов каждого вопроса.
+
+QuestionSession - состояние одной сессии: курсор на каждую пару (тема, уровень) и
+множество уже заданных вопросов (заданный вопрос закрывает и свои почти-дубликаты).
+Следующий вопрос - амортизированно O(1): курсор только сдвигается вперед.
+Вопрос из банка берется, только когда Ментор переходит к новому вопросу или теме
+(wants_new_question); Интервьюер перефразирует его по инструкции Ментора. На Deepen/Simplify
+и после неверного или частично верного ответа (QUESTION_FOLLOW_UP_VERDICTS) вопрос генерируется
+как раньше - уточняющий, по инструкции Ментора.
+"""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+import config
+
+LEVELS = ("junior", "middle", "senior")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Question:
+    __slots__ = ("id", "topic", "level", "text")
+
+    def __init__(self, id: str, topic: str, level: str, text: str):
+        self.id = id
+        self.topic = topic
+        self.level = level
+        self.text = text
+
+
+def wants_new_question(strategy: Any) -> bool:
+    """
+    Ментор (MentorStrategy) просит новый вопрос/тему, а не уточнение или завершение.
+    Ход ищется сначала в strategy, затем в instruction; решает первый упомянутый
+    ("Deepen, do not change topic yet" - уточнение). Без явного хода - вопрос по инструкции.
+    """
+    for text in (strategy.strategy, strategy.instruction):
+        text = (text or "").lower()
+        moves = [(text.find(move), True) for move in config.QUESTION_NEW_MOVES if move in text] + \
+                [(text.find(move), False) for move in config.QUESTION_FOLLOW_UP_MOVES if move in text]
+        if moves:
+            return min(moves)[1]
+    return False
+
+
+def _question_id(topic: str, text: str) -> str:
+    return f"{topic}:{hashlib.sha1(text.encode('utf-8')).hexdigest()[:10]}"
+
+
+def load_question_files(directory: str) -> List[Question]:
+    """
+    Все вопросы из папки в порядке файлов и строк (порядок в файле - приоритет внутри уровня).
+    """
+    questions: List[Question] = []
+    seen: Set[str] = set()
+    if not os.path.isdir(directory):
+        return questions
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix == ".jsonl":
+            with open(path, "r", encoding="utf-8") as f:
+                items = [json.loads(line) for line in f if line.strip()]
+        elif path.suffix == ".json":
+            with open(path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        else:
+            continue
+        for item in items:
+            topic, level, text = item["topic"].lower(), item["level"].lower(), item["question"].strip()
+            question_id = item.get("id") or _question_id(topic, text)
+            if level not in LEVELS or question_id in seen:
+                continue
+            seen.add(question_id)
+            questions.append(Question(question_id, topic, level, text))
+    return questions
+
+
+def questions_from_topics(topics: Dict[str, Dict[str, List[str]]]) -> List[Question]:
+    return [Question(_question_id(topic, text), topic, level, text)
+            for topic, levels in topics.items() for level, texts in levels.items() for text in texts]
+
+
+class QuestionBank:
+    """
+    Общий на процесс и неизменяемый после загрузки (делится с пре-форк воркерами).
+    """
+    def __init__(self, questions: List[Question], embeddings: Any = None):
+        self.questions = questions
+        self.index: Dict[str, int] = {q.id: i for i, q in enumerate(questions)}
+        self.buckets: Dict[Tuple[str, str], List[int]] = {}
+        for i, q in enumerate(questions):
+            self.buckets.setdefault((q.topic, q.level), []).append(i)
+        self.topics: List[str] = list(dict.fromkeys(q.topic for q in questions))
+        # neighbours[i] - почти-дубликаты вопроса i в той же теме (-1 - пусто)
+        self.neighbours = np.full((len(questions), config.QUESTION_MAX_NEIGHBOURS), -1, dtype=np.int32)
+        if embeddings is not None and questions:
+            self._load_vectors(embeddings)
+
+    def _load_vectors(self, embeddings: Any):
+        texts = [q.text for q in self.questions]
+        key = hashlib.sha256(json.dumps([config.EMBEDDING_MODEL, config.QUESTION_DUPLICATE_SIMILARITY,
+                                         config.QUESTION_MAX_NEIGHBOURS, [q.topic for q in self.questions], texts],
+                                        ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+        cache_path = os.path.join(str(config.QUESTION_CACHE_DIR), f"{key}.npz")
+        if os.path.exists(cache_path):
+            self.neighbours = np.load(cache_path)["neighbours"]
+            return
+        # Эмбеддинги нормализованы (make_embeddings), скалярное произведение - косинус
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        topics = np.array([q.topic for q in self.questions])
+        k = config.QUESTION_MAX_NEIGHBOURS
+        for topic in self.topics:
+            rows = np.flatnonzero(topics == topic)
+            matrix = vectors[rows]
+            # Блоками, чтобы большой банк не требовал n x n матрицы целиком
+            for start in range(0, len(rows), 1024):
+                sims = matrix[start:start + 1024] @ matrix.T
+                for offset, row_sims in enumerate(sims):
+                    row_sims[start + offset] = -1.0
+                    close = np.flatnonzero(row_sims >= config.QUESTION_DUPLICATE_SIMILARITY)
+                    close = close[np.argsort(-row_sims[close])][:k]
+                    self.neighbours[rows[start + offset], :len(close)] = rows[close]
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp.npz"
+        np.savez(tmp_path, neighbours=self.neighbours)
+        os.replace(tmp_path, cache_path)
+
+    def get_questions(self, topic: str, level: str) -> List[str]:
+        return [self.questions[i].text for i in self.buckets.get((topic.lower(), level.lower()), [])]
+
+    def session(self, state: Optional[Dict[str, Any]] = None,
+                classify: Callable[[str], Optional[str]] = None) -> "QuestionSession":
+        return QuestionSession(self, state, classify)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "questions": len(self.questions),
+            "buckets": {f"{topic}/{level}": len(ids) for (topic, level), ids in self.buckets.items()},
+            "with_duplicates": int((self.neighbours[:, 0] >= 0).sum()) if len(self.questions) else 0,
+        }
+
+
+class QuestionSession:
+    def __init__(self, bank: QuestionBank, state: Optional[Dict[str, Any]] = None,
+                 classify: Callable[[str], Optional[str]] = None):
+        state = state or {}
+        self.bank = bank
+        self.classify = classify
+        self.topic: Optional[str] = state.get("topic")
+        level = state.get("level", config.QUESTION_START_LEVEL)
+        self.level: str = level if level in LEVELS else "middle"
+        self.asked: List[str] = []
+        self._covered: Set[int] = set()
+        self._cursor: Dict[Tuple[str, str], int] = {}
+        for question_id in state.get("asked", []):
+            if question_id in bank.index:
+                self.mark_asked(bank.questions[bank.index[question_id]])
+        self.topic = state.get("topic")
+        self.level = level if level in LEVELS else "middle"
+
+    def mark_asked(self, question: Question):
+        """
+        Вопрос задан: закрывает его и почти-дубликаты; тема и уровень сессии - тема и уровень вопроса.
+        Только здесь они и меняются, поэтому отклоненный Судьей вопрос состояние не сдвигает.
+        """
+        index = self.bank.index[question.id]
+        self.topic = question.topic
+        if question.level in LEVELS:
+            self.level = question.level
+        self.asked.append(question.id)
+        self._covered.add(index)
+        self._covered.update(int(n) for n in self.bank.neighbours[index] if n >= 0)
+
+    def next(self, topic: str, level: str) -> Optional[Question]:
+        """
+        Первый незаданный вопрос пары (тема, уровень); курсор не возвращается назад.
+        """
+        bucket = self.bank.buckets.get((topic, level))
+        if not bucket:
+            return None
+        i = self._cursor.get((topic, level), 0)
+        while i < len(bucket) and bucket[i] in self._covered:
+            i += 1
+        self._cursor[(topic, level)] = i
+        return self.bank.questions[bucket[i]] if i < len(bucket) else None
+
+    def _shifted_level(self, step: int) -> str:
+        index = LEVELS.index(self.level) if self.level in LEVELS else 1
+        return LEVELS[min(len(LEVELS) - 1, max(0, index + step))]
+
+    def _answer_topic(self, answer: str) -> Optional[str]:
+        """
+        Тема по ответу; короткий ответ ("Да", "Знаю") не классифицируется - остается текущая тема.
+        """
+        topic = None
+        if self.classify is not None and len(_WORD_RE.findall(answer or "")) >= config.QUESTION_CLASSIFY_MIN_WORDS:
+            topic = self.classify(answer)
+        if topic not in self.bank.topics:
+            topic = self.topic if self.topic in self.bank.topics else None
+        return topic or (self.bank.topics[0] if self.bank.topics else None)
+
+    def next_for(self, answer: str, verdict: str, strategy: Any = None, mark: bool = True) -> Optional[Question]:
+        """
+        Следующий вопрос после ответа кандидата или None, если нужен уточняющий (сгенерированный) вопрос.
+        Верный ответ - вопрос уровнем выше, неверный - ниже; тема - по ответу, иначе текущая.
+        strategy - MentorStrategy хода: вопрос из банка, только если Ментор просит новый вопрос/тему.
+        mark=False - только посмотреть (вопрос отмечается через mark_asked, например после одобрения Судьи).
+        Сама выборка состояние сессии не меняет: тема и уровень сдвигаются в mark_asked.
+        """
+        if verdict in config.QUESTION_FOLLOW_UP_VERDICTS:
+            return None
+        if strategy is not None and not wants_new_question(strategy):
+            return None
+        target = self._shifted_level({"TRUE": 1, "FALSE": -1}.get(verdict, 0))
+        topic = self._answer_topic(answer)
+        if topic is None:
+            return None
+        # Сначала своя тема (уровень, потом соседние), затем остальные темы на том же уровне
+        levels = sorted(LEVELS, key=lambda level: abs(LEVELS.index(level) - LEVELS.index(target)))
+        candidates = [(topic, level) for level in levels] + [(other, target) for other in self.bank.topics
+                                                             if other != topic]
+        for candidate_topic, level in candidates:
+            question = self.next(candidate_topic, level)
+            if question is not None:
+                if mark:
+                    self.mark_asked(question)
+                return question
+        return None
+
+    def to_state(self) -> Dict[str, Any]:
+        """
+        Для чекпоинта сессии (extra["questions"]).
+        """
+        return {"topic": self.topic, "level": self.level, "asked": list(self.asked)}
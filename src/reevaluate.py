@@ -0,0 +1,284 @@
+"""
+Пакетная переоценка архивных интервью DecisionMaker'ом.
+
+После правки DECISION_MAKER_PROMPT или FinalDecisionReport прогоняет логи из interview/
+(по одному файлу, без загрузки всего архива в память), восстанавливает из них полный лог
+диалога и заново вызывает DecisionMakerAgent. Отчет сравнивает старые и новые решения:
+смену уровня и рекомендации, матрицы переходов, изменение confidence_score.
+
+  - Параллельность ограничена --concurrency (плюс общий LLM_MAX_CONCURRENCY процесса),
+    в полете не больше 2 * concurrency заданий: сервер загружен, но не перегружен.
+  - Прогресс и ответы лежат в SQLite (reeval/reeval.sqlite). Повторный запуск пропускает
+    уже оцененные логи, а одинаковые диалоги (ключ - хеш промпта, схемы, модели и лога)
+    оцениваются один раз.
+
+Примеры:
+    python src/reevaluate.py
+    python src/reevaluate.py --dir interview --concurrency 16 --stub
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Если запускаем из корня, добавляем src в путь
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+import config
+from agents import DecisionMakerAgent
+from llm_client import LLMClient
+from resilience import LLMUnavailableError
+from schemas import FinalDecisionReport
+from session import Transcript
+from telemetry import telemetry
+
+# final_test_runner пишет вопрос Интервьюера перед ответом кандидата в той же записи хода
+_INTERVIEWER_FIRST_RE = re.compile(r"^interview_log_.+\.json$")
+_REPR_FIELDS = {
+    "level": re.compile(r"level='([^']*)'"),
+    "hiring_recommendation": re.compile(r"hiring_recommendation='([^']*)'"),
+    "confidence_score": re.compile(r"confidence_score=(\d+)"),
+}
+
+
+def iter_logs(directory: Path, include_stub: bool = False) -> Iterator[Path]:
+    for path in sorted(directory.rglob("*.json")):
+        if not include_stub and "stub_runs" in path.parts:
+            continue
+        yield path
+
+
+def rebuild_transcript(path: Path, data: Dict[str, Any]) -> Transcript:
+    """
+    Полный лог в формате, который DecisionMaker получал в исходной сессии.
+    """
+    transcript = Transcript()
+    interviewer_first = bool(_INTERVIEWER_FIRST_RE.match(path.name))
+    for turn in data.get("turns", []):
+        if interviewer_first:
+            transcript.append("Interviewer", turn.get("agent_visible_message", ""))
+            transcript.append("Candidate", turn.get("user_message", ""))
+        else:
+            transcript.append("Candidate", turn.get("user_message", ""))
+            transcript.append("Interviewer", turn.get("agent_visible_message", ""))
+    return transcript
+
+
+def parse_old_decision(feedback: Any) -> Dict[str, Any]:
+    """
+    Старое решение из лога: dict (main.py), JSON-строка (scenario_runner) или repr модели (final_test_runner).
+    """
+    if isinstance(feedback, str):
+        try:
+            feedback = json.loads(feedback)
+        except json.JSONDecodeError:
+            found = {name: regex.search(feedback) for name, regex in _REPR_FIELDS.items()}
+            feedback = {name: m.group(1) for name, m in found.items() if m}
+    if not isinstance(feedback, dict):
+        return {}
+    decision = {k: feedback.get(k) for k in ("level", "hiring_recommendation", "confidence_score")}
+    if decision["confidence_score"] is not None:
+        decision["confidence_score"] = int(decision["confidence_score"])
+    return decision
+
+
+class ResultStore:
+    """
+    SQLite: кэш ответов по ключу диалога и прогресс по файлам логов.
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, decision TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (run TEXT, path TEXT, key TEXT, old TEXT, new TEXT, "
+            "status TEXT, error TEXT, PRIMARY KEY (run, path))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def cached(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT decision FROM responses WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def done(self, run: str) -> Dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT path, status FROM results WHERE run = ?", (run,)).fetchall()
+        return dict(rows)
+
+    def save(self, run: str, path: str, key: str, old: Dict[str, Any], new: Optional[Dict[str, Any]],
+             status: str, error: str = None):
+        with self._lock:
+            if new is not None:
+                self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)",
+                                   (key, json.dumps(new, ensure_ascii=False)))
+            self._conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (run, path, key, json.dumps(old, ensure_ascii=False),
+                                json.dumps(new, ensure_ascii=False) if new is not None else None, status, error))
+            self._conn.commit()
+
+    def results(self, run: str) -> List[Tuple[str, Dict[str, Any], Optional[Dict[str, Any]], str]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT path, old, new, status FROM results WHERE run = ? ORDER BY path",
+                                      (run,)).fetchall()
+        return [(path, json.loads(old), json.loads(new) if new else None, status) for path, old, new, status in rows]
+
+
+class Reevaluator:
+    def __init__(self, llm_client: LLMClient = None, store: ResultStore = None, concurrency: int = None,
+                 retries: int = 2):
+        self.client = llm_client or LLMClient()
+        self.agent = DecisionMakerAgent("DecisionMaker", self.client)
+        self.store = store or ResultStore(str(config.REEVAL_DIR / "reeval.sqlite"))
+        self.concurrency = max(1, concurrency or config.REEVAL_CONCURRENCY)
+        self.retries = retries
+        profile = self.client.profiles.get(self.client.profile_for("DecisionMaker"), {})
+        # Прогон однозначно определяется промптом, схемой ответа и моделью
+        self.run_id = hashlib.sha256(json.dumps([
+            config.DECISION_MAKER_PROMPT,
+            FinalDecisionReport.model_json_schema(),
+            profile.get("model"),
+            profile.get("temperature"),
+        ], sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+        self.counters = Counter()
+
+    def _key(self, full_log: str) -> str:
+        return hashlib.sha256(f"{self.run_id}\n{full_log}".encode("utf-8")).hexdigest()
+
+    def _evaluate(self, path: Path) -> str:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if "turns" not in data:
+            return "skipped"
+        old = parse_old_decision(data.get("final_feedback"))
+        full_log = rebuild_transcript(path, data).full_log()
+        key = self._key(full_log)
+        new = self.store.cached(key)
+        if new is not None:
+            self.store.save(self.run_id, str(path), key, old, new, "cached")
+            return "cached"
+        for attempt in range(self.retries + 1):
+            try:
+                decision = self.agent.run({"full_log": full_log})
+                break
+            except LLMUnavailableError as e:
+                if attempt == self.retries:
+                    self.store.save(self.run_id, str(path), key, old, None, "error", str(e))
+                    return "error"
+                # Сервер перегружен или breaker открыт - даем ему время прийти в себя
+                time.sleep(config.BREAKER_RESET_TIMEOUT * (attempt + 1) / (self.retries + 1))
+        self.store.save(self.run_id, str(path), key, old, decision.model_dump(), "ok")
+        return "ok"
+
+    def _safe_evaluate(self, path: Path) -> str:
+        try:
+            return self._evaluate(path)
+        except Exception as e:
+            self.store.save(self.run_id, str(path), "", {}, None, "error", f"{type(e).__name__}: {e}")
+            return "error"
+
+    def run(self, paths: Iterator[Path]) -> Dict[str, Any]:
+        done = self.store.done(self.run_id)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending = set()
+            for path in paths:
+                if done.get(str(path)) in ("ok", "cached"):
+                    self.counters["resumed"] += 1
+                    continue
+                # Окно заданий: архив читается по мере освобождения воркеров
+                if len(pending) >= 2 * self.concurrency:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.counters.update(f.result() for f in finished)
+                pending.add(pool.submit(self._safe_evaluate, path))
+            self.counters.update(f.result() for f in wait(pending).done)
+        return self.report(time.perf_counter() - started)
+
+    def report(self, wall_sec: float) -> Dict[str, Any]:
+        rows = self.store.results(self.run_id)
+        compared = [(path, old, new) for path, old, new, status in rows if new is not None]
+        level_moves = Counter(f"{old.get('level')} -> {new['level']}" for _, old, new in compared)
+        rec_moves = Counter(f"{old.get('hiring_recommendation')} -> {new['hiring_recommendation']}"
+                            for _, old, new in compared)
+        deltas = [new["confidence_score"] - old["confidence_score"] for _, old, new in compared
+                  if old.get("confidence_score") is not None]
+        changed = [
+            {"path": path, "old": old,
+             "new": {k: new[k] for k in ("level", "hiring_recommendation", "confidence_score")}}
+            for path, old, new in compared
+            if old.get("level") != new["level"] or old.get("hiring_recommendation") != new["hiring_recommendation"]
+        ]
+        return {
+            "run_id": self.run_id,
+            "timestamp": datetime.now().isoformat(),
+            "wall_sec": round(wall_sec, 2),
+            "this_run": dict(self.counters),
+            "logs": len(rows),
+            "compared": len(compared),
+            "errors": sum(1 for row in rows if row[3] == "error"),
+            "level_changed": sum(1 for _, old, new in compared if old.get("level") != new["level"]),
+            "recommendation_changed": sum(1 for _, old, new in compared
+                                          if old.get("hiring_recommendation") != new["hiring_recommendation"]),
+            "level_transitions": dict(level_moves),
+            "recommendation_transitions": dict(rec_moves),
+            "confidence_delta": {
+                "mean": round(sum(deltas) / len(deltas), 2) if deltas else 0.0,
+                "mean_abs": round(sum(abs(d) for d in deltas) / len(deltas), 2) if deltas else 0.0,
+                "min": min(deltas) if deltas else 0,
+                "max": max(deltas) if deltas else 0,
+            },
+            "changed": changed,
+            "llm_events": telemetry.snapshot()["counters"],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score archived interview logs with the current Decision Maker.")
+    parser.add_argument("--dir", default=str(config.BASE_DIR / "interview"), help="Folder with interview logs.")
+    parser.add_argument("--include-stub", action="store_true", help="Also re-score logs from stub runs.")
+    parser.add_argument("--concurrency", type=int, default=config.REEVAL_CONCURRENCY)
+    parser.add_argument("--db", default=str(config.REEVAL_DIR / "reeval.sqlite"), help="Progress and response cache.")
+    parser.add_argument("--output", help="Report path (default: reeval/report_<run>_<time>.json).")
+    parser.add_argument("--stub", action="store_true", help="Use the local deterministic stub LLM server.")
+    args = parser.parse_args()
+
+    stub = None
+    llm_client = None
+    if args.stub:
+        from stub_llm import StubLLMServer
+        stub = StubLLMServer(latency=config.STUB_LLM_LATENCY).start()
+        llm_client = LLMClient(base_url=stub.base_url, api_key="stub", model="stub")
+    try:
+        evaluator = Reevaluator(llm_client, ResultStore(args.db), concurrency=args.concurrency)
+        print(f"Re-evaluating logs in {args.dir} (run {evaluator.run_id}, concurrency {evaluator.concurrency})...")
+        report = evaluator.run(iter_logs(Path(args.dir), include_stub=args.include_stub))
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    output = args.output or str(config.REEVAL_DIR / f"report_{report['run_id']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Logs: {report['logs']}, compared: {report['compared']}, errors: {report['errors']}, "
+          f"this run: {report['this_run']}")
+    print(f"Level changed: {report['level_changed']}, recommendation changed: {report['recommendation_changed']}, "
+          f"confidence delta mean {report['confidence_delta']['mean']}")
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Повтор записанных интервью через текущий конвейер агентов.
+
+Берет логи из interview/, подает записанные user_message в тот же раннер, который
+их писал (interview_log_* - final_test, остальные - structured), и сравнивает ход за
+ходом новые internal_thoughts и agent_visible_message с записанными: какие агенты
+в мыслях изменились, насколько (difflib), и поменялось ли финальное решение.
+Параллельно считается цена: латентность и токены по агентам. С --baseline отчет
+сравнивается с предыдущим прогоном (например, до правки промпта) - видно, какие
+*_PROMPT из config.py изменились и сколько это стоит.
+
+Сессии можно выбрать случайно (--sample, --seed) и остановиться раньше, как только
+разошлись --max-diverged сессий: чтобы увидеть, что промпт меняет поведение, весь архив не нужен.
+
+Примеры:
+    python src/replay.py --stub --workers 4
+    python src/replay.py --base-url http://localhost:8000/v1 --sample 20 --max-diverged 5
+    python src/replay.py --stub --baseline replays/replay_old.json
+"""
+import argparse
+import contextlib
+import difflib
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+# Если запускаем из корня, добавляем src в путь
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+import config
+from benchmark import AgentTimings, TimingAgentManager, _git_commit, summarize
+from knowledge_base import InterviewKnowledgeBase
+from llm_client import LLMClient
+from reevaluate import iter_logs, parse_old_decision
+from scenario_engine import get_runner
+from telemetry import telemetry
+
+REPLAYS_DIR = config.BASE_DIR / "replays"
+_SECTION_RE = re.compile(r"\[([A-Za-z-]+)\]:? ")
+_DIFF_LINES = 12
+
+
+def prompt_hashes() -> Dict[str, str]:
+    """
+    Короткие хеши всех *_PROMPT из config.py: по ним видно, какие промпты поменялись между прогонами.
+    """
+    return {name: hashlib.sha256(getattr(config, name).encode("utf-8")).hexdigest()[:12]
+            for name in sorted(dir(config)) if name.endswith("_PROMPT") and isinstance(getattr(config, name), str)}
+
+
+def thought_sections(thoughts: str) -> Dict[str, str]:
+    """
+    "[Fact-Checker]: ...\n[Mentor]: ..." или "[Router] ... | [Judge] ..." -> {агент: текст}.
+    """
+    parts = _SECTION_RE.split(thoughts or "")
+    return {parts[i]: parts[i + 1].strip(" |\n") for i in range(1, len(parts) - 1, 2)}
+
+
+def _similarity(a: str, b: str) -> float:
+    return round(difflib.SequenceMatcher(None, a or "", b or "").ratio(), 3)
+
+
+def _diff(a: str, b: str) -> List[str]:
+    lines = list(difflib.unified_diff((a or "").splitlines(), (b or "").splitlines(),
+                                      "recorded", "replayed", lineterm="", n=0))
+    return lines[:_DIFF_LINES]
+
+
+def diff_turns(recorded: List[Dict[str, Any]], replayed: List[Dict[str, Any]]) -> Dict[str, Any]:
+    turns = []
+    changed_agents: Dict[str, int] = {}
+    for old, new in zip(recorded, replayed):
+        old_sections = thought_sections(old.get("internal_thoughts", ""))
+        new_sections = thought_sections(new.get("internal_thoughts", ""))
+        agents = sorted(name for name in set(old_sections) | set(new_sections)
+                        if old_sections.get(name) != new_sections.get(name))
+        for name in agents:
+            changed_agents[name] = changed_agents.get(name, 0) + 1
+        message_changed = old.get("agent_visible_message") != new.get("agent_visible_message")
+        if not agents and not message_changed:
+            continue
+        turns.append({
+            "turn_id": old.get("turn_id"),
+            "changed_agents": agents,
+            "thoughts_similarity": _similarity(old.get("internal_thoughts"), new.get("internal_thoughts")),
+            "message_similarity": _similarity(old.get("agent_visible_message"), new.get("agent_visible_message")),
+            "message_diff": _diff(old.get("agent_visible_message"), new.get("agent_visible_message"))
+            if message_changed else [],
+        })
+    return {
+        "compared_turns": min(len(recorded), len(replayed)),
+        "missing_turns": max(0, len(recorded) - len(replayed)),
+        "extra_turns": max(0, len(replayed) - len(recorded)),
+        "changed_turns": len(turns),
+        "changed_agents": changed_agents,
+        "turns": turns,
+    }
+
+
+class ReplayHarness:
+    def __init__(self, llm_client: LLMClient, kb: InterviewKnowledgeBase = None, workers: int = 1,
+                 pipeline_mode: str = None, verbose: bool = False):
+        self.llm_client = llm_client
+        self.kb = kb or InterviewKnowledgeBase()
+        self.workers = max(1, workers)
+        self.pipeline_mode = pipeline_mode
+        self.verbose = verbose
+        self.timings = AgentTimings()
+
+    def _quiet(self):
+        # Раннеры много печатают; redirect_stdout глобален, поэтому глушим весь прогон, а не сессию
+        return contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    def replay_one(self, path: Path) -> Dict[str, Any]:
+        with open(path, "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+        runner_name = "final_test" if path.name.startswith("interview_log_") else "structured"
+        inputs = [turn["user_message"] for turn in recorded.get("turns", [])]
+        session_id = f"replay_{path.stem}"
+        log_dir = tempfile.mkdtemp(prefix="interview_replay_")
+        result = {"path": str(path), "runner": runner_name, "turns": len(inputs)}
+        started = time.perf_counter()
+        try:
+            manager = TimingAgentManager(self.timings, llm_client=self.llm_client, kb=self.kb)
+            output = get_runner(runner_name)(session_id, recorded.get("participant_name", "Candidate"), inputs,
+                                             manager=manager, log_dir=log_dir, pipeline_mode=self.pipeline_mode)
+            with open(next(Path(log_dir).glob("*.json")), "r", encoding="utf-8") as f:
+                replayed = json.load(f)
+        except Exception as e:
+            result.update(status="error", error=f"{type(e).__name__}: {e}")
+            return result
+        finally:
+            shutil.rmtree(log_dir, ignore_errors=True)
+
+        old_decision = parse_old_decision(recorded.get("final_feedback"))
+        new_decision = output["final_decision"]
+        result.update(
+            status="ok",
+            duration_sec=round(time.perf_counter() - started, 3),
+            turn_latencies=[round(t, 4) for t in output["turn_latencies"]],
+            diff=diff_turns(recorded.get("turns", []), replayed.get("turns", [])),
+            decision={
+                "old": old_decision,
+                "new": {"level": new_decision.level, "hiring_recommendation": new_decision.hiring_recommendation,
+                        "confidence_score": new_decision.confidence_score},
+            },
+        )
+        result["diverged"] = bool(result["diff"]["changed_turns"] or result["diff"]["missing_turns"]
+                                  or result["diff"]["extra_turns"]
+                                  or old_decision.get("level") != new_decision.level
+                                  or old_decision.get("hiring_recommendation") != new_decision.hiring_recommendation)
+        return result
+
+    def run(self, paths: List[Path], max_diverged: int = 0) -> Dict[str, Any]:
+        telemetry.reset()
+        results: List[Dict[str, Any]] = []
+        stopped_early = False
+        started = time.perf_counter()
+        with self._quiet(), ThreadPoolExecutor(max_workers=self.workers) as pool:
+            queue = deque(paths)
+            pending = set()
+            while queue or pending:
+                # Новые сессии не запускаем, если расхождений уже достаточно
+                diverged = sum(1 for r in results if r.get("diverged"))
+                if max_diverged and diverged >= max_diverged:
+                    stopped_early = bool(queue)
+                    queue.clear()
+                while queue and len(pending) < self.workers:
+                    pending.add(pool.submit(self.replay_one, queue.popleft()))
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(f.result() for f in finished)
+        wall = time.perf_counter() - started
+        return self.report(sorted(results, key=lambda r: r["path"]), wall, stopped_early)
+
+    def agent_costs(self) -> Dict[str, Dict[str, Any]]:
+        counters = telemetry.snapshot()["counters"]
+        costs = {}
+        for name, stats in self.timings.report().items():
+            calls = counters.get("llm_call", {}).get(name, 0)
+            prompt = counters.get("prompt_tokens", {}).get(name, 0)
+            completion = counters.get("completion_tokens", {}).get(name, 0)
+            costs[name] = {
+                "runs": stats["count"],
+                "mean_ms": stats["mean_ms"],
+                "p95_ms": stats["p95_ms"],
+                "total_sec": stats["total_sec"],
+                "llm_calls": calls,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "tokens_per_call": round((prompt + completion) / calls, 1) if calls else 0.0,
+            }
+        return costs
+
+    def report(self, results: List[Dict[str, Any]], wall_sec: float, stopped_early: bool) -> Dict[str, Any]:
+        ok = [r for r in results if r["status"] == "ok"]
+        turns = [t for r in ok for t in r["turn_latencies"]]
+        changed_agents: Dict[str, int] = {}
+        for r in ok:
+            for name, n in r["diff"]["changed_agents"].items():
+                changed_agents[name] = changed_agents.get(name, 0) + n
+        compared_turns = sum(r["diff"]["compared_turns"] for r in ok)
+        return {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": datetime.now().isoformat(),
+                "prompts": prompt_hashes(),
+                "pipeline_mode": self.pipeline_mode or config.PIPELINE_MODE,
+                "workers": self.workers,
+            },
+            "sessions": len(results),
+            "errors": len(results) - len(ok),
+            "diverged_sessions": sum(1 for r in ok if r["diverged"]),
+            "stopped_early": stopped_early,
+            "wall_sec": round(wall_sec, 3),
+            "turn_latency": summarize(turns),
+            "agents": self.agent_costs(),
+            "behavior": {
+                "compared_turns": compared_turns,
+                "changed_turns": sum(r["diff"]["changed_turns"] for r in ok),
+                "changed_agent_thoughts": changed_agents,
+                "level_changed": sum(1 for r in ok if r["decision"]["old"].get("level") != r["decision"]["new"]["level"]),
+                "recommendation_changed": sum(
+                    1 for r in ok
+                    if r["decision"]["old"].get("hiring_recommendation") != r["decision"]["new"]["hiring_recommendation"]),
+            },
+            "results": results,
+        }
+
+
+def compare_with_baseline(baseline: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Цена изменения относительно прошлого прогона: какие промпты поменялись, дельты латентности и токенов по агентам.
+    """
+    old_prompts = baseline["meta"].get("prompts", {})
+    new_prompts = current["meta"]["prompts"]
+    agents = {}
+    for name in sorted(set(baseline["agents"]) | set(current["agents"])):
+        old = baseline["agents"].get(name, {})
+        new = current["agents"].get(name, {})
+        agents[name] = {
+            key: round(new.get(key, 0) - old.get(key, 0), 2)
+            for key in ("mean_ms", "p95_ms", "tokens_per_call", "prompt_tokens", "completion_tokens")
+        }
+    return {
+        "baseline_commit": baseline["meta"].get("commit"),
+        "changed_prompts": sorted(name for name in set(old_prompts) | set(new_prompts)
+                                  if old_prompts.get(name) != new_prompts.get(name)),
+        "turn_latency_ms": {key: round(current["turn_latency"][key] - baseline["turn_latency"][key], 2)
+                            for key in ("p50_ms", "p95_ms", "mean_ms")},
+        "agents": agents,
+        "changed_turns": current["behavior"]["changed_turns"] - baseline["behavior"]["changed_turns"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded interviews through the current agent pipeline.")
+    parser.add_argument("--dir", default=str(config.BASE_DIR / "interview"), help="Folder with interview logs.")
+    parser.add_argument("--workers", type=int, default=config.SCENARIO_WORKERS, help="Sessions replayed in parallel.")
+    parser.add_argument("--sample", type=int, help="Replay a random sample of N sessions.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --sample and session order.")
+    parser.add_argument("--max-diverged", type=int, default=0,
+                        help="Stop starting new sessions after N of them diverged (0 - replay all).")
+    parser.add_argument("--mode", choices=["multi", "fused"], help="Analysis pipeline mode (default: PIPELINE_MODE).")
+    parser.add_argument("--stub", action="store_true", help="Use the local deterministic stub LLM server.")
+    parser.add_argument("--stub-latency", default=str(config.STUB_LLM_LATENCY))
+    parser.add_argument("--base-url", help="Replay against this OpenAI-compatible endpoint.")
+    parser.add_argument("--baseline", help="Previous replay report to compare costs with.")
+    parser.add_argument("--output", help="Report path (default: replays/replay_<time>_<commit>.json).")
+    parser.add_argument("--verbose", action="store_true", help="Keep runner output.")
+    args = parser.parse_args()
+
+    paths = list(iter_logs(Path(args.dir)))
+    rng = random.Random(args.seed)
+    if args.sample and args.sample < len(paths):
+        paths = rng.sample(paths, args.sample)
+    elif args.max_diverged:
+        # Ранняя остановка смотрит на первые сессии - они не должны быть всегда одними и теми же
+        rng.shuffle(paths)
+
+    stub = None
+    if args.stub:
+        from stub_llm import StubLLMServer
+        stub = StubLLMServer(latency=args.stub_latency).start()
+        llm_client = LLMClient(base_url=stub.base_url, api_key="stub", model="stub")
+    else:
+        llm_client = LLMClient(base_url=args.base_url) if args.base_url else LLMClient()
+    try:
+        harness = ReplayHarness(llm_client, workers=args.workers, pipeline_mode=args.mode, verbose=args.verbose)
+        print(f"Replaying {len(paths)} sessions from {args.dir}...")
+        report = harness.run(paths, max_diverged=args.max_diverged)
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["baseline"] = compare_with_baseline(json.load(f), report)
+
+    output = args.output
+    if not output:
+        os.makedirs(REPLAYS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = str(REPLAYS_DIR / f"replay_{stamp}_{report['meta']['commit']}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    behavior = report["behavior"]
+    print(f"Sessions: {report['sessions']} ({report['diverged_sessions']} diverged, {report['errors']} errors"
+          f"{', stopped early' if report['stopped_early'] else ''})")
+    print(f"Turns changed: {behavior['changed_turns']}/{behavior['compared_turns']}, "
+          f"by agent: {behavior['changed_agent_thoughts']}")
+    print(f"Final decision changed: level {behavior['level_changed']}, "
+          f"recommendation {behavior['recommendation_changed']}")
+    for name, stats in report["agents"].items():
+        print(f"  {name:14} mean {stats['mean_ms']:8.1f} ms  {stats['tokens_per_call']:7.1f} tokens/call")
+    if "baseline" in report:
+        base = report["baseline"]
+        print(f"\nVs {base['baseline_commit']}: changed prompts {base['changed_prompts'] or 'none'}, "
+              f"turn p50 {base['turn_latency_ms']['p50_ms']:+.1f} ms")
+        for name, delta in base["agents"].items():
+            print(f"  {name:14} mean {delta['mean_ms']:+8.1f} ms  {delta['tokens_per_call']:+7.1f} tokens/call")
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Ограничение хвостовой латентности LLM-вызовов.
+
+Все вызовы агентов идут через ResilientCaller:
+  - дедлайн на вызов по агенту (config.AGENT_DEADLINES);
+  - hedged request: если ответ не пришел за p95 недавних вызовов этого агента,
+    отправляется дубликат, берется первый ответ, второй отменяется;
+  - circuit breaker на профиль модели: после серии сбоев (таймауты и ошибки перегрузки
+    failure_errors, но не 4xx/ошибки валидации) вызовы сразу получают BreakerOpenError;
+    LLMClient переходит на следующий профиль цепочки отката, а когда профилей не осталось,
+    агент отдает деградированный ответ (см. BaseAgent.fallback).
+Вызовы выполняются как корутины (llm.ainvoke) в отдельном фоновом event loop,
+поэтому отмена задачи действительно обрывает HTTP-запрос к серверу.
+Каждый таймаут, hedge и переход breaker'а пишется в telemetry.
+Одновременно в полете не больше config.LLM_MAX_CONCURRENCY запросов; вызовы отмененной
+сессии (cancellation.CancelToken) снимаются из очереди и из полета сразу.
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+import config
+from cancellation import SessionCancelled, current_token
+from telemetry import telemetry
+
+
+class LLMUnavailableError(RuntimeError):
+    """
+    LLM не ответил вовремя или endpoint выключен circuit breaker'ом.
+    """
+
+
+class BreakerOpenError(LLMUnavailableError):
+    """
+    Вызов не отправлялся: breaker профиля открыт (можно сразу идти на другой профиль).
+    """
+
+
+class LatencyTracker:
+    """
+    Скользящее окно длительностей успешных вызовов одного агента.
+    """
+    def __init__(self, window: int = 200):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._values.append(seconds)
+
+    def __len__(self):
+        return len(self._values)
+
+    def percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Перцентиль с линейной интерполяцией (p95 из 20 замеров - не максимум); None, пока замеров меньше min_samples.
+        """
+        with self._lock:
+            if len(self._values) < max(1, min_samples):
+                return None
+            ordered = sorted(self._values)
+        pos = (len(ordered) - 1) * q / 100.0
+        low = int(pos)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold сбоев подряд) -> open -> (reset_timeout) -> half_open -> closed/open.
+    """
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or config.BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or config.BREAKER_RESET_TIMEOUT
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                # Пробный запрос после паузы
+                self.state = "half_open"
+                telemetry.record("breaker_half_open", f"profile:{self.name}")
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                telemetry.record("breaker_closed", f"profile:{self.name}")
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    telemetry.record("breaker_open", f"profile:{self.name}", failures=self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class _NullBreaker:
+    """
+    Для вызовов вне учета breaker'а: всегда пропускает, исходы не считает.
+    """
+    def allow(self) -> bool:
+        return True
+
+    def record_success(self):
+        pass
+
+    def record_failure(self):
+        pass
+
+
+_NO_BREAKER = _NullBreaker()
+
+
+class ResilientCaller:
+    """
+    failure_errors - исключения вызова, которые считаются сбоем endpoint'а для breaker'а
+    (у LLMClient - llm_client.OVERLOAD_ERRORS); таймауты считаются всегда.
+    """
+    def __init__(self, failure_errors: Tuple[Type[BaseException], ...] = ()):
+        self.failure_errors = failure_errors
+        self.latency: Dict[str, LatencyTracker] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        # Глубина очереди к серверу (меняется только в фоновом loop'е): ждут слот и в полете
+        self.waiting = 0
+        self.in_flight = 0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Фоновый event loop для всех LLM-вызовов процесса (создается при первом вызове).
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-loop", daemon=True).start()
+            return self._loop
+
+    def _tracker(self, agent: str) -> LatencyTracker:
+        with self._lock:
+            return self.latency.setdefault(agent, LatencyTracker())
+
+    def _breaker(self, profile: str) -> CircuitBreaker:
+        with self._lock:
+            return self.breakers.setdefault(profile, CircuitBreaker(profile))
+
+    def hedge_delay(self, agent: str) -> Optional[float]:
+        """
+        Через сколько секунд отправлять дубликат: p95 недавних вызовов агента.
+        None - hedging выключен или истории пока мало.
+        """
+        tracker = self._tracker(agent)
+        if not config.HEDGE_ENABLED or len(tracker) < config.HEDGE_MIN_SAMPLES:
+            return None
+        return max(config.HEDGE_MIN_DELAY, tracker.percentile(config.HEDGE_PERCENTILE))
+
+    async def _in_slot(self, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Запрос занимает слот конкурентности; отмененная задача освобождает его сразу.
+        """
+        if config.LLM_MAX_CONCURRENCY <= 0:
+            return await self._tracked(make_call)
+        if self._slots is None:
+            # Создается внутри фонового loop'а, поэтому гонки нет
+            self._slots = asyncio.Semaphore(config.LLM_MAX_CONCURRENCY)
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            return await self._tracked(make_call)
+        finally:
+            self._slots.release()
+
+    async def _tracked(self, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        self.in_flight += 1
+        try:
+            return await make_call()
+        finally:
+            self.in_flight -= 1
+
+    def queue_depth(self) -> int:
+        """
+        Запросы процесса, ждущие слот или ответ сервера (сигнал нагрузки для load_governor.py).
+        """
+        return self.waiting + self.in_flight
+
+    async def _run(self, agent: str, make_call: Callable[[], Awaitable[Any]],
+                   deadline: float, hedge_delay: Optional[float]) -> Any:
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._in_slot(make_call))
+        tasks = {primary}
+        last_error: Optional[BaseException] = None
+        hedged = False
+        try:
+            while tasks:
+                remaining = deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                wait_for = remaining
+                if hedge_delay is not None and not hedged:
+                    wait_for = min(remaining, max(0.0, hedge_delay - (time.monotonic() - started)))
+                done, tasks = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if hedged:
+                            telemetry.record("hedge_won", agent, winner="primary" if task is primary else "hedge")
+                        return task.result()
+                    last_error = task.exception()
+                if not done and hedge_delay is not None and not hedged:
+                    hedged = True
+                    telemetry.record("hedge", agent, delay=round(hedge_delay, 3))
+                    tasks.add(asyncio.ensure_future(self._in_slot(make_call)))
+            raise last_error or RuntimeError("LLM call finished without result")
+        finally:
+            # Проигравший дубликат или вызов после дедлайна - отменяем, чтобы не жечь GPU
+            for task in tasks:
+                task.cancel()
+
+    def call(self, agent: str, profile: str, make_call: Callable[[], Awaitable[Any]],
+             deadline: float = None, breaker: bool = True) -> Any:
+        """
+        Синхронный вызов корутины make_call() с дедлайном, hedging и circuit breaker.
+        Отмена текущего CancelToken обрывает вызов с SessionCancelled.
+        breaker=False - служебный вызов (прогрев при старте): breaker его не пропускает и не учитывает.
+        """
+        token = current_token()
+        if token is not None:
+            token.raise_if_cancelled()
+        breaker = self._breaker(profile) if breaker else _NO_BREAKER
+        if not breaker.allow():
+            telemetry.record("breaker_rejected", agent, profile=profile)
+            raise BreakerOpenError(f"Circuit breaker for '{profile}' is open")
+
+        deadline = deadline or config.AGENT_DEADLINES.get(agent, config.DEFAULT_AGENT_DEADLINE)
+        started = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(agent, make_call, deadline, self.hedge_delay(agent)), self.loop
+        )
+        unregister = token.on_cancel(future.cancel) if token is not None else (lambda: None)
+        try:
+            result = future.result()
+        except concurrent.futures.CancelledError:
+            # Не сбой endpoint'а - breaker не трогаем
+            telemetry.record("cancelled", agent, profile=profile)
+            raise SessionCancelled(f"{agent} call cancelled: {token.reason if token else 'cancelled'}")
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            telemetry.record("timeout", agent, profile=profile, deadline=deadline)
+            raise LLMUnavailableError(f"{agent} did not answer within {deadline}s")
+        except Exception as e:
+            # 4xx и ошибки валидации - не перегрузка: сервер ответил, для breaker'а это успех
+            # (иначе неудачная по 4xx проба оставила бы его в half_open)
+            if isinstance(e, self.failure_errors):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            telemetry.record("error", agent, profile=profile, error=type(e).__name__)
+            raise
+        except BaseException:
+            # Ctrl+C во время ожидания: не оставляем запрос висеть в loop'е
+            future.cancel()
+            raise
+        finally:
+            unregister()
+        breaker.record_success()
+        self._tracker(agent).add(time.monotonic() - started)
+        return result
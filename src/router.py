@@ -0,0 +1,115 @@
+"""
+Локальный маршрутизатор сообщений кандидата.
+
+До вызова LLM-агентов решает, кому из них действительно есть что делать:
+  - "stop": кандидат просит закончить -> сразу к DecisionMaker;
+  - "acknowledgement": короткое "Да"/"Знаю"/"Нет" -> без FactChecker
+    (проверять нечего), Психолог и Ментор работают как обычно;
+  - "answer": полный конвейер.
+Только эвристики: остановка - по регулярному выражению на всё сообщение. Эмбеддинги
+(англоязычная модель базы знаний) для этого не годятся: короткие русские ответы вроде
+"Да" или "Знаю" оказываются близко к русским стоп-фразам, а ложная остановка обрывает
+интервью. Каждое решение сохраняется для аудита. Проверка на примерах: python src/router.py
+"""
+import re
+from typing import Any, Dict, List
+
+import config
+from schemas import FactCheckReport, RoutingDecision
+
+# Просьба остановиться - только если она и есть всё сообщение (плюс вежливые слова и пунктуация):
+# "Стоп, я хочу уточнить вопрос" или "Хватит про Python, давайте SQL" - обычные ответы
+_STOP_FILLER = (r"(?:пожалуйста|спасибо|давайте|давай|может|можно|я|мы|хочу|хотел|хотела|бы|всё|все|на этом|уже|"
+                r"please|thanks|thank you|let's|i|we|want to|would like to|can|now|here)")
+_STOP_VERB = r"(?:стоп|stop|хватит|enough|закончим|заканчиваем|завершим|закончить|завершить|прекратим|end|finish)"
+_STOP_OBJECT = r"(?:интервью|собеседование|игра|игру|(?:the )?interview|(?:the )?game)"
+STOP_PATTERNS = re.compile(
+    rf"^(?:{_STOP_FILLER}[\s,]+)*{_STOP_VERB}(?:\s+{_STOP_OBJECT})?(?:[\s,]+{_STOP_FILLER})*[\s.!?…]*$",
+    re.IGNORECASE,
+)
+# Примеры для check_routing(): ответы сценария final_test_4 и короткие технические ответы - не остановка
+NOT_STOP_EXAMPLES = [
+    "Да", "Знаю", "Нет", "Не знаю", "Ну это когда проверяют регрессию. Повторно тестируют.",
+    "GIL мешает потокам", "Индекс ускоряет поиск", "Использую asyncio и aiohttp", "Закончил проект на Django",
+    "Стоп, я хочу уточнить вопрос", "Хватит про Python, давайте SQL", "Stop-the-world в сборщике мусора",
+]
+STOP_EXAMPLES = [
+    "STOP", "Стоп.", "Стоп интервью.", "Стоп игра", "Давайте закончим", "Давайте на этом закончим собеседование.",
+    "Я хочу завершить интервью.", "Можно закончить собеседование?", "Let's end the interview here.",
+    "I want to stop the interview now",
+]
+ACK_WORDS = {
+    "да", "нет", "не", "знаю", "ок", "окей", "угу", "ага", "понятно", "хорошо", "ладно", "конечно",
+    "наверное", "возможно", "yes", "no", "ok", "okay", "sure", "maybe",
+}
+_WORD_RE = re.compile(r"[\w+#-]+", re.UNICODE)
+
+
+class AgentRouter:
+    def __init__(self, enabled: bool = None):
+        self.enabled = config.AGENT_ROUTER_ENABLED if enabled is None else enabled
+        self.decisions: List[Dict[str, Any]] = []
+
+    def route(self, message: str, turn: int = None) -> RoutingDecision:
+        text = (message or "").strip()
+        words = [w.lower() for w in _WORD_RE.findall(text)]
+
+        if text.upper() == "STOP":
+            # Явная команда из исходного интерфейса работает всегда
+            decision = RoutingDecision(intent="stop", stop=True, reason="explicit STOP command")
+        elif not self.enabled:
+            decision = RoutingDecision(intent="answer", reason="router disabled")
+        elif len(words) <= config.ROUTER_STOP_MAX_WORDS and STOP_PATTERNS.match(text):
+            decision = RoutingDecision(intent="stop", stop=True, reason="stop phrase")
+        elif words and len(words) <= config.ROUTER_ACK_MAX_WORDS and all(w in ACK_WORDS for w in words):
+            decision = RoutingDecision(intent="acknowledgement", run_fact_checker=False,
+                                       reason="short acknowledgement without a technical claim")
+        else:
+            decision = RoutingDecision(intent="answer", reason="full pipeline")
+
+        self.decisions.append({
+            "turn": turn,
+            "message": text[:200],
+            "intent": decision.intent,
+            "fact_checker": decision.run_fact_checker,
+            "psychologist": decision.run_psychologist,
+            "mentor": decision.run_mentor,
+            "reason": decision.reason,
+        })
+        return decision
+
+    @staticmethod
+    def skipped_fact_report(decision: RoutingDecision) -> FactCheckReport:
+        """
+        Заглушка отчета Фактчекера, когда роутер его не вызывал.
+        """
+        return FactCheckReport(verdict="OPINION", evidence=f"Fact-check skipped by router: {decision.reason}.")
+
+    def audit(self) -> Dict[str, Any]:
+        skipped = sum(1 for d in self.decisions if not d["fact_checker"])
+        return {
+            "enabled": self.enabled,
+            "messages": len(self.decisions),
+            "fact_checks_skipped": skipped,
+            "stops": sum(1 for d in self.decisions if d["intent"] == "stop"),
+            "decisions": self.decisions,
+        }
+
+
+def check_routing(router: AgentRouter) -> List[str]:
+    """
+    Ошибки маршрутизации на STOP_EXAMPLES/NOT_STOP_EXAMPLES (пустой список - всё верно).
+    """
+    errors = [f"stop expected: {text!r} -> {router.route(text).reason}"
+              for text in STOP_EXAMPLES if not router.route(text).stop]
+    errors += [f"not a stop: {text!r} -> {router.route(text).reason}"
+               for text in NOT_STOP_EXAMPLES if router.route(text).stop]
+    return errors
+
+
+if __name__ == "__main__":
+    errors = check_routing(AgentRouter(enabled=True))
+    for error in errors:
+        print(error)
+    print("Роутер: ошибок нет." if not errors else f"Роутер: ошибок - {len(errors)}.")
+    raise SystemExit(1 if errors else 0)
@@ -0,0 +1,172 @@
+"""
+Движок прогона сценариев.
+
+Сценарии загружаются из scenarios/*.json (см. schemas.ScenarioSpec) и
+выполняются параллельно в пуле потоков. Клиент LLM и база знаний создаются
+один раз и общие для всех сценариев. С флагом --stub вместо реального сервера
+поднимается локальный stub_llm, так что регрессия идет без сети и с
+воспроизводимыми таймингами.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Если запускаем из корня, добавляем src в путь
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+import config
+from schemas import ScenarioSpec
+from agents import AgentManager
+from llm_client import LLMClient
+from knowledge_base import InterviewKnowledgeBase
+from tracing import tracer
+
+
+def load_scenarios(directory: str = None, runner: str = None, only: Optional[List[str]] = None) -> List[ScenarioSpec]:
+    """
+    Читает все *.json из папки сценариев в алфавитном порядке.
+    runner - оставить только сценарии этого раннера, only - только эти id.
+    """
+    directory = Path(directory) if directory else config.SCENARIOS_DIR
+    scenarios = []
+    for path in sorted(directory.glob("*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            spec = ScenarioSpec(**json.load(f))
+        if runner and spec.runner != runner:
+            continue
+        if only and spec.id not in only:
+            continue
+        scenarios.append(spec)
+    return scenarios
+
+
+def get_runner(name: str) -> Callable:
+    # Импорт внутри функции: раннеры сами импортируют движок в своих __main__
+    if name == "structured":
+        from scenario_runner import run_scenario
+        return run_scenario
+    from final_test_runner import run_final_test_scenario
+    return run_final_test_scenario
+
+
+class ScenarioEngine:
+    """
+    Параллельный прогон сценариев. Каждый сценарий получает свой AgentManager,
+    но с общими LLMClient и InterviewKnowledgeBase.
+    """
+    def __init__(self, workers: int = 1, llm_client: LLMClient = None,
+                 kb: InterviewKnowledgeBase = None, log_dir: str = None, pipeline_mode: str = None,
+                 resume: bool = False):
+        self.workers = max(1, workers)
+        self.llm_client = llm_client
+        self.kb = kb
+        self.log_dir = log_dir
+        # Режим анализа по умолчанию; сценарий может задать свой в pipeline_mode
+        self.pipeline_mode = pipeline_mode
+        # Продолжать сценарии с чекпоинта упавшего прогона
+        self.resume = resume
+
+    def run_one(self, spec: ScenarioSpec) -> Dict[str, Any]:
+        """
+        Один сценарий в текущем потоке (так же его запускают воркеры worker_pool.py).
+        """
+        runner = get_runner(spec.runner)
+        manager = AgentManager(llm_client=self.llm_client, kb=self.kb)
+        started = time.perf_counter()
+        result = {"id": spec.id, "title": spec.title, "runner": spec.runner, "turns": len(spec.inputs)}
+        try:
+            output = runner(spec.id, spec.participant_name, spec.inputs, manager=manager, log_dir=self.log_dir,
+                            pipeline_mode=spec.pipeline_mode or self.pipeline_mode, resume=self.resume)
+            result["status"] = "ok"
+            result["turn_latencies"] = [round(t, 4) for t in output["turn_latencies"]]
+        except Exception as e:
+            print(f"Error in Scenario {spec.id}: {e}")
+            result["status"] = "error"
+            result["error"] = str(e)
+        result["duration_sec"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def run(self, scenarios: List[ScenarioSpec]) -> List[Dict[str, Any]]:
+        # Тяжелые объекты создаем заранее, до запуска потоков
+        if self.llm_client is None:
+            self.llm_client = LLMClient()
+        if self.kb is None:
+            self.kb = InterviewKnowledgeBase()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self.run_one, scenarios))
+        total = time.perf_counter() - started
+
+        print(f"\n=== Прогон завершен: {len(results)} сценариев, {self.workers} воркеров, {total:.2f} c ===")
+        for r in results:
+            print(f"  [{r['status']}] {r['id']} ({r['title']}): {r['duration_sec']:.2f} c")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run interview scenarios in parallel.")
+    parser.add_argument("--dir", default=str(config.SCENARIOS_DIR), help="Folder with scenario JSON files.")
+    parser.add_argument("--runner", choices=["final_test", "structured"], help="Run only scenarios of this runner.")
+    parser.add_argument("--only", nargs="*", help="Scenario ids to run.")
+    parser.add_argument("--workers", type=int, default=config.SCENARIO_WORKERS)
+    parser.add_argument("--mode", choices=["multi", "fused"], help="Analysis pipeline mode (default: PIPELINE_MODE).")
+    parser.add_argument("--stub", action="store_true", help="Use the local deterministic stub LLM server.")
+    parser.add_argument("--stub-latency", default=str(config.STUB_LLM_LATENCY),
+                        help="Seconds or a distribution, e.g. 'uniform:0.1:0.4' (see stub_llm.LatencyModel).")
+    parser.add_argument("--stub-responses", help="JSON file with canned responses for the stub.")
+    parser.add_argument("--profiles", help="JSON file with model profiles (see config.MODEL_PROFILES_FILE).")
+    parser.add_argument("--log-dir", help="Where to write interview logs.")
+    parser.add_argument("--report", help="Write per-scenario timings to this JSON file.")
+    parser.add_argument("--trace", choices=["chrome", "otlp"], help="Record tracing spans and export them.")
+    parser.add_argument("--resume", action="store_true", help="Continue scenarios from their checkpoints.")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Run in N pre-forked processes sharing the embedding model (see worker_pool.py).")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.enabled = True
+
+    scenarios = load_scenarios(args.dir, runner=args.runner, only=args.only)
+    stub = None
+    llm_kwargs = {"profiles_file": args.profiles} if args.profiles else {}
+    log_dir = args.log_dir
+    if args.stub:
+        from stub_llm import StubLLMServer, load_responses
+        responses = load_responses(args.stub_responses) if args.stub_responses else None
+        stub = StubLLMServer(responses=responses, latency=args.stub_latency).start()
+        # Профили (--profiles) сохраняются, stub лишь подменяет endpoint и модель во всех
+        llm_kwargs = {**llm_kwargs, "base_url": stub.base_url, "api_key": "stub", "model": "stub"}
+        # Не перезаписываем настоящие логи интервью
+        log_dir = log_dir or str(config.STUB_LOG_DIR)
+        print(f"Stub LLM: {stub.base_url} (latency {stub.latency.spec})")
+
+    try:
+        if args.processes:
+            from worker_pool import PreforkPool
+            results = PreforkPool(args.processes, llm_kwargs=llm_kwargs, log_dir=log_dir,
+                                  pipeline_mode=args.mode, resume=args.resume).run(scenarios)["scenarios"]
+        else:
+            llm_client = LLMClient(**llm_kwargs) if llm_kwargs else None
+            results = ScenarioEngine(workers=args.workers, llm_client=llm_client, log_dir=log_dir,
+                                     pipeline_mode=args.mode, resume=args.resume).run(scenarios)
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    trace_path = tracer.export(fmt=args.trace)
+    if trace_path:
+        print(f"Trace saved to {trace_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,37 @@
 from agents import (
     AgentManager, FactCheckerAgent, PsychologistAgent, MentorAgent, 
-    InterviewerAgent, DecisionMakerAgent, JudgeAgent, SummarizerAgent
+    InterviewerAgent, DecisionMakerAgent, JudgeAgent, SummarizerAgent, FusedAnalystAgent
 )
 from logger import InterviewLogger
+import config
 from config import BASE_DIR
+from tracing import tracer
+from telemetry import telemetry
+from prefetch import SpeculativePrefetcher
+from cancellation import CancelToken, cancel_scope, run_in_background
+from judge_policy import JudgePolicy
+from router import AgentRouter
+from load_governor import pipeline_for, runs_judge, runs_psychologist, skipped_psych_profile, templated_turn
+from session import Transcript
+from checkpoint import SessionCheckpoint, SessionState
+from scoreboard import Scoreboard
+from pathlib import Path
 import json
+import os
+import time
+from collections import Counter
 
-def run_scenario(scenario_name: str, candidate_name: str, inputs: list):
-    print(f"\n=== Running Scenario (v3 - Structured): {scenario_name} ===")
+def run_scenario(scenario_name: str, candidate_name: str, inputs: list,
+                 manager: AgentManager = None, log_dir: str = None, pipeline_mode: str = None,
+                 resume: bool = False):
+    pipeline_mode = pipeline_mode or config.PIPELINE_MODE
+    print(f"\n=== Running Scenario (v3 - Structured, {pipeline_mode}): {scenario_name} ===")
     
-    logger = InterviewLogger(filename=str(BASE_DIR / "interview" / f"scenario_v3_{scenario_name}.json"))
-    manager = AgentManager()
+    interview_dir = Path(log_dir) if log_dir else BASE_DIR / "interview"
+    os.makedirs(interview_dir, exist_ok=True)
+    logger = InterviewLogger(filename=str(interview_dir / f"scenario_v3_{scenario_name}.json"))
+    if manager is None:
+        manager = AgentManager()
     
     # Register V2/V3 Agents
     manager.register_agent("FactChecker", FactCheckerAgent)
@@ -20,6 +41,7 @@ def run_scenario(scenario_name: str, candidate_name: str, inputs: list):
     manager.register_agent("DecisionMaker", DecisionMakerAgent)
     manager.register_agent("Judge", JudgeAgent)
     manager.register_agent("Summarizer", SummarizerAgent)
+    manager.register_agent("FusedAnalyst", FusedAnalystAgent)
     
     fact_checker = manager.get_agent("FactChecker")
     psychologist = manager.get_agent("Psychologist")
@@ -28,132 +50,250 @@ def run_scenario(scenario_name: str, candidate_name: str, inputs: list):
     decision_maker = manager.get_agent("DecisionMaker")
     judge = manager.get_agent("Judge")
     summarizer = manager.get_agent("Summarizer")
+    fused_analyst = manager.get_agent("FusedAnalyst")
     
     logger.start_session(candidate_name)
-    history = []
-    # We maintain a separate full text log for the Decision Maker, 
-    # as it might need the full context even if we summarize for other agents.
-    # However, for huge contexts, Decision Maker might also need a summarized version.
-    # For now, we keep full log text, assuming it fits in context (or DM uses RAG).
-    full_log_text = ""
-    summary_so_far = ""
+    # Per-turn checkpoint; resume=True continues a crashed run after its last completed turn
+    checkpoint = SessionCheckpoint(f"scenario_{scenario_name}")
+    state = checkpoint.load() if resume else None
+    if state is not None:
+        logger.restore_turns(state.log_turns)
+        print(f"Resuming after turn {state.turn}.")
+    else:
+        # Fresh run: files left by an earlier run must not be mixed into this one
+        checkpoint.clear()
+        state = SessionState(checkpoint.session_id, transcript=Transcript(), extra={"summary_so_far": ""})
+    # Working history for the agents plus the full log for the Decision Maker:
+    # summarization only compacts the former, Transcript.full_log() keeps every turn.
+    history = state.transcript
+    summary_so_far = state.extra.get("summary_so_far", "")
+    judge_policy = JudgePolicy(seed=scenario_name)
+    router = AgentRouter()
+    # Turn quality tier by LLM server load (shared by all sessions of the client)
+    governor = manager.llm_client.governor
+    tier_counts = Counter()
+    # Next questions come from the question bank; asked ones are kept in the checkpoint
+    questions = None
+    if config.QUESTION_BANK:
+        questions = manager.kb.question_bank.session(state.extra.get("questions"), classify=manager.kb.classify_topic)
+    # Running skill scoreboard: the Mentor and the Decision Maker read it instead of long transcripts
+    scoreboard = None
+    if config.SCOREBOARD:
+        scoreboard = Scoreboard(state.extra.get("scoreboard"), classify=manager.kb.classify_topic)
     
     print("System started.")
+    turn_latencies = []
+    turn_reports = []
+    # Memory Management: Summarize if history gets too long (e.g., > 6 turns)
+    # 6 turns = 3 user + 3 system.
+    MEMORY_THRESHOLD = 6
+    # Summarization runs in the background while the candidate answers; cancelled when the session stops
+    session_token = CancelToken(scenario_name)
+    summary_token = None
+    pending_summary = None
+    # PREFETCH=1: between turns, prepare question facts and warm the KV cache for the Mentor
+    prefetcher = SpeculativePrefetcher(manager.kb, mentor, session_token)
     
-    for user_input in inputs:
-        print(f"\n{candidate_name}: {user_input}")
+    with tracer.span("session", session=scenario_name, runner="structured"), cancel_scope(session_token):
+        for turn_no, user_input in enumerate(inputs, 1):
+            if turn_no <= state.turn:
+                continue
+            print(f"\n{candidate_name}: {user_input}")
+            # Local routing: a stop request goes straight to the Decision Maker
+            routing = router.route(user_input, turn=turn_no)
+            if routing.stop:
+                print(f"[Router]: {routing.reason} -> final decision")
+                break
+            session_token.raise_if_cancelled()
+            prefetched = prefetcher.take()
+            extra_ctx = prefetched.context() if prefetched else {}
+            with tracer.span("turn", session=scenario_name, turn=turn_no):
+                turn_started = time.perf_counter()
+                compacted = None
         
-        # Memory Management: Summarize if history gets too long (e.g., > 6 turns)
-        # 6 turns = 3 user + 3 system.
-        MEMORY_THRESHOLD = 6
-        if len(history) > MEMORY_THRESHOLD:
-            print("\n[System]: Consolidating Memory...")
-            summary_obj = summarizer.run({"history": history})
-            summary_so_far = summary_obj.summary
-            # Be careful: we want to keep RECENT history for flow, but summarize OLD history.
-            # Strategy: Keep last 2 turns (4 messages), summarize the rest.
-            # For simplicity here: We just store the summary in a separate variable 
-            # and maybe prepend it to the history sent to agents?
-            # Or we physically truncate self.history.
-            # Let's truncate: Keep last 2 turns, replace older with a system message "Summary: ..."
-            
-            recent_history = history[-2:]
-            history = [{"role": "System", "content": f"Previous conversation summary: {summary_so_far}"}] + recent_history
-            print(f"[Summarizer]: {summary_so_far}")
+                if pending_summary is not None:
+                    print("\n[System]: Consolidating Memory...")
+                    with tracer.span("summarization", history_len=len(history)):
+                        summary_obj = pending_summary.result()
+                    pending_summary = None
+                    summary_so_far = summary_obj.summary
+                    # Keep the last 2 messages for flow, replace older ones with a system message "Summary: ..."
+                    history.compact(summary_so_far, keep=2)
+                    compacted = {"summary": summary_so_far, "keep": 2}
+                    print(f"[Summarizer]: {summary_so_far}")
 
-        history.append({"role": "Candidate", "content": user_input})
-        full_log_text += f"\nCandidate: {user_input}"
-        
-        # 1. Parallel Analysis
-        fact_report = fact_checker.run({"user_message": user_input})
-        psych_report = psychologist.run({"user_message": user_input})
+                history.append("Candidate", user_input)
+                tier = governor.tier()
+                tier_counts[tier] += 1
+                turn_mode = pipeline_for(tier, pipeline_mode)
+                templated_response = None
         
-        # fact_report and psych_report are Pydantic models.
-        print(f"[Fact-Checker]: {fact_report.verdict} | {fact_report.evidence}")
-        print(f"[Psychologist]: {psych_report.emotional_state} | {psych_report.communication_style}")
+                if turn_mode == "templated":
+                    # Server overloaded: no LLM calls this turn, a templated follow-up question
+                    fact_report, psych_report, mentor_strategy, templated_response = templated_turn(turn_no)
+                elif turn_mode == "fused":
+                    # 1+2. Fused Analysis: fact-check, psych profile and mentor strategy in one LLM call
+                    analysis = fused_analyst.run({"user_message": user_input, "history": history, **extra_ctx})
+                    fact_report = analysis.fact_check
+                    psych_report = analysis.psych_profile
+                    mentor_strategy = analysis.mentor_strategy
+                    if scoreboard is not None:
+                        scoreboard.update(user_input, fact_report, psych_report,
+                                          topic=questions.topic if questions is not None else None)
+                else:
+                    # 1. Parallel Analysis (the router may skip fact-checking for short acknowledgements)
+                    if routing.run_fact_checker:
+                        fact_report = fact_checker.run({"user_message": user_input, **extra_ctx})
+                    else:
+                        fact_report = router.skipped_fact_report(routing)
+                    if runs_psychologist(tier):
+                        psych_report = psychologist.run({"user_message": user_input})
+                    else:
+                        psych_report = skipped_psych_profile(tier)
+                    if scoreboard is not None:
+                        scoreboard.update(user_input, fact_report, psych_report,
+                                          topic=questions.topic if questions is not None else None)
+            
+                    # 2. Mentor Strategy
+                    mentor_strategy = mentor.run({
+                        "history": history,
+                        "fact_check": fact_report.model_dump_json(),
+                        "psych_profile": psych_report.model_dump_json(),
+                        "scoreboard": scoreboard,
+                        **extra_ctx
+                    })
         
-        # 2. Mentor Strategy
-        mentor_strategy = mentor.run({
-            "history": history,
-            "fact_check": fact_report.model_dump_json(),
-            "psych_profile": psych_report.model_dump_json()
-        })
-        print(f"[Mentor]: {mentor_strategy.strategy} -> {mentor_strategy.instruction} (Tone: {mentor_strategy.tone})")
+                # fact_report and psych_report are Pydantic models.
+                print(f"[Fact-Checker]: {fact_report.verdict} | {fact_report.evidence}")
+                print(f"[Psychologist]: {psych_report.emotional_state} | {psych_report.communication_style}")
+                print(f"[Mentor]: {mentor_strategy.strategy} -> {mentor_strategy.instruction} (Tone: {mentor_strategy.tone})")
         
-        # 3. Interviewer Response Generation & Judge Loop
-        approved = False
-        attempts = 0
-        MAX_RETRIES = 2
-        response_text = ""
+                # 3. Interviewer Response Generation & Judge Loop
+                approved = False
+                attempts = 0
+                MAX_RETRIES = 2
+                response_text = ""
         
-        current_instruction = mentor_strategy.instruction
-        current_tone = mentor_strategy.tone
+                current_instruction = mentor_strategy.instruction
+                current_tone = mentor_strategy.tone
+                # Bank question when the Mentor moves on: the Interviewer only rephrases it
+                # (after a Judge rejection - generated as before). It counts as asked only once the Judge approves it
+                question = asked_question = None
+                if questions is not None and templated_response is None and mentor_strategy.interview_status != "TERMINATE":
+                    question = questions.next_for(user_input, fact_report.verdict, mentor_strategy, mark=False)
         
-        while not approved and attempts < MAX_RETRIES:
-            attempts += 1
-            response_text = interviewer.run({
-                "history": history,
-                "instruction": current_instruction,
-                "tone": current_tone
-            })
+                while not approved and attempts < MAX_RETRIES:
+                    session_token.raise_if_cancelled()
+                    attempts += 1
+                    with tracer.span("judge_attempt", attempt=attempts) as attempt_span:
+                        bank_question = question.text if question is not None and attempts == 1 else None
+                        response_text = templated_response or interviewer.run({
+                            "history": history,
+                            "instruction": current_instruction,
+                            "tone": current_tone,
+                            "bank_question": bank_question
+                        })
+                        judge_instruction = (f"Ask this question from the question bank: {bank_question}"
+                                             if bank_question else current_instruction)
             
-            # Judge Check
-            verdict = judge.run({
-                "history": history,
-                "instruction": current_instruction,
-                "generated_response": response_text
-            })
+                        # Judge Check (local pre-filter, then LLM Judge only when the policy asks for it)
+                        verdict, judge_source = judge_policy.review(
+                            response_text, mentor_strategy, attempts,
+                            lambda: judge.run({
+                                "history": history,
+                                "instruction": judge_instruction,
+                                "generated_response": response_text
+                            }),
+                            allow_llm=runs_judge(tier)
+                        )
+                        attempt_span.set(approved=verdict.approved, score=verdict.score, source=judge_source)
             
-            if verdict.approved:
-                approved = True
-                print(f"[Judge]: Approved (Score: {verdict.score})")
-            else:
-                print(f"[Judge]: Rejected. Feedback: {verdict.feedback}")
-                # Refine instruction for retry
-                current_instruction = f"{mentor_strategy.instruction} (CRITICAL FEEDBACK: {verdict.feedback})"
+                    if verdict.approved:
+                        approved = True
+                        print(f"[Judge]: Approved (Score: {verdict.score}, {judge_source})")
+                        if bank_question:
+                            questions.mark_asked(question)
+                            asked_question = question
+                    else:
+                        print(f"[Judge]: Rejected. Feedback: {verdict.feedback}")
+                        # Refine instruction for retry
+                        current_instruction = f"{mentor_strategy.instruction} (CRITICAL FEEDBACK: {verdict.feedback})"
         
-        if not approved:
-            print("[System]: Max retries reached. Using last response.")
+                if not approved:
+                    print("[System]: Max retries reached. Using last response.")
         
-        history.append({"role": "Interviewer", "content": response_text})
-        full_log_text += f"\nInterviewer: {response_text}"
+                history.append("Interviewer", response_text)
+                prefetcher.start(history)
+                if len(history) > MEMORY_THRESHOLD:
+                    # Start consolidating memory now, the result is applied at the start of the next turn
+                    summary_token = session_token.child()
+                    pending_summary = run_in_background(summarizer.run, {"history": list(history)}, token=summary_token)
         
-        # Logging
-        combined_thoughts = (
-            f"[Fact-Checker] {fact_report.model_dump_json()} | "
-            f"[Psychologist] {psych_report.model_dump_json()} | "
-            f"[Mentor] {mentor_strategy.model_dump_json()}"
-        )
-        logger.log_turn(user_input, combined_thoughts, response_text)
-        print(f"[Interviewer]: {response_text}")
+                # Logging
+                combined_thoughts = (
+                    f"[Router] {routing.intent}: {routing.reason} | "
+                    f"[Fact-Checker] {fact_report.model_dump_json()} | "
+                    f"[Psychologist] {psych_report.model_dump_json()} | "
+                    f"[Mentor] {mentor_strategy.model_dump_json()} | "
+                    f"[Judge] {judge_source}: {verdict.model_dump_json()}"
+                )
+                if asked_question is not None:
+                    combined_thoughts += f" | [Question-Bank] {asked_question.topic}/{asked_question.level}: {asked_question.text}"
+                with tracer.span("logging"):
+                    log_entry = logger.log_turn(user_input, combined_thoughts, response_text, quality_tier=tier)
+                    state.turn = turn_no
+                    state.log_turns.append(log_entry)
+                    state.extra["summary_so_far"] = summary_so_far
+                    turn_extra = {"summary_so_far": summary_so_far}
+                    if questions is not None:
+                        state.extra["questions"] = turn_extra["questions"] = questions.to_state()
+                    if scoreboard is not None:
+                        state.extra["scoreboard"] = turn_extra["scoreboard"] = scoreboard.to_state()
+                    checkpoint.record_turn(state, [["Candidate", user_input], ["Interviewer", response_text]],
+                                           log_turn=log_entry, compact=compacted, extra=turn_extra)
+                print(f"[Interviewer]: {response_text}")
+                turn_latencies.append(time.perf_counter() - turn_started)
+                governor.observe_turn(turn_latencies[-1])
+                turn_reports.append({
+                    "fact_verdict": fact_report.verdict,
+                    "tone": mentor_strategy.tone,
+                    "interview_status": mentor_strategy.interview_status,
+                })
+
+        prefetcher.cancel("interview finished")
+        if pending_summary is not None and not pending_summary.done():
+            # The Decision Maker reads the full log, the pending summary is not needed anymore
+            summary_token.cancel("interview finished")
 
-    # 4. Final Decision
-    final_decision = decision_maker.run({"full_log": full_log_text})
+        # 4. Final Decision
+        if scoreboard is not None:
+            final_decision = decision_maker.run({"scoreboard": scoreboard, "history": history})
+        else:
+            final_decision = decision_maker.run({"full_log": history.full_log()})
     
-    # Save formatted feedback
-    logger.log_feedback(final_decision.model_dump_json(indent=2))
+        # Save formatted feedback
+        logger.log_feedback(final_decision.model_dump_json(indent=2))
+        judge_metrics = judge_policy.metrics()
+        logger.log_metrics("judge", judge_metrics)
+        logger.log_metrics("routing", router.audit())
+        if scoreboard is not None:
+            logger.log_metrics("scoreboard", scoreboard.to_state())
+        logger.log_metrics("load_tiers", {"turns": dict(tier_counts), "governor": governor.metrics()})
+        # Timeouts, hedged requests, breaker and degradation (process-wide counters)
+        logger.log_metrics("llm_events", telemetry.snapshot())
+        # Knowledge base shard sizes and where the queries went
+        logger.log_metrics("kb_shards", manager.kb.shard_stats())
+        print(f"[Judge policy]: {judge_metrics['judge_calls']}/{judge_metrics['responses']} LLM calls, "
+              f"{judge_metrics['skipped']} skipped, {judge_metrics['prefilter_rejections']} pre-filter rejections")
     
-    print(f"\nFinal Decision:\n{final_decision.model_dump_json(indent=2)}")
+        print(f"\nFinal Decision:\n{final_decision.model_dump_json(indent=2)}")
+    checkpoint.clear()
     print(f"Scenario {scenario_name} completed. Log saved.")
+    return {"final_decision": final_decision, "turn_latencies": turn_latencies, "turn_reports": turn_reports}
 
 if __name__ == "__main__":
-    # 1. Middle Developer Scenario
-    inputs_middle = [
-        "Привет. Меня зовут Алекс, я Middle Python разработчик. Работал 2 года с Django и Postgres.",
-        "Generators save memory because they yield items one by one instead of storing the list.",
-        "GIL prevents multiple threads from executing python bytecode at once, so CPU-bound tasks are single-threaded.",
-        "Для оптимизации SQL запросов я использую индексы и стараюсь избегать N+1 через select_related.",
-        "Стоп игра."
-    ]
-    
-    # 2. Senior Developer Scenario
-    inputs_senior = [
-        "Привет. Я Алекс, Senior Backend. 5 лет опыта, строил микросервисы на FastAPI, Highload системы.",
-        "Python's asyncio uses an event loop to handle I/O bound tasks concurrently without OS threads.",
-        "For database sharding, I prefer key-based sharding for even distribution, but it makes resharding hard.",
-        "Metaclasses allow intercepting class creation. Useful for frameworks, but I avoid them in business logic to keep code readable.",
-        "Стоп игра."
-    ]
-    
-    run_scenario("alex_middle", "Alex Middle", inputs_middle)
-    # run_scenario("alex_senior", "Alex Senior", inputs_senior)
+    # Scenarios live in scenarios/structured_*.json (Middle and Senior).
+    from scenario_engine import ScenarioEngine, load_scenarios
+
+    scenarios = load_scenarios(runner="structured", only=["alex_middle"])
+    ScenarioEngine().run(scenarios)
@@ -1,30 +1,67 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from pydantic import BaseModel, Field, model_validator
+from pydantic.json_schema import SkipJsonSchema
+from typing import Any, List, Optional, Literal
+from annotated_types import MaxLen
+from telemetry import telemetry
+
+# --- Output limits ---
+class BoundedModel(BaseModel):
+    """
+    Fields with max_length (strings and lists) are clipped to the limit instead of failing the parse:
+    the limit is the generation budget and also goes into the JSON schema for the LLM (maxLength/maxItems).
+    """
+    @model_validator(mode="before")
+    @classmethod
+    def _clip_to_limits(cls, data: Any) -> Any:
+        if not isinstance(data, dict):
+            return data
+        data = dict(data)
+        for name, field in cls.model_fields.items():
+            value = data.get(name)
+            limit = next((m.max_length for m in field.metadata if isinstance(m, MaxLen)), None)
+            if limit is not None and isinstance(value, (str, list)) and len(value) > limit:
+                data[name] = value[:limit]
+                telemetry.record("clipped", cls.__name__, field=name, length=len(value), limit=limit)
+        return data
 
 # --- Fact Checker ---
-class FactCheckReport(BaseModel):
+class ClaimVerdict(BoundedModel):
+    claim: str = Field("", max_length=400, description="The atomic claim being checked.")
+    verdict: Literal["TRUE", "FALSE", "PARTIALLY TRUE", "OPINION"] = Field(
+        ..., description="The Truth verdict of the claim."
+    )
+    evidence: str = Field(
+        ..., max_length=400, description="Brief explanation citing known facts or internal knowledge."
+    )
+    correction: Optional[str] = Field(
+        None, max_length=300, description="If false/partially true, provide the correct information."
+    )
+
+class FactCheckReport(BoundedModel):
     verdict: Literal["TRUE", "FALSE", "PARTIALLY TRUE", "OPINION"] = Field(
         ..., description="The Truth verdict of the statement."
     )
     evidence: str = Field(
-        ..., description="Brief explanation citing known facts or internal knowledge."
+        ..., max_length=600, description="Brief explanation citing known facts or internal knowledge."
     )
     correction: Optional[str] = Field(
-        None, description="If false/partially true, provide the correct information."
+        None, max_length=400, description="If false/partially true, provide the correct information."
     )
+    # Filled in by FactCheckerAgent itself when checking claim by claim; not in the schema for the LLM
+    claims: SkipJsonSchema[List[ClaimVerdict]] = Field(default=[], max_length=8)
 
 # --- Psychologist ---
-class PsychProfile(BaseModel):
-    emotional_state: str = Field(..., description="Current emotional state of the candidate.")
-    communication_style: str = Field(..., description="Brief analysis of how they speak.")
-    soft_skills: List[str] = Field(..., description="Observed soft skills (e.g. clarity, honesty).")
-    stress_markers: List[str] = Field(default=[], description="Any signs of stress or defensiveness.")
+class PsychProfile(BoundedModel):
+    emotional_state: str = Field(..., max_length=200, description="Current emotional state of the candidate.")
+    communication_style: str = Field(..., max_length=400, description="Brief analysis of how they speak.")
+    soft_skills: List[str] = Field(..., max_length=6, description="Observed soft skills (e.g. clarity, honesty).")
+    stress_markers: List[str] = Field(default=[], max_length=6, description="Any signs of stress or defensiveness.")
 
 # --- Mentor ---
-class MentorStrategy(BaseModel):
-    thought_process: str = Field(..., description="Internal reasoning about the situation.")
-    strategy: str = Field(..., description="High-level plan for the next step.")
-    instruction: str = Field(..., description="Specific instruction for the Interviewer.")
+class MentorStrategy(BoundedModel):
+    thought_process: str = Field(..., max_length=800, description="Internal reasoning about the situation (a few sentences).")
+    strategy: str = Field(..., max_length=300, description="High-level plan for the next step.")
+    instruction: str = Field(..., max_length=500, description="Specific instruction for the Interviewer.")
     tone: Literal["Friendly", "Strict", "Encouraging", "Neutral", "Empathetic and Calm"] = Field(
         ..., description="The tone the Interviewer should adopt."
     )
@@ -32,6 +69,12 @@ class MentorStrategy(BaseModel):
         default="CONTINUE", description="Set to TERMINATE if the candidate asks to stop or the interview is finished."
     )
 
+# --- Fused Analysis (FactChecker + Psychologist + Mentor in one call) ---
+class FusedAnalysis(BaseModel):
+    fact_check: FactCheckReport = Field(..., description="Fact-Checker part: verification of the candidate's claims.")
+    psych_profile: PsychProfile = Field(..., description="Psychologist part: communication and emotional state.")
+    mentor_strategy: MentorStrategy = Field(..., description="Mentor part: next move, based on the two reports above.")
+
 # --- Interviewer ---
 # Interviewer output is usually just the text response, but we can wrap it if needed.
 # For now, we'll keep it simple string in the runner, or a wrapper if we want consistency.
@@ -39,21 +82,47 @@ class InterviewerResponse(BaseModel):
     response: str = Field(..., description="The spoken response to the candidate in Russian.")
 
 # --- Decision Maker ---
-class JudgeVerdict(BaseModel):
+class JudgeVerdict(BoundedModel):
     approved: bool = Field(..., description="Whether the response is safe and appropriate.")
-    feedback: str = Field(..., description="Critique or suggestions for improvement.")
+    feedback: str = Field(..., max_length=500, description="Critique or suggestions for improvement.")
     score: int = Field(..., description="Quality score 0-10.")
 
-class FinalDecisionReport(BaseModel):
-    level: Literal["Junior", "Middle", "Senior"] = Field(..., description="Assessed candidate level.")
-    hiring_recommendation: Literal["Hire", "No Hire", "Strong Hire"] = Field(..., description="Final recommendation.")
+class FinalDecisionReport(BoundedModel):
+    level: Literal["Junior", "Middle", "Senior", "Undetermined"] = Field(
+        ..., description="Assessed candidate level. Undetermined only if no technical answer could be assessed."
+    )
+    hiring_recommendation: Literal["Hire", "No Hire", "Strong Hire", "Insufficient Data"] = Field(
+        ..., description="Final recommendation. Insufficient Data only if no technical answer could be assessed."
+    )
     confidence_score: int = Field(..., description="Confidence percentage 0-100.")
-    hard_skills_confirmed: List[str]
-    knowledge_gaps: List[str]
-    soft_skills_assessment: str
-    personal_roadmap: List[str]
+    hard_skills_confirmed: List[str] = Field(..., max_length=10)
+    knowledge_gaps: List[str] = Field(..., max_length=10)
+    soft_skills_assessment: str = Field(..., max_length=1000)
+    personal_roadmap: List[str] = Field(..., max_length=8, description="Concrete next steps, most important first.")
 
 # --- Memory/Summary ---
-class ConversationSummary(BaseModel):
-    summary: str = Field(..., description="Concise summary of the conversation so far.")
-    key_points: List[str] = Field(..., description="Important facts or events to remember.")
+class ConversationSummary(BoundedModel):
+    summary: str = Field(..., max_length=2000, description="Concise summary of the conversation so far.")
+    key_points: List[str] = Field(..., max_length=10, description="Important facts or events to remember.")
+
+# --- Router ---
+class RoutingDecision(BaseModel):
+    intent: Literal["answer", "acknowledgement", "stop"] = Field(..., description="Detected message intent.")
+    run_fact_checker: bool = True
+    run_psychologist: bool = True
+    run_mentor: bool = True
+    stop: bool = Field(False, description="Skip the analysis and go straight to the Decision Maker.")
+    reason: str = Field("", description="Why the router decided so (for audit).")
+
+# --- Scenarios ---
+class ScenarioSpec(BaseModel):
+    id: str = Field(..., description="Scenario identifier, used in the log file name.")
+    title: str = Field("", description="Human readable scenario name.")
+    runner: Literal["final_test", "structured"] = Field(
+        "final_test", description="Which turn loop runs the scenario (final_test_runner or scenario_runner)."
+    )
+    participant_name: str
+    inputs: List[str] = Field(..., description="Candidate messages in order.")
+    pipeline_mode: Optional[Literal["multi", "fused"]] = Field(
+        None, description="Analysis pipeline for this session (defaults to config.PIPELINE_MODE)."
+    )
@@ -0,0 +1,153 @@
+"""
+Таблица навыков сессии вместо рассуждений по сырому логу.
+
+Scoreboard обновляется после каждого хода по FactCheckReport и PsychProfile:
+счетчики вердиктов (всего и по темам), последние подтвержденные навыки и пробелы
+(с исправлением Фактчекера), мягкие навыки, маркеры стресса и последние эмоциональные
+состояния. Ментор видит таблицу вместе с коротким окном истории, DecisionMaker - вместо
+полного лога, поэтому размер их промптов не растет с длиной интервью. Если DecisionMaker
+недоступен, решение считается по той же таблице без LLM (decision()).
+"""
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+import config
+from schemas import FactCheckReport, FinalDecisionReport, PsychProfile
+
+CHECKED_VERDICTS = ("TRUE", "PARTIALLY TRUE", "FALSE")
+MAX_TEXT = 160
+RECENT_STATES = 3
+
+
+def _short(text: Optional[str]) -> str:
+    text = " ".join(str(text or "").split())
+    return text if len(text) <= MAX_TEXT else text[:MAX_TEXT - 3] + "..."
+
+
+def _is_stub_profile(profile: PsychProfile) -> bool:
+    # Психолог пропущен (роутер, нагрузка, таймаут) - профиль-заглушка в таблицу не идет
+    return profile.emotional_state.startswith("Unknown")
+
+
+class Scoreboard:
+    def __init__(self, state: Optional[Dict[str, Any]] = None, classify: Callable[[str], Optional[str]] = None):
+        state = state or {}
+        self.classify = classify
+        self.turns: int = state.get("turns", 0)
+        self.verdicts = Counter(state.get("verdicts", {}))
+        self.topics: Dict[str, Counter] = {topic: Counter(c) for topic, c in state.get("topics", {}).items()}
+        # Последние SCOREBOARD_MAX_ITEMS подтвержденных утверждений и пробелов; счетчики по темам - за всё интервью
+        self.confirmed: List[Dict[str, Any]] = list(state.get("confirmed", []))
+        self.gaps: List[Dict[str, Any]] = list(state.get("gaps", []))
+        self.soft_skills = Counter(state.get("soft_skills", {}))
+        self.stress_markers = Counter(state.get("stress_markers", {}))
+        self.emotional_states: List[str] = list(state.get("emotional_states", []))
+
+    def update(self, answer: str, fact_report: FactCheckReport, psych_profile: PsychProfile, topic: str = None):
+        """
+        Добавляет ход; topic - тема вопроса, на который отвечал кандидат (иначе по ответу через classify).
+        """
+        self.turns += 1
+        self.verdicts[fact_report.verdict] += 1
+        claims = [(c.claim, c.verdict, c.correction or c.evidence) for c in fact_report.claims] or \
+                 [(answer, fact_report.verdict, fact_report.correction or fact_report.evidence)]
+        checked = [claim for claim in claims if claim[1] in CHECKED_VERDICTS]
+        if checked:
+            # Тема нужна только проверенным утверждениям: OPINION не тратит вызов эмбеддингов
+            if topic is None and self.classify is not None:
+                topic = self.classify(answer)
+            topic = topic or "general"
+            for claim, verdict, correction in checked:
+                self.topics.setdefault(topic, Counter())[verdict] += 1
+                if verdict == "TRUE":
+                    self.confirmed.append({"turn": self.turns, "topic": topic, "claim": _short(claim)})
+                else:
+                    self.gaps.append({"turn": self.turns, "topic": topic, "claim": _short(claim),
+                                      "verdict": verdict, "correction": _short(correction)})
+            self.confirmed = self.confirmed[-config.SCOREBOARD_MAX_ITEMS:]
+            self.gaps = self.gaps[-config.SCOREBOARD_MAX_ITEMS:]
+        if not _is_stub_profile(psych_profile):
+            self.soft_skills.update(s.strip().lower() for s in psych_profile.soft_skills if s.strip())
+            self.stress_markers.update(s.strip().lower() for s in psych_profile.stress_markers if s.strip())
+            self.emotional_states = (self.emotional_states + [_short(psych_profile.emotional_state)])[-RECENT_STATES:]
+
+    def _top(self, counter: Counter) -> str:
+        items = counter.most_common(config.SCOREBOARD_MAX_ITEMS)
+        return ", ".join(f"{name} ({n})" for name, n in items) if items else "none"
+
+    def render(self) -> str:
+        """
+        Компактный текст для промпта: размер ограничен SCOREBOARD_MAX_ITEMS, а не числом ходов.
+        """
+        verdicts = ", ".join(f"{v} {self.verdicts[v]}" for v in CHECKED_VERDICTS + ("OPINION",) if self.verdicts[v])
+        lines = [f"Turns analysed: {self.turns}", f"Fact-check verdicts: {verdicts or 'none'}"]
+        if self.topics:
+            lines.append("By topic: " + "; ".join(
+                f"{topic} {c['TRUE']} true / {c['PARTIALLY TRUE']} partial / {c['FALSE']} false"
+                for topic, c in self.topics.items()))
+        lines.append("Confirmed skills (most recent):")
+        lines += [f"- [{item['topic']}] {item['claim']}" for item in self.confirmed] or ["- none"]
+        lines.append("Knowledge gaps (most recent):")
+        lines += [f"- [{item['topic']}] {item['verdict']}: {item['claim']} -> {item['correction']}"
+                  for item in self.gaps] or ["- none"]
+        lines.append(f"Soft skills: {self._top(self.soft_skills)}")
+        lines.append(f"Stress markers: {self._top(self.stress_markers)}")
+        lines.append(f"Emotional state (recent): {' -> '.join(self.emotional_states) or 'unknown'}")
+        return "\n".join(lines)
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def decision(self) -> FinalDecisionReport:
+        """
+        Решение без LLM по таблице (откат DecisionMaker): доля верных ответов среди проверенных.
+        Без проверенных ответов (только OPINION, пропущенный Фактчекер) - "Insufficient Data", а не No Hire.
+        """
+        checked = sum(self.verdicts[v] for v in CHECKED_VERDICTS)
+        if not checked:
+            return FinalDecisionReport(
+                level="Undetermined",
+                hiring_recommendation="Insufficient Data",
+                confidence_score=0,
+                hard_skills_confirmed=[],
+                knowledge_gaps=[],
+                soft_skills_assessment=(f"Decision Maker unavailable (LLM timeout) and no answer was fact-checked, "
+                                        f"so the candidate cannot be assessed from the scoreboard. "
+                                        f"Soft skills: {self._top(self.soft_skills)}.")[:1000],
+                personal_roadmap=[],
+            )
+        ratio = (self.verdicts["TRUE"] + 0.5 * self.verdicts["PARTIALLY TRUE"]) / checked
+        if ratio >= 0.85 and checked >= 4:
+            level, recommendation = "Senior", "Strong Hire"
+        elif ratio >= 0.6:
+            level, recommendation = "Middle", "Hire"
+        else:
+            level, recommendation = "Junior", "No Hire"
+        strong_topics = [topic for topic, c in self.topics.items() if c["TRUE"] > c["FALSE"] + c["PARTIALLY TRUE"]]
+        return FinalDecisionReport(
+            level=level,
+            hiring_recommendation=recommendation,
+            # Без LLM и на малом числе проверок уверенность низкая
+            confidence_score=min(60, 20 + 5 * checked),
+            hard_skills_confirmed=(strong_topics + [item["claim"] for item in self.confirmed])[:10],
+            knowledge_gaps=[f"[{item['topic']}] {item['claim']}" for item in self.gaps][:10],
+            soft_skills_assessment=(f"Decision Maker unavailable (LLM timeout), assessed from the scoreboard. "
+                                    f"Soft skills: {self._top(self.soft_skills)}. "
+                                    f"Stress markers: {self._top(self.stress_markers)}.")[:1000],
+            personal_roadmap=[f"Review {item['topic']}: {item['correction']}" for item in reversed(self.gaps)][:8],
+        )
+
+    def to_state(self) -> Dict[str, Any]:
+        """
+        Для чекпоинта сессии (extra["scoreboard"]) и metrics.scoreboard в логе.
+        """
+        return {
+            "turns": self.turns,
+            "verdicts": dict(self.verdicts),
+            "topics": {topic: dict(c) for topic, c in self.topics.items()},
+            "confirmed": list(self.confirmed),
+            "gaps": list(self.gaps),
+            "soft_skills": dict(self.soft_skills),
+            "stress_markers": dict(self.stress_markers),
+            "emotional_states": list(self.emotional_states),
+        }
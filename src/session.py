@@ -0,0 +1,151 @@
+"""
+Состояние диалога сессии.
+
+Transcript хранит реплики компактными записями Turn (__slots__), у каждой один раз
+считается строка "Role: content" и оценка числа токенов. Окна последних N реплик
+для промптов кэшируются до следующего изменения, а полный лог для DecisionMaker
+собирается один раз по запросу вместо `full_log_text +=` на каждом ходу.
+Суммаризация сжимает только рабочую историю, полный лог остается целиком.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+
+def approx_tokens(text: str) -> int:
+    # ~4 символа на токен: точный токенизатор модели тут не нужен, важен порядок величины
+    return len(text) // 4 + 1
+
+
+class Turn:
+    __slots__ = ("role", "content", "line", "tokens")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+        self.line = f"{role}: {content}"
+        self.tokens = approx_tokens(self.line)
+
+    def __getitem__(self, key: str) -> str:
+        # Совместимость с прежним форматом реплики {"role": ..., "content": ...}
+        if key not in ("role", "content"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class Transcript:
+    """
+    Рабочая история (то, что видят агенты) плюс полный лог сессии.
+    Ведет себя как список реплик: len(), итерация, индексы и срезы.
+    """
+    __slots__ = ("_turns", "_log", "_log_text", "_version", "_windows", "_tokens")
+
+    def __init__(self):
+        self._turns: List[Turn] = []
+        self._log: List[str] = []
+        self._log_text: Tuple[int, str] = (0, "")
+        self._version = 0
+        self._windows: Dict[Optional[int], Tuple[int, str]] = {}
+        self._tokens = 0
+
+    def append(self, role: str, content: str) -> Turn:
+        turn = Turn(role, content)
+        self._turns.append(turn)
+        self._log.append(turn.line)
+        self._tokens += turn.tokens
+        self._version += 1
+        return turn
+
+    def compact(self, summary: str, keep: int):
+        """
+        Заменяет всё, кроме последних keep реплик, одной системной репликой с резюме.
+        """
+        recent = self._turns[-keep:] if keep else []
+        summary_turn = Turn("System", f"Previous conversation summary: {summary}")
+        self._turns = [summary_turn] + recent
+        self._tokens = sum(turn.tokens for turn in self._turns)
+        self._version += 1
+
+    def window(self, last: Optional[int] = None) -> str:
+        """
+        Последние last реплик в формате "Role: content" по строкам (None - вся история).
+        """
+        cached = self._windows.get(last)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        turns = self._turns if last is None else self._turns[-last:]
+        text = "\n".join(turn.line for turn in turns)
+        self._windows[last] = (self._version, text)
+        return text
+
+    def window_tokens(self, last: Optional[int] = None) -> int:
+        turns = self._turns if last is None else self._turns[-last:]
+        return sum(turn.tokens for turn in turns)
+
+    @property
+    def tokens(self) -> int:
+        return self._tokens
+
+    def full_log(self) -> str:
+        """
+        Весь диалог без суммаризации - вход DecisionMaker (формат прежнего full_log_text).
+        """
+        count, text = self._log_text
+        if count != len(self._log):
+            text = "".join("\n" + line for line in self._log)
+            self._log_text = (len(self._log), text)
+        return text
+
+    def to_state(self, with_log: bool = True) -> Dict[str, Any]:
+        """
+        Компактное представление для чекпоинта (checkpoint.py); with_log=False - без полного лога,
+        его чекпоинт дописывает отдельно (log_tail).
+        """
+        state = {"turns": [[turn.role, turn.content] for turn in self._turns]}
+        if with_log:
+            state["log"] = list(self._log)
+        return state
+
+    @property
+    def log_size(self) -> int:
+        return len(self._log)
+
+    def log_tail(self, start: int) -> List[str]:
+        """
+        Строки полного лога начиная с start.
+        """
+        return self._log[start:]
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "Transcript":
+        transcript = cls()
+        for role, content in state["turns"]:
+            turn = Turn(role, content)
+            transcript._turns.append(turn)
+            transcript._tokens += turn.tokens
+        transcript._log = list(state["log"])
+        transcript._version = 1
+        return transcript
+
+    def to_list(self) -> List[Dict[str, str]]:
+        return [turn.to_dict() for turn in self._turns]
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def __iter__(self) -> Iterator[Turn]:
+        return iter(self._turns)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Turn, List[Turn]]:
+        return self._turns[index]
+
+
+def format_history(history: Union[Transcript, List], last: Optional[int] = None) -> str:
+    """
+    Окно истории для промпта: из Transcript - кэшированное, из списка реплик - как раньше.
+    """
+    if isinstance(history, Transcript):
+        return history.window(last)
+    turns = history if last is None else history[-last:]
+    return "\n".join([f"{turn['role']}: {turn['content']}" for turn in turns])
@@ -0,0 +1,277 @@
+"""
+LRU-кэш состояний сессий для процесса, ведущего много интервью сразу.
+
+В памяти держатся только активные сессии. Сессия, которая не используется дольше
+SESSION_IDLE_SECONDS или вытесняется лимитами (SESSION_CACHE_MAX_SESSIONS,
+SESSION_CACHE_MAX_MB), сбрасывается на диск снапшотом в формате чекпоинта
+(checkpoint.py) и поднимается обратно при следующем сообщении кандидата.
+Сессия, взятая в работу (acquire/session()), не вытесняется до release.
+Это библиотека для внешнего процесса, который ведет много интервью сразу (веб-сервер,
+бот); точки входа этого репозитория (main.py, раннеры сценариев) ведут по одной сессии
+и кэш не используют.
+Снапшоты пишутся на диск после снятия блокировки кэша: запись с fsync одной сессии
+не задерживает ходы остальных.
+
+Простой проверяется на каждом put/acquire/release; чтобы простаивающие сессии уходили
+на диск и при отсутствии трафика, запустите фоновую очистку:
+
+    cache = SessionCache()
+    cache.start_sweeper()  # раз в SESSION_SWEEP_SECONDS вызывает evict_idle()
+    with cache.session(session_id) as state:
+        ... ход интервью над state.transcript ...
+    cache.stop_sweeper()
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import config
+from checkpoint import SessionCheckpoint, SessionState
+
+
+def approx_state_bytes(state: SessionState) -> int:
+    """
+    Грубая оценка памяти состояния: текст истории и лога (str в CPython ~1-4 байта на символ) плюс записи лога.
+    """
+    transcript = state.transcript
+    chars = sum(len(line) for line in transcript.to_state()["log"]) + sum(len(turn.line) for turn in transcript)
+    log_chars = sum(len(str(value)) for entry in state.log_turns for value in entry.values())
+    return 2 * (chars + log_chars) + 200 * (len(transcript) + len(state.log_turns))
+
+
+class _Entry:
+    __slots__ = ("state", "store", "size", "last_used", "pins")
+
+    def __init__(self, state: SessionState, store: SessionCheckpoint):
+        self.state = state
+        # Тот же объект чекпоинта помнит, что уже лежит в <id>.log: сброс дописывает только новое
+        self.store = store
+        self.size = approx_state_bytes(state)
+        self.last_used = time.monotonic()
+        self.pins = 0
+
+
+class SessionCache:
+    def __init__(self, max_sessions: int = None, max_mb: float = None, idle_seconds: float = None,
+                 directory: str = None):
+        self.max_sessions = config.SESSION_CACHE_MAX_SESSIONS if max_sessions is None else max_sessions
+        self.max_bytes = int((config.SESSION_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024)
+        self.idle_seconds = config.SESSION_IDLE_SECONDS if idle_seconds is None else idle_seconds
+        self.directory = directory or str(config.SESSION_SPILL_DIR)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Вытесненные, но еще не записанные на диск: acquire забирает их отсюда, а не с диска
+        self._spilling: Dict[str, _Entry] = {}
+        # Запись снапшотов по одной: проверка "запись еще актуальна" и сама запись атомарны
+        self._spill_lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_stop = threading.Event()
+        self.counters = {"hits": 0, "misses": 0, "rehydrated": 0, "created": 0, "evicted": 0,
+                         "evicted_idle": 0, "spilled_bytes": 0}
+
+    def _store(self, session_id: str) -> SessionCheckpoint:
+        return SessionCheckpoint(session_id, directory=self.directory, enabled=True)
+
+    def put(self, state: SessionState):
+        """
+        Новая сессия (или замена состояния целиком).
+        """
+        store = self._store(state.session_id)
+        with self._lock:
+            old = self._entries.pop(state.session_id, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._spilling.pop(state.session_id, None)
+            entry = _Entry(state, store)
+            self._entries[state.session_id] = entry
+            self._bytes += entry.size
+            self.counters["created"] += 1
+            victims = self._enforce_limits()
+        self._spill(victims)
+
+    def acquire(self, session_id: str) -> Optional[SessionState]:
+        """
+        Состояние сессии из памяти или с диска; None, если сессии нет нигде.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self.counters["hits"] += 1
+                self._entries.move_to_end(session_id)
+                entry.pins += 1
+                entry.last_used = time.monotonic()
+                return entry.state
+            spilling = session_id in self._spilling
+            if not spilling:
+                self.counters["misses"] += 1
+        if spilling:
+            # Вытеснена, но снапшот еще не записан - забираем ту же запись из памяти
+            state = self._reclaim(session_id)
+            if state is not None:
+                return state
+            with self._lock:
+                self.counters["misses"] += 1
+        # Диск читаем без блокировки, чтобы не задерживать остальные сессии
+        store = self._store(session_id)
+        state = store.load()
+        if state is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                entry = _Entry(state, store)
+                self._entries[session_id] = entry
+                self._bytes += entry.size
+                self.counters["rehydrated"] += 1
+            entry.pins += 1
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(session_id)
+            victims = self._enforce_limits()
+        self._spill(victims)
+        return entry.state
+
+    def _reclaim(self, session_id: str) -> Optional[SessionState]:
+        # _spill_lock: ждем текущую запись снапшота, состояние не должно меняться, пока его сериализуют
+        with self._spill_lock, self._lock:
+            entry = self._spilling.pop(session_id, None) or self._entries.get(session_id)
+            if entry is None:
+                return None
+            if session_id not in self._entries:
+                self._entries[session_id] = entry
+                self._bytes += entry.size
+            self.counters["hits"] += 1
+            self._entries.move_to_end(session_id)
+            entry.pins += 1
+            entry.last_used = time.monotonic()
+            return entry.state
+
+    def release(self, session_id: str):
+        """
+        Ход обработан: размер пересчитывается, сессию снова можно вытеснить.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            entry.pins = max(0, entry.pins - 1)
+            entry.last_used = time.monotonic()
+            size = approx_state_bytes(entry.state)
+            self._bytes += size - entry.size
+            entry.size = size
+            victims = self._enforce_limits()
+        self._spill(victims)
+
+    @contextmanager
+    def session(self, session_id: str) -> Iterator[SessionState]:
+        state = self.acquire(session_id)
+        if state is None:
+            raise KeyError(session_id)
+        try:
+            yield state
+        finally:
+            self.release(session_id)
+
+    def drop(self, session_id: str):
+        """
+        Сессия завершена: убрать из памяти и с диска.
+        """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+            self._spilling.pop(session_id, None)
+        with self._spill_lock:
+            self._store(session_id).clear()
+
+    def evict_idle(self) -> int:
+        """
+        Сбрасывает на диск сессии, простаивающие дольше idle_seconds (вызывается и на каждом release/put).
+        """
+        with self._lock:
+            victims = self._evict_idle()
+        self._spill(victims)
+        return len(victims)
+
+    def start_sweeper(self, interval: float = None) -> threading.Thread:
+        """
+        Фоновый поток, который раз в interval секунд вызывает evict_idle().
+        """
+        interval = config.SESSION_SWEEP_SECONDS if interval is None else interval
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return self._sweeper
+        self._sweeper_stop.clear()
+
+        def sweep():
+            while not self._sweeper_stop.wait(interval):
+                self.evict_idle()
+
+        self._sweeper = threading.Thread(target=sweep, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+        return self._sweeper
+
+    def stop_sweeper(self):
+        self._sweeper_stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+
+    def _evict_idle(self) -> List[Tuple[str, _Entry]]:
+        if not self.idle_seconds:
+            return []
+        deadline = time.monotonic() - self.idle_seconds
+        idle = [sid for sid, entry in self._entries.items() if not entry.pins and entry.last_used < deadline]
+        victims = [self._evict(session_id) for session_id in idle]
+        self.counters["evicted_idle"] += len(idle)
+        return victims
+
+    def _enforce_limits(self) -> List[Tuple[str, _Entry]]:
+        """
+        Под self._lock: убирает лишние сессии из памяти и возвращает их для _spill.
+        """
+        victims = self._evict_idle()
+        # Самые давно использованные - в начале OrderedDict; закрепленные пропускаем
+        for session_id in list(self._entries):
+            if len(self._entries) <= self.max_sessions and self._bytes <= self.max_bytes:
+                break
+            if not self._entries[session_id].pins:
+                victims.append(self._evict(session_id))
+        return victims
+
+    def _evict(self, session_id: str) -> Tuple[str, _Entry]:
+        entry = self._entries.pop(session_id)
+        self._bytes -= entry.size
+        self._spilling[session_id] = entry
+        self.counters["evicted"] += 1
+        self.counters["spilled_bytes"] += entry.size
+        return session_id, entry
+
+    def _spill(self, victims: List[Tuple[str, _Entry]]):
+        """
+        Без self._lock: снапшоты вытесненных сессий на диск.
+        """
+        for session_id, entry in victims:
+            with self._spill_lock:
+                with self._lock:
+                    # Сессию уже забрали обратно, завершили или вытеснили заново - эта запись устарела
+                    if self._spilling.get(session_id) is not entry:
+                        continue
+                entry.store.snapshot(entry.state)
+                with self._lock:
+                    if self._spilling.get(session_id) is entry:
+                        del self._spilling[session_id]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else 0.0,
+                "resident_sessions": len(self._entries),
+                "resident_mb": round(self._bytes / (1024 * 1024), 3),
+                "pinned_sessions": sum(1 for entry in self._entries.values() if entry.pins),
+                "max_sessions": self.max_sessions,
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+            }
@@ -0,0 +1,305 @@
+"""
+Локальный детерминированный stub-сервер, совместимый с OpenAI Chat Completions API.
+
+Нужен для прогона регрессии без сети и без GPU: LLMClient направляется на
+base_url этого сервера, а сервер по системному промпту определяет, какой агент
+его вызывает, и отдает заранее заготовленный ответ с заданной задержкой.
+Один и тот же промпт всегда получает один и тот же ответ.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import config
+
+# Агент определяется по первой строке его системного промпта из config.py
+AGENT_MARKERS = {
+    "FactChecker": config.FACT_CHECKER_PROMPT.splitlines()[0],
+    "Psychologist": config.PSYCHOLOGIST_PROMPT.splitlines()[0],
+    "Mentor": config.MENTOR_PROMPT.splitlines()[0],
+    "FusedAnalyst": config.FUSED_ANALYST_PROMPT.splitlines()[0],
+    "Interviewer": config.INTERVIEWER_PROMPT.splitlines()[0],
+    "DecisionMaker": config.DECISION_MAKER_PROMPT.splitlines()[0],
+    "Judge": config.JUDGE_PROMPT.splitlines()[0],
+    "Summarizer": config.SUMMARIZER_PROMPT.splitlines()[0],
+}
+
+DEFAULT_RESPONSES: Dict[str, List[str]] = {
+    "FactChecker": [
+        json.dumps({"verdict": "TRUE", "evidence": "Stub: the statement matches the knowledge base.", "correction": None}),
+        json.dumps({"verdict": "OPINION", "evidence": "Stub: the statement is a personal claim.", "correction": None}),
+        json.dumps({"verdict": "PARTIALLY TRUE", "evidence": "Stub: the statement is incomplete.",
+                    "correction": "Stub: mention the trade-offs as well."}),
+    ],
+    "Psychologist": [
+        json.dumps({"emotional_state": "Calm", "communication_style": "Concise and clear.",
+                    "soft_skills": ["Clarity of thought"], "stress_markers": []}),
+        json.dumps({"emotional_state": "Slightly tense", "communication_style": "Short answers.",
+                    "soft_skills": ["Honesty"], "stress_markers": ["Evasion"]}),
+    ],
+    "Mentor": [
+        json.dumps({"thought_process": "Stub: the candidate answered, go deeper.", "strategy": "Deepen",
+                    "instruction": "Ask a follow-up question about the last topic.", "tone": "Neutral",
+                    "interview_status": "CONTINUE"}),
+        json.dumps({"thought_process": "Stub: switch to another area.", "strategy": "Change Topic",
+                    "instruction": "Ask about database indexes.", "tone": "Friendly",
+                    "interview_status": "CONTINUE"}),
+    ],
+    "FusedAnalyst": [
+        json.dumps({
+            "fact_check": {"verdict": "TRUE", "evidence": "Stub: the statement matches the knowledge base.",
+                           "correction": None},
+            "psych_profile": {"emotional_state": "Calm", "communication_style": "Concise and clear.",
+                              "soft_skills": ["Clarity of thought"], "stress_markers": []},
+            "mentor_strategy": {"thought_process": "Stub: the candidate answered, go deeper.", "strategy": "Deepen",
+                                "instruction": "Ask a follow-up question about the last topic.", "tone": "Neutral",
+                                "interview_status": "CONTINUE"},
+        }),
+    ],
+    "Interviewer": [
+        "Хорошо. Расскажи подробнее, как ты применял это на практике?",
+        "Понятно. Давай перейдем к базам данных: зачем нужны индексы?",
+    ],
+    "Judge": [
+        json.dumps({"approved": True, "feedback": "Stub: acceptable.", "score": 9}),
+    ],
+    "Summarizer": [
+        json.dumps({"summary": "Stub: the candidate described their experience and answered technical questions.",
+                    "key_points": ["Experience described", "Technical questions answered"]}),
+    ],
+    "DecisionMaker": [
+        json.dumps({"level": "Middle", "hiring_recommendation": "Hire", "confidence_score": 70,
+                    "hard_skills_confirmed": ["Python"], "knowledge_gaps": ["Stub gap"],
+                    "soft_skills_assessment": "Stub: communicates clearly.",
+                    "personal_roadmap": ["Stub: study system design."]}),
+    ],
+    "default": ["OK"],
+}
+
+
+def detect_agent(prompt: str) -> str:
+    """
+    Возвращает имя агента, чей системный промпт встречается в запросе раньше всего.
+    """
+    best_name, best_pos = "default", None
+    for name, marker in AGENT_MARKERS.items():
+        pos = prompt.find(marker)
+        if pos != -1 and (best_pos is None or pos < best_pos):
+            best_name, best_pos = name, pos
+    return best_name
+
+
+class LatencyModel:
+    """
+    Задержка ответа stub-сервера. Формат спецификации:
+      "0.2"                  - фиксированная задержка
+      "uniform:LOW:HIGH"     - равномерное распределение
+      "normal:MEAN:STD"      - нормальное (обрезается снизу нулем)
+      "lognormal:MU:SIGMA"   - логнормальное (длинный хвост, как у реального GPU-сервера)
+    Случайное значение выводится из хеша промпта, поэтому повторный прогон
+    дает те же задержки.
+    """
+    def __init__(self, spec: Union[str, float] = 0.0):
+        self.spec = str(spec)
+        parts = self.spec.split(":")
+        if len(parts) == 1:
+            self.kind, self.params = "fixed", (float(parts[0]),)
+        else:
+            self.kind, self.params = parts[0], tuple(float(p) for p in parts[1:])
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal") or len(self.params) != (1 if self.kind == "fixed" else 2):
+            raise ValueError(f"Unknown latency spec: {self.spec}")
+
+    def sample(self, seed: int) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        rng = random.Random(seed)
+        a, b = self.params
+        if self.kind == "uniform":
+            return rng.uniform(a, b)
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(a, b))
+        return rng.lognormvariate(a, b)
+
+
+class StubLLMServer:
+    """
+    OpenAI-совместимый HTTP сервер с заготовленными ответами.
+    Использование:
+        with StubLLMServer(latency=0.1) as stub:
+            client = LLMClient(base_url=stub.base_url)
+    """
+    def __init__(self, responses: Optional[Dict[str, Union[str, List[str]]]] = None,
+                 latency: Union[str, float] = None, host: str = None, port: int = None,
+                 agent_latency: Optional[Dict[str, Union[str, float]]] = None, overload_rate: float = 0.0):
+        self.responses: Dict[str, List[str]] = dict(DEFAULT_RESPONSES)
+        for name, value in (responses or {}).items():
+            self.responses[name] = [value] if isinstance(value, str) else list(value)
+        self.latency = LatencyModel(config.STUB_LLM_LATENCY if latency is None else latency)
+        # Отдельные распределения для агентов, например {"Interviewer": "normal:0.8:0.2"}
+        self.agent_latency = {name: LatencyModel(spec) for name, spec in (agent_latency or {}).items()}
+        self.host = host or config.STUB_LLM_HOST
+        self.port = config.STUB_LLM_PORT if port is None else port
+        # Доля запросов, на которые сервер отвечает 503 (имитация перегрузки для проверки fallback)
+        self.overload_rate = overload_rate
+        self.request_count = 0
+        self.overloaded_count = 0
+        self.model_counts = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def reply(self, messages: List[Dict[str, str]], model: str = "stub") -> Dict[str, Any]:
+        """
+        Выбирает ответ детерминированно: агент по промпту, вариант по хешу промпта.
+        """
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        agent = detect_agent(prompt)
+        variants = self.responses.get(agent) or self.responses["default"]
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        content = variants[int.from_bytes(digest[:4], "big") % len(variants)]
+        delay = self.agent_latency.get(agent, self.latency).sample(int.from_bytes(digest[4:12], "big"))
+        with self._lock:
+            self.request_count += 1
+            self.model_counts[model] += 1
+            # Перегрузка тоже детерминирована: по хешу промпта и номеру запроса
+            overloaded = random.Random(int.from_bytes(digest[12:20], "big") + self.request_count).random() < self.overload_rate
+            if overloaded:
+                self.overloaded_count += 1
+        return {"agent": agent, "prompt": prompt, "content": content, "delay": delay, "overloaded": overloaded}
+
+    def start(self) -> "StubLLMServer":
+        self._server = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def _make_handler(stub: StubLLMServer):
+    class _Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            # Не засоряем вывод сценариев логами каждого запроса
+            pass
+
+        def _send_json(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            result = stub.reply(request.get("messages", []), request.get("model", "stub"))
+            if result["overloaded"]:
+                self._send_json(503, {"error": {"message": "Stub: server overloaded", "type": "server_error"}})
+                return
+            if result["delay"] > 0:
+                time.sleep(result["delay"])
+            content, finish_reason = apply_limits(result["content"], request.get("max_tokens"), request.get("stop"))
+            self._send_json(200, {
+                "id": f"chatcmpl-stub-{stub.request_count}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": {
+                    # Грубая оценка: ~4 символа на токен
+                    "prompt_tokens": len(result["prompt"]) // 4,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": (len(result["prompt"]) + len(content)) // 4,
+                },
+            })
+
+    return _Handler
+
+
+def apply_limits(content: str, max_tokens: int = None, stop: Union[str, List[str]] = None) -> Tuple[str, str]:
+    """
+    Как настоящий сервер: обрезка по stop-последовательностям и max_tokens (~4 символа на токен).
+    Возвращает текст и finish_reason ("stop" или "length").
+    """
+    for seq in ([stop] if isinstance(stop, str) else stop or []):
+        if seq and seq in content:
+            content = content[:content.index(seq)]
+    if max_tokens and len(content) > max_tokens * 4:
+        return content[:max_tokens * 4], "length"
+    return content, "stop"
+
+
+def load_responses(path: str) -> Dict[str, Union[str, List[str]]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_agent_latency(items: List[str]) -> Dict[str, str]:
+    """
+    ["Interviewer=normal:0.8:0.2", ...] -> {"Interviewer": "normal:0.8:0.2"}
+    """
+    result = {}
+    for item in items or []:
+        name, _, spec = item.partition("=")
+        result[name.strip()] = spec.strip()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local deterministic OpenAI-compatible stub server.")
+    parser.add_argument("--host", default=config.STUB_LLM_HOST)
+    parser.add_argument("--port", type=int, default=config.STUB_LLM_PORT or 8899)
+    parser.add_argument("--latency", default=config.STUB_LLM_LATENCY,
+                        help="Seconds per response or a distribution, e.g. 'lognormal:-1.5:0.4'.")
+    parser.add_argument("--agent-latency", nargs="*", default=[], metavar="AGENT=SPEC",
+                        help="Per-agent latency, e.g. Interviewer=normal:0.8:0.2.")
+    parser.add_argument("--responses", help="JSON file: {agent_name: response or [responses]}.")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Share of requests answered with 503.")
+    args = parser.parse_args()
+
+    responses = load_responses(args.responses) if args.responses else None
+    stub = StubLLMServer(responses=responses, latency=args.latency, host=args.host, port=args.port,
+                         agent_latency=parse_agent_latency(args.agent_latency),
+                         overload_rate=args.overload_rate).start()
+    print(f"Stub LLM server is listening on {stub.base_url} (latency {stub.latency.spec}). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
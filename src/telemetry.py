@@ -0,0 +1,56 @@
+"""
+Счетчики и последние события LLM-слоя: таймауты, hedge-запросы, срабатывания
+circuit breaker, деградированные ответы. Общие на процесс, потокобезопасные.
+"""
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict
+
+
+class Telemetry:
+    def __init__(self, max_events: int = 1000):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.events = deque(maxlen=max_events)
+
+    def record(self, event: str, agent: str = None, **fields: Any):
+        with self._lock:
+            self.counters[(event, agent)] += 1
+            self.events.append({"time": round(time.time(), 3), "event": event, "agent": agent, **fields})
+
+    def incr(self, event: str, agent: str = None, n: int = 1):
+        """
+        Только счетчик, без записи в recent_events (для частых событий вроде каждого вызова LLM).
+        """
+        with self._lock:
+            self.counters[(event, agent)] += n
+
+    def count(self, event: str, agent: str = None) -> int:
+        with self._lock:
+            if agent is not None:
+                return self.counters[(event, agent)]
+            return sum(n for (name, _), n in self.counters.items() if name == event)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        {"counters": {event: {agent: n}}, "truncation_rate": {...}, "recent_events": [...]} - для логов и бенчмарков.
+        """
+        with self._lock:
+            counters: Dict[str, Dict[str, int]] = {}
+            for (event, agent), n in sorted(self.counters.items(), key=lambda kv: (kv[0][0], str(kv[0][1]))):
+                counters.setdefault(event, {})[agent or "-"] = n
+            calls = counters.get("llm_call", {})
+            # Доля ответов, обрезанных по max_tokens, по агентам
+            truncation_rate = {agent: round(n / calls[agent], 3)
+                               for agent, n in counters.get("truncated", {}).items() if calls.get(agent)}
+            return {"counters": counters, "truncation_rate": truncation_rate,
+                    "recent_events": list(self.events)[-50:]}
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.events.clear()
+
+
+telemetry = Telemetry()
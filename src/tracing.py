@@ -0,0 +1,212 @@
+"""
+Легковесная трассировка горячего пути интервью.
+
+Спаны вкладываются друг в друга (сессия -> ход -> агент -> фаза). Текущий спан хранится
+в contextvars, поэтому работа в других потоках (run_in_background, пул проверки утверждений
+через copy_context) остается дочерней для хода, а не становится отдельным корнем.
+Спаны экспортируются в JSON формата Chrome Trace (chrome://tracing, Perfetto) или
+OTLP/JSON (можно загрузить в Jaeger/Tempo через OTLP collector).
+
+В памяти хранятся последние TRACE_MAX_SPANS спанов; export() их сбрасывает.
+
+Когда трассировка выключена, span() возвращает общий пустой контекст-менеджер,
+так что накладные расходы - одна проверка флага.
+
+    from tracing import tracer
+    with tracer.span("turn", turn=3):
+        ...
+    tracer.export("trace.json")
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import config
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "attrs", "span_id", "trace_id", "parent_id", "start_ns", "tid", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = None
+        self.parent_id = None
+        self.start_ns = 0
+        self.tid = threading.get_ident()
+        self._token = None
+
+    def set(self, **attrs):
+        """
+        Добавить атрибуты к уже открытому спану (например, результат вердикта).
+        """
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is not None:
+            self.parent_id = parent.span_id
+            self.trace_id = parent.trace_id
+        else:
+            self.trace_id = uuid.uuid4().hex
+        self.tid = threading.get_ident()
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.time_ns()
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Спан закрыт в другом контексте, чем открыт - просто возвращаем родителя
+            parent = self._token.old_value
+            _current_span.set(None if parent is contextvars.Token.MISSING else parent)
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer._record(self, end_ns)
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled: bool = False, service_name: str = "interview-coach"):
+        self.enabled = enabled
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        # Долгоживущий процесс не копит спаны бесконечно: старые вытесняются
+        self._spans = deque(maxlen=config.TRACE_MAX_SPANS)
+        self.dropped = 0
+
+    def _record(self, span: _Span, end_ns: int):
+        record = {
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "start_ns": span.start_ns,
+            "end_ns": end_ns,
+            "tid": span.tid,
+            "attrs": span.attrs,
+        }
+        with self._lock:
+            if len(self._spans) == self._spans.maxlen:
+                self.dropped += 1
+            self._spans.append(record)
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, attrs)
+
+    def spans(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+            self.dropped = 0
+
+    def to_chrome(self) -> Dict[str, Any]:
+        spans = self.spans()
+        # Маленькие номера потоков читаются лучше, чем threading.get_ident()
+        tids = {tid: i + 1 for i, tid in enumerate(dict.fromkeys(s["tid"] for s in spans))}
+        events = []
+        for s in spans:
+            events.append({
+                "name": s["name"],
+                "cat": "interview",
+                "ph": "X",
+                "ts": s["start_ns"] // 1000,
+                "dur": max(1, (s["end_ns"] - s["start_ns"]) // 1000),
+                "pid": os.getpid(),
+                "tid": tids[s["tid"]],
+                "args": {k: str(v) for k, v in s["attrs"].items()},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_otlp(self) -> Dict[str, Any]:
+        otlp_spans = []
+        for s in self.spans():
+            span = {
+                "traceId": s["trace_id"],
+                "spanId": s["span_id"],
+                "name": s["name"],
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(s["start_ns"]),
+                "endTimeUnixNano": str(s["end_ns"]),
+                "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in s["attrs"].items()],
+            }
+            if s["parent_id"]:
+                span["parentSpanId"] = s["parent_id"]
+            otlp_spans.append(span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "interview.tracing"}, "spans": otlp_spans}],
+            }]
+        }
+
+    def export(self, path: Optional[str] = None, fmt: str = None) -> Optional[str]:
+        """
+        Сохраняет накопленные спаны. fmt: "chrome" или "otlp" (по умолчанию TRACE_FORMAT).
+        """
+        if not self.enabled:
+            return None
+        fmt = fmt or config.TRACE_FORMAT
+        if path is None:
+            os.makedirs(config.TRACE_DIR, exist_ok=True)
+            stamp = time.strftime("%Y%m%d_%H%M%S")
+            path = str(config.TRACE_DIR / f"trace_{stamp}_{fmt}.json")
+        payload = self.to_otlp() if fmt == "otlp" else self.to_chrome()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        # Выгруженные спаны больше не держим в памяти
+        self.clear()
+        return path
+
+
+tracer = Tracer(enabled=config.TRACING_ENABLED)
+
+
+def traced(name: str = None):
+    """
+    Декоратор: оборачивает функцию в спан с именем name (или именем функции).
+    """
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
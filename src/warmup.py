@@ -0,0 +1,163 @@
+"""
+Прогрев при старте и проба готовности.
+
+Без прогрева первый ход после запуска платит за всё сразу: первый инференс модели
+эмбеддингов, открытие шардов Chroma, банк вопросов, разбор шаблонов и JSON-схем агентов
+и холодный KV-кэш LLM-сервера. warm_up() делает это до приветствия:
+
+  - embeddings:    первый embed_query (ленивая инициализация модели/сессии ONNX);
+  - question_bank: загрузка банка вопросов и его кэша дубликатов;
+  - retrieval:     один пробный поиск по базе знаний и классификация темы;
+  - compile:       шаблоны и схемы парсеров всех зарегистрированных агентов;
+  - llm_prime:     запрос max_tokens=1 с системным промптом каждого агента (параллельно),
+                   сервер кэширует общий префикс будущих вызовов.
+
+Время каждой фазы пишется в readiness; после прогрева readiness.ready = True.
+READY_PORT поднимает HTTP-пробу: GET /ready отвечает 503 до конца прогрева и 200 после,
+GET /live - всегда 200.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+import config
+from telemetry import telemetry
+
+WARMUP_QUERY = "A Python decorator wraps a function to extend its behaviour."
+
+
+class Readiness:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.total_ms: Optional[float] = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def error(self, name: str, reason: str):
+        with self._lock:
+            self.errors[name] = reason
+
+    def mark_ready(self):
+        self.total_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"ready": self.ready, "total_ms": self.total_ms,
+                    "phases_ms": dict(self.phases), "errors": dict(self.errors)}
+
+
+readiness = Readiness()
+
+
+def _prime_llm(manager: Any):
+    """
+    По запросу на каждый уникальный (профиль, системный промпт). Прогрев идет мимо circuit breaker'а,
+    а любой его сбой (перегрузка, таймаут, неверный ключ) только записывается в readiness - старт не падает.
+    """
+    client = manager.llm_client
+    targets = {}
+    for name, agent in manager.agents.items():
+        prefix = agent.static_prefix()
+        if prefix:
+            targets.setdefault((client.profile_for(name), prefix), name)
+    if not targets:
+        return
+
+    def prime(name: str, prefix: str):
+        try:
+            client.warm_prefix(name, prefix, deadline=config.WARMUP_PRIME_DEADLINE, breaker=False)
+        except Exception as e:
+            readiness.error(f"llm_prime.{name}", f"{type(e).__name__}: {e}")
+            telemetry.record("warmup_failed", name, reason=str(e))
+
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="warmup") as pool:
+        for future in [pool.submit(prime, name, prefix) for (_, prefix), name in targets.items()]:
+            future.result()
+
+
+def warm_up(manager: Any, prime_llm: bool = None) -> Dict[str, Any]:
+    """
+    Прогрев после регистрации агентов в manager; возвращает readiness.report().
+    """
+    prime_llm = config.WARMUP_PRIME_LLM if prime_llm is None else prime_llm
+    kb = manager.kb
+    with readiness.phase("embeddings"):
+        kb.embeddings.embed_query(WARMUP_QUERY)
+    if config.QUESTION_BANK:
+        with readiness.phase("question_bank"):
+            kb.question_bank
+    with readiness.phase("retrieval"):
+        kb.verify_fact(WARMUP_QUERY)
+        kb.classify_topic(WARMUP_QUERY)
+    with readiness.phase("compile"):
+        for agent in manager.agents.values():
+            agent.compile()
+    if prime_llm:
+        with readiness.phase("llm_prime"):
+            _prime_llm(manager)
+    readiness.mark_ready()
+    return readiness.report()
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    phases = ", ".join(f"{name} {ms:.0f} ms" for name, ms in report["phases_ms"].items())
+    line = f"Startup {report['total_ms'] / 1000:.1f}s ({phases})"
+    if report["errors"]:
+        line += f"; warm-up failed for: {', '.join(report['errors'])}"
+    return line
+
+
+class _ReadinessHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/live":
+            status, body = 200, {"live": True}
+        elif self.path == "/ready":
+            body = readiness.report()
+            status = 200 if body["ready"] else 503
+        else:
+            status, body = 404, {"error": "not found"}
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_readiness(port: int = None, host: str = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Проба готовности в фоновом потоке; None, если READY_PORT=0.
+    """
+    port = config.READY_PORT if port is None else port
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host or config.READY_HOST, port), _ReadinessHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="readiness", daemon=True).start()
+    return server
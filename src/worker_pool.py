@@ -0,0 +1,168 @@
+"""
+Пре-форк пул процессов для прогона сессий на нескольких ядрах.
+
+Родитель один раз загружает модель эмбеддингов и базу знаний, переводит базу в режим
+только для чтения (kb.freeze(): факты и матрица эмбеддингов в памяти, без клиента Chroma),
+замораживает GC (gc.freeze, чтобы сборщик мусора не трогал общие страницы) и только
+потом форкает воркеров. Веса модели и матрица делятся с воркерами copy-on-write:
+N ядер без N копий модели. Каждый воркер создает свой LLMClient (у него свой event loop)
+и сообщает память процесса: RSS, PSS (общие страницы поделены между процессами) и private.
+
+Примеры:
+    python src/worker_pool.py --workers 4 --stub
+    python src/scenario_engine.py --processes 4 --stub
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+
+# Если запускаем из корня, добавляем src в путь
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+import config
+from knowledge_base import InterviewKnowledgeBase
+from llm_client import LLMClient
+from scenario_engine import ScenarioEngine, load_scenarios
+from schemas import ScenarioSpec
+
+# Заполняется в родителе до fork и наследуется воркерами
+_SHARED: Dict[str, Any] = {}
+_WORKER: Dict[str, Any] = {}
+
+
+def process_memory(pid: str = "self") -> Dict[str, float]:
+    """
+    Память процесса в МБ из /proc/<pid>/smaps_rollup (Linux); иначе только пиковый RSS.
+    """
+    fields: Dict[str, float] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"):
+                    fields[key] = int(rest.split()[0]) / 1024
+    except OSError:
+        return {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    return {
+        "rss_mb": round(fields.get("Rss", 0.0), 1),
+        "pss_mb": round(fields.get("Pss", 0.0), 1),
+        "shared_mb": round(fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+    }
+
+
+def _init_worker(threads: int):
+    if threads:
+        import torch
+
+        # Иначе каждый воркер запускает по потоку на ядро и они мешают друг другу
+        torch.set_num_threads(threads)
+    _WORKER["engine"] = ScenarioEngine(
+        llm_client=LLMClient(**_SHARED["llm_kwargs"]),
+        kb=_SHARED["kb"],
+        log_dir=_SHARED["log_dir"],
+        pipeline_mode=_SHARED["pipeline_mode"],
+        resume=_SHARED["resume"],
+    )
+
+
+def _run_in_worker(spec: ScenarioSpec) -> Dict[str, Any]:
+    result = _WORKER["engine"].run_one(spec)
+    result["worker_pid"] = os.getpid()
+    result["worker_memory"] = process_memory()
+    return result
+
+
+class PreforkPool:
+    def __init__(self, workers: int = None, kb: InterviewKnowledgeBase = None, llm_kwargs: Dict[str, Any] = None,
+                 log_dir: str = None, pipeline_mode: str = None, threads_per_worker: int = None,
+                 resume: bool = False):
+        self.workers = max(1, workers or config.PREFORK_WORKERS)
+        self.kb = kb
+        self.llm_kwargs = llm_kwargs or {}
+        self.log_dir = log_dir
+        self.pipeline_mode = pipeline_mode
+        self.resume = resume
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.threads_per_worker = threads_per_worker
+
+    def run(self, scenarios: List[ScenarioSpec]) -> Dict[str, Any]:
+        if self.kb is None:
+            self.kb = InterviewKnowledgeBase()
+        self.kb.freeze()
+        _SHARED.update(kb=self.kb, llm_kwargs=self.llm_kwargs, log_dir=self.log_dir, pipeline_mode=self.pipeline_mode,
+                       resume=self.resume)
+        parent_memory = process_memory()
+        # Всё загруженное к этому моменту - в постоянное поколение, GC воркеров его не обходит
+        gc.collect()
+        gc.freeze()
+
+        started = time.perf_counter()
+        context = multiprocessing.get_context("fork")
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                     initializer=_init_worker, initargs=(self.threads_per_worker,)) as pool:
+                results = list(pool.map(_run_in_worker, scenarios))
+        finally:
+            gc.unfreeze()
+        total = time.perf_counter() - started
+
+        workers: Dict[int, Dict[str, float]] = {}
+        for r in results:
+            # Последний замер воркера - после его последнего сценария
+            workers[r.pop("worker_pid")] = r.pop("worker_memory")
+        print(f"\n=== Прогон завершен: {len(results)} сценариев, {self.workers} процессов, {total:.2f} c ===")
+        for r in results:
+            print(f"  [{r['status']}] {r['id']} ({r['title']}): {r['duration_sec']:.2f} c")
+        print(f"Parent (model + KB): {parent_memory}")
+        for pid, memory in sorted(workers.items()):
+            print(f"  worker {pid}: {memory}")
+        return {
+            "scenarios": results,
+            "wall_sec": round(total, 3),
+            "memory": {"parent": parent_memory, "workers": {str(pid): m for pid, m in workers.items()}},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run interview scenarios in pre-forked worker processes.")
+    parser.add_argument("--workers", type=int, default=config.PREFORK_WORKERS)
+    parser.add_argument("--threads", type=int, help="Torch threads per worker (default: cores / workers).")
+    parser.add_argument("--dir", default=str(config.SCENARIOS_DIR), help="Folder with scenario JSON files.")
+    parser.add_argument("--runner", choices=["final_test", "structured"], help="Run only scenarios of this runner.")
+    parser.add_argument("--only", nargs="*", help="Scenario ids to run.")
+    parser.add_argument("--mode", choices=["multi", "fused"], help="Analysis pipeline mode (default: PIPELINE_MODE).")
+    parser.add_argument("--stub", action="store_true", help="Use the local deterministic stub LLM server.")
+    parser.add_argument("--stub-latency", default=str(config.STUB_LLM_LATENCY))
+    parser.add_argument("--log-dir", help="Where to write interview logs.")
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.dir, runner=args.runner, only=args.only)
+    stub = None
+    llm_kwargs: Dict[str, Any] = {}
+    log_dir = args.log_dir
+    if args.stub:
+        from stub_llm import StubLLMServer
+        # Сервер живет в родителе, воркеры ходят к нему по HTTP
+        stub = StubLLMServer(latency=args.stub_latency).start()
+        llm_kwargs = {"base_url": stub.base_url, "api_key": "stub", "model": "stub"}
+        log_dir = log_dir or str(config.STUB_LOG_DIR)
+    try:
+        PreforkPool(args.workers, llm_kwargs=llm_kwargs, log_dir=log_dir, pipeline_mode=args.mode,
+                    threads_per_worker=args.threads).run(scenarios)
+    finally:
+        if stub is not None:
+            stub.stop()
+
+
+if __name__ == "__main__":
+    main()